@@ -0,0 +1,255 @@
+# codingapp/comparators.py
+"""
+Streaming output comparators (one per Question.output_policy).
+
+A comparator is fed the program's stdout chunk by chunk while it runs and
+keeps only what it needs to decide (the current partial line/token, or the
+remaining expected lines for "unordered"). As soon as the output can no longer
+match, feed() returns False and the runner (sandbox.communicate) kills the
+program after capturing a little context, instead of buffering everything and
+comparing afterwards.
+
+Policies:
+    exact       output lines must equal the expected lines, leading whitespace
+                and blank lines included (trailing spaces and trailing blank
+                lines are ignored; build the expected side with comparator_lines)
+    whitespace  same whitespace-separated tokens in the same order (default;
+                accepts everything the old line/joined comparison accepted)
+    float       like whitespace, but numeric tokens match within `epsilon`
+                (absolute for |x| <= 1, relative above)
+    unordered   same non-blank lines in any order
+
+Usage:
+    comparator = make_comparator(["3", "7"], policy="float", epsilon=1e-6)
+    comparator.feed("3.0000001\\n")      # True: still possibly matching
+    comparator.feed("8\\n")              # False: mismatch, stop the program
+    comparator.finish()                 # -> False; comparator.mismatch explains why
+
+Like sandbox.py this module must not import Django or anything from codingapp:
+the warm judge worker imports it directly.
+"""
+
+import math
+from collections import Counter
+from typing import List
+
+POLICY_EXACT = "exact"
+POLICY_WHITESPACE = "whitespace"
+POLICY_FLOAT = "float"
+POLICY_UNORDERED = "unordered"
+POLICIES = (POLICY_EXACT, POLICY_WHITESPACE, POLICY_FLOAT, POLICY_UNORDERED)
+DEFAULT_POLICY = POLICY_WHITESPACE
+DEFAULT_EPSILON = 1e-6
+
+# Output still captured after the first mismatch, so the error message shows some context
+CONTEXT_BYTES = 256
+
+
+def _preview(text: str, limit: int = 60) -> str:
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class OutputComparator:
+    """Base class: splits the stream into lines and hands complete lines to _line()."""
+
+    policy = None
+
+    def __init__(self, expected_lines: List[str], epsilon: float = DEFAULT_EPSILON):
+        self.expected_lines = list(expected_lines)
+        self.epsilon = float(epsilon)
+        self.ok = True
+        self.finished = False
+        self.mismatch = ""
+        self._partial = ""
+
+    def spec(self) -> dict:
+        """Constructor arguments, so a judge worker can build the same comparator."""
+        return {"policy": self.policy, "expected_lines": self.expected_lines, "epsilon": self.epsilon}
+
+    def feed(self, text: str) -> bool:
+        """Consume a chunk of stdout. Returns False once the output cannot match anymore."""
+        if not self.ok or not text:
+            return self.ok
+        text = self._partial + text.replace("\r\n", "\n")
+        lines = text.split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            if not self._line(line):
+                break
+        return self.ok
+
+    def finish(self) -> bool:
+        """Output is complete; returns whether it matched."""
+        if not self.finished:
+            if self.ok and self._partial:
+                self._line(self._partial)
+            self._partial = ""
+            if self.ok:
+                self._end()
+            self.finished = True
+        return self.ok
+
+    def check(self, stdout: str) -> bool:
+        """Compare a complete, already collected output."""
+        self.feed(stdout or "")
+        return self.finish()
+
+    def state(self) -> dict:
+        return {"ok": self.ok, "finished": self.finished, "mismatch": self.mismatch}
+
+    def adopt(self, state: dict):
+        """Take over the verdict of a comparator that ran elsewhere (a judge worker)."""
+        if not state:
+            return
+        self.ok = bool(state.get("ok", True))
+        self.finished = bool(state.get("finished", False))
+        self.mismatch = state.get("mismatch") or ""
+
+    def _fail(self, message: str) -> bool:
+        self.ok = False
+        self.mismatch = message
+        return False
+
+    def _line(self, line: str) -> bool:
+        raise NotImplementedError
+
+    def _end(self):
+        raise NotImplementedError
+
+
+class ExactComparator(OutputComparator):
+    policy = POLICY_EXACT
+
+    def __init__(self, expected_lines, epsilon=DEFAULT_EPSILON):
+        super().__init__(expected_lines, epsilon)
+        self._index = 0
+
+    def _line(self, line):
+        line = line.rstrip()
+        if self._index >= len(self.expected_lines):
+            if line:
+                return self._fail(f"unexpected extra line {self._index + 1}: {_preview(line)!r}")
+            return True
+        expected = self.expected_lines[self._index]
+        if line != expected:
+            return self._fail(f"line {self._index + 1} differs: expected {_preview(expected)!r}, "
+                              f"got {_preview(line)!r}")
+        self._index += 1
+        return True
+
+    def _end(self):
+        if self._index < len(self.expected_lines):
+            self._fail(f"output ended after {self._index} of {len(self.expected_lines)} lines")
+
+
+class WhitespaceComparator(OutputComparator):
+    policy = POLICY_WHITESPACE
+
+    def __init__(self, expected_lines, epsilon=DEFAULT_EPSILON):
+        super().__init__(expected_lines, epsilon)
+        self._expected_tokens = " ".join(self.expected_lines).split()
+        self._index = 0
+
+    def feed(self, text):
+        # tokens, unlike lines, can be checked as soon as the next whitespace arrives
+        if not self.ok or not text:
+            return self.ok
+        text = self._partial + text
+        tokens = text.split()
+        self._partial = "" if text[-1:].isspace() or not tokens else tokens.pop()
+        for token in tokens:
+            if not self._token(token):
+                break
+        return self.ok
+
+    def _line(self, line):
+        for token in line.split():
+            if not self._token(token):
+                return False
+        return True
+
+    def _token(self, token):
+        if self._index >= len(self._expected_tokens):
+            return self._fail(f"unexpected extra output {_preview(token)!r}")
+        expected = self._expected_tokens[self._index]
+        if not self._same(token, expected):
+            return self._fail(f"token {self._index + 1} differs: expected {_preview(expected)!r}, "
+                              f"got {_preview(token)!r}")
+        self._index += 1
+        return True
+
+    def _same(self, token, expected):
+        return token == expected
+
+    def _end(self):
+        if self._index < len(self._expected_tokens):
+            self._fail(f"output ended after {self._index} of {len(self._expected_tokens)} tokens")
+
+
+class FloatComparator(WhitespaceComparator):
+    policy = POLICY_FLOAT
+
+    def _same(self, token, expected):
+        if token == expected:
+            return True
+        try:
+            got, want = float(token), float(expected)
+        except ValueError:
+            return False
+        if not (math.isfinite(got) and math.isfinite(want)):
+            return False
+        return abs(got - want) <= self.epsilon * max(1.0, abs(want))
+
+
+class UnorderedComparator(OutputComparator):
+    policy = POLICY_UNORDERED
+
+    def __init__(self, expected_lines, epsilon=DEFAULT_EPSILON):
+        super().__init__(expected_lines, epsilon)
+        self._remaining = Counter(line.strip() for line in self.expected_lines if line.strip())
+
+    def _line(self, line):
+        line = line.strip()
+        if not line:
+            return True
+        if self._remaining[line] <= 0:
+            return self._fail(f"unexpected line {_preview(line)!r}")
+        self._remaining[line] -= 1
+        return True
+
+    def _end(self):
+        missing = sorted(+self._remaining)
+        if missing:
+            self._fail(f"missing {sum(self._remaining.values())} line(s), e.g. {_preview(missing[0])!r}")
+
+
+_COMPARATORS = {
+    POLICY_EXACT: ExactComparator,
+    POLICY_WHITESPACE: WhitespaceComparator,
+    POLICY_FLOAT: FloatComparator,
+    POLICY_UNORDERED: UnorderedComparator,
+}
+
+
+def comparator_lines(expected, policy: str = None) -> List[str]:
+    """
+    Expected output (a string or a list of lines) as the comparator for `policy`
+    compares it. "exact" keeps leading whitespace and inner blank lines and,
+    like on the output side, drops only trailing spaces and trailing blank
+    lines; the other policies get the stripped, non-blank lines.
+    """
+    if isinstance(expected, str):
+        expected = expected.replace("\r\n", "\n").split("\n")
+    lines = [str(x) for x in (expected or [])]
+    if (policy or DEFAULT_POLICY).lower() != POLICY_EXACT:
+        return [line.strip() for line in lines if line.strip()]
+    lines = [part.rstrip() for line in lines for part in line.replace("\r\n", "\n").split("\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def make_comparator(expected_lines: List[str], policy: str = None, epsilon: float = None) -> OutputComparator:
+    """Comparator for `policy` (unknown/empty policies fall back to DEFAULT_POLICY)."""
+    cls = _COMPARATORS.get((policy or DEFAULT_POLICY).lower(), _COMPARATORS[DEFAULT_POLICY])
+    return cls(expected_lines, DEFAULT_EPSILON if epsilon is None else epsilon)
@@ -0,0 +1,38 @@
+# codingapp/consumers.py
+"""
+WebSocket consumers.
+
+LeaderboardConsumer (ws/assessments/<id>/leaderboard/) streams the rank/score
+deltas of an assessment's leaderboard (leaderboard_live.publish_entries) to
+teacher dashboards; the page itself is still rendered by assessment_leaderboard.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from .leaderboard_live import ensure_loaded, group_name
+from .models import Assessment
+
+
+class LeaderboardConsumer(JsonWebsocketConsumer):
+
+    def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated or not user.is_staff:
+            self.close()
+            return
+        assessment = Assessment.objects.filter(pk=int(self.scope["url_route"]["kwargs"]["assessment_id"])).first()
+        if assessment is None:
+            self.close()
+            return
+        ensure_loaded(assessment)
+        self.group = group_name(assessment.id)
+        async_to_sync(self.channel_layer.group_add)(self.group, self.channel_name)
+        self.accept()
+
+    def disconnect(self, code):
+        if getattr(self, "group", None):
+            async_to_sync(self.channel_layer.group_discard)(self.group, self.channel_name)
+
+    def leaderboard_delta(self, event):
+        self.send_json({"assessment_id": event["assessment_id"], "rows": event["rows"]})
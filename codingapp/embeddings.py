@@ -0,0 +1,163 @@
+# codingapp/embeddings.py
+"""
+Embedding similarity for plagiarism: hashed token n-gram TF-IDF vectors and an
+in-process nearest-neighbour index per (assessment, question).
+
+compute_ensemble_plagiarism used to copy the structural score into its
+embedding slot. Instead every AssessmentSubmission gets a code vector
+(AssessmentSubmission.embedding): counts of its 1-3 token n-grams hashed into
+EMBEDDING_DIM buckets, stored sparse. They are computed in batches by the
+tasks.compute_submission_embeddings Celery task, not while grading.
+
+Weighting happens per question, where the IDF is meaningful (boilerplate every
+student writes gets ~no weight):
+
+    index = get_embedding_index(assessment_id, question_id)
+    index.neighbours(embedding, k=5, exclude_user_id=user.id)   # [(submission_id, cosine), ...]
+    index.best_similarities()                                   # {submission_id: best cosine vs. other students}
+
+An index is a dense, L2-normalised float32 matrix, so a top-k query is one
+matrix-vector product (well under a millisecond for a few thousand
+submissions; exact, which at these sizes is cheaper than an approximate
+structure). Indexes are cached per process and rebuilt when the question's
+embedded submissions change.
+"""
+
+import base64
+import math
+import struct
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import AssessmentSubmission
+from .utils import normalize_code, tokenize_code
+
+EMBEDDING_PREFIX = "ev1:"
+EMBEDDING_DIM = 1024
+EMBEDDING_NGRAMS = (1, 2, 3)
+_COUNT_MAX = 0xFFFF
+
+
+def code_embedding(code: str) -> Dict[int, int]:
+    """Hashed token n-gram counts of `code` (comments stripped): {bucket: count}."""
+    tokens = tokenize_code(normalize_code(code or ""))
+    counts = Counter()
+    for n in EMBEDDING_NGRAMS:
+        for i in range(len(tokens) - n + 1):
+            counts[zlib.crc32(" ".join(tokens[i:i + n]).encode("utf-8")) % EMBEDDING_DIM] += 1
+    return dict(counts)
+
+
+def encode_embedding(embedding: Dict[int, int]) -> str:
+    """Stored form: prefix + base64 of sorted (bucket, count) uint16 pairs."""
+    items = sorted(embedding.items())
+    flat = [v for bucket, count in items for v in (bucket, min(count, _COUNT_MAX))]
+    return EMBEDDING_PREFIX + base64.b64encode(struct.pack(f">{len(flat)}H", *flat)).decode("ascii")
+
+
+def decode_embedding(value: Optional[str]) -> Optional[Dict[int, int]]:
+    """Inverse of encode_embedding; None when `value` is empty or not in the stored format."""
+    if not value or not value.startswith(EMBEDDING_PREFIX):
+        return None
+    try:
+        raw = base64.b64decode(value[len(EMBEDDING_PREFIX):])
+        flat = struct.unpack(f">{len(raw) // 2}H", raw)
+    except (ValueError, struct.error):
+        return None
+    return dict(zip(flat[0::2], flat[1::2]))
+
+
+def tf_matrix(embeddings: List[Dict[int, int]]) -> np.ndarray:
+    """Sublinear term frequencies (1 + log count) as an n x EMBEDDING_DIM matrix."""
+    matrix = np.zeros((len(embeddings), EMBEDDING_DIM), dtype=np.float32)
+    for row, embedding in enumerate(embeddings):
+        for bucket, count in (embedding or {}).items():
+            if 0 <= bucket < EMBEDDING_DIM and count > 0:
+                matrix[row, bucket] = 1.0 + math.log(count)
+    return matrix
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class EmbeddingIndex:
+    """TF-IDF vectors of one (assessment, question)'s submissions, queried by cosine similarity."""
+
+    def __init__(self, submission_ids: List[int], user_ids: List[int], embeddings: List[Dict[int, int]]):
+        self.submission_ids = np.asarray(submission_ids, dtype=np.int64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        tf = tf_matrix(embeddings)
+        df = np.count_nonzero(tf, axis=0)
+        # smoothed IDF, as in scikit-learn's TfidfVectorizer
+        self.idf = (np.log((1.0 + len(embeddings)) / (1.0 + df)) + 1.0).astype(np.float32)
+        self.vectors = _normalize_rows(tf * self.idf)
+
+    def __len__(self):
+        return len(self.submission_ids)
+
+    def neighbours(self, embedding: Dict[int, int], k: int = 5, exclude_user_id: Optional[int] = None,
+                   exclude_submission_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """The `k` most similar indexed submissions as (submission_id, cosine), best first."""
+        if not len(self) or k <= 0:
+            return []
+        query = _normalize_rows((tf_matrix([embedding]) * self.idf))[0]
+        scores = self.vectors @ query
+        if exclude_user_id is not None:
+            scores[self.user_ids == exclude_user_id] = -np.inf
+        if exclude_submission_id is not None:
+            scores[self.submission_ids == exclude_submission_id] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.submission_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def best_similarities(self) -> Dict[int, float]:
+        """submission id -> cosine similarity to the closest submission of another student (0 if none)."""
+        if not len(self):
+            return {}
+        scores = self.vectors @ self.vectors.T
+        scores[self.user_ids[:, None] == self.user_ids[None, :]] = -np.inf
+        best = np.maximum(scores.max(axis=1), 0.0)
+        return {int(sid): float(value) for sid, value in zip(self.submission_ids, best)}
+
+
+_indexes: "OrderedDict[Tuple[int, int], Tuple[tuple, EmbeddingIndex]]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_embedding_index(assessment_id: int, question_id: int) -> EmbeddingIndex:
+    """The (cached) index of the question's embedded submissions, rebuilt when they changed."""
+    rows = AssessmentSubmission.objects.filter(assessment_id=assessment_id, question_id=question_id,
+                                               embedding__isnull=False)
+    summary = rows.aggregate(count=Count("id"), latest=Max("updated_at"), last_id=Max("id"))
+    stamp = (summary["count"], summary["latest"], summary["last_id"])
+    key = (assessment_id, question_id)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == stamp:
+            _indexes.move_to_end(key)
+            return cached[1]
+
+    ids, users, embeddings = [], [], []
+    for submission_id, user_id, stored in rows.values_list("id", "user_id", "embedding"):
+        embedding = decode_embedding(stored)
+        if embedding is not None:
+            ids.append(submission_id)
+            users.append(user_id)
+            embeddings.append(embedding)
+    index = EmbeddingIndex(ids, users, embeddings)
+
+    with _indexes_lock:
+        _indexes[key] = (stamp, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > getattr(settings, "EMBEDDING_INDEX_CACHE_SIZE", 64):
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,223 @@
+# codingapp/fingerprint_index.py
+"""
+Persisted winnowing fingerprints, their inverted index and MinHash LSH buckets.
+
+Plagiarism checks used to re-tokenize and re-fingerprint up to
+PLAGIARISM_COMPARE_LIMIT peer submissions on every submit. Instead each
+AssessmentSubmission stores its fingerprint once (AssessmentSubmission.fingerprint,
+utils.encode_fingerprint), along with its structural sequence (AST node types
+for Python, token classes for the C family; ast_sequence), and every hash gets a FingerprintHash row, so:
+
+    fingerprint = index_submission(submission)            # after saving a submission
+    matches = find_candidates(assessment_id, question_id, fingerprint, exclude_user_id=user.id)
+    # -> [(submission_id, shared_hashes, token_similarity), ...] best first
+
+find_candidates answers from the index alone: the token (winnowing Jaccard)
+similarity needs only the number of shared hashes and each peer's fingerprint
+size, which is read from the stored form without decoding it.
+
+Each submission is also filed under LSH_BANDS MinHash LSH buckets (LSHBucket,
+utils.lsh_band_keys). plagiarism_peers() uses them to pick the peers worth the
+expensive structural comparison: the likely matches among *all* submissions of
+the question, at the cost of one indexed lookup, instead of the newest N.
+
+Rows saved before the index existed are indexed lazily the first time their
+(assessment, question) is looked up (ensure_indexed), or in bulk with
+`python manage.py build_fingerprint_index`.
+"""
+
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import AssessmentSubmission, FingerprintHash, LSHBucket
+from .utils import (AST_SEQUENCE_PREFIX, FINGERPRINT_PREFIX, code_features, decode_ast_sequence,
+                    decode_fingerprint, encode_ast_sequence, encode_fingerprint, fingerprint_similarity,
+                    fingerprint_size, lsh_band_keys, minhash_signature)
+
+logger = logging.getLogger(__name__)
+
+# hashes per IN (...) lookup; stays well below SQLite's variable limit
+LOOKUP_CHUNK = 500
+BULK_BATCH_SIZE = 1000
+# Groups with at most this many peers are compared exhaustively (cheaper than being clever)
+DEFAULT_EXHAUSTIVE_BELOW = 50
+# Best inverted-index matches (token similarity >= INDEX_MIN_SIMILARITY) always compared,
+# in case their similarity is below what LSH reliably catches
+INDEX_CANDIDATES = 20
+INDEX_MIN_SIMILARITY = 0.2
+
+
+def to_signed(value: int) -> int:
+    """Unsigned 64-bit hash -> the signed value a BigIntegerField can hold."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value: int) -> int:
+    """Inverse of to_signed."""
+    return value + (1 << 64) if value < 0 else value
+
+
+def indexed_fingerprint(submission_id: int) -> set:
+    """The fingerprint the index currently holds for a submission (empty if it has no FingerprintHash rows)."""
+    return {to_unsigned(h) for h in FingerprintHash.objects.filter(submission_id=submission_id)
+            .values_list("hash", flat=True)}
+
+
+def index_submission(submission: AssessmentSubmission, fingerprint: Optional[set] = None,
+                     ast_sequence: Optional[List[int]] = None) -> set:
+    """
+    Store `submission`'s fingerprint and structural sequence (computed from
+    its code and language unless given) and replace its FingerprintHash and LSHBucket rows.
+    Returns the fingerprint set.
+    """
+    features = code_features(submission.code)
+    if fingerprint is None:
+        fingerprint = features.fingerprint
+    if ast_sequence is None:
+        ast_sequence = features.structure(submission.language)
+    encoded = encode_fingerprint(fingerprint)
+    encoded_ast = encode_ast_sequence(ast_sequence)
+    scope = {"assessment_id": submission.assessment_id, "question_id": submission.question_id,
+             "submission_id": submission.pk}
+    with transaction.atomic():
+        # queryset update: don't bump updated_at or re-run save() logic
+        AssessmentSubmission.objects.filter(pk=submission.pk).update(fingerprint=encoded, ast_sequence=encoded_ast)
+        FingerprintHash.objects.filter(submission_id=submission.pk).delete()
+        FingerprintHash.objects.bulk_create(
+            [FingerprintHash(hash=to_signed(h), **scope) for h in fingerprint],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        LSHBucket.objects.filter(submission_id=submission.pk).delete()
+        LSHBucket.objects.bulk_create(
+            [LSHBucket(bucket=key, **scope) for key in set(lsh_band_keys(minhash_signature(fingerprint)))],
+        )
+    submission.fingerprint = encoded
+    submission.ast_sequence = encoded_ast
+    return fingerprint
+
+
+def submission_fingerprint(submission: AssessmentSubmission) -> set:
+    """The stored fingerprint, computing and indexing it first if the row predates the index."""
+    stored = decode_fingerprint(submission.fingerprint)
+    if stored is not None:
+        return stored
+    return index_submission(submission)
+
+
+def ensure_indexed(assessment_id: int, question_id: int) -> int:
+    """Index the (assessment, question) submissions missing a stored fingerprint, structural sequence or LSH buckets; returns how many."""
+    missing = (
+        AssessmentSubmission.objects
+        .filter(assessment_id=assessment_id, question_id=question_id)
+        .filter(Q(fingerprint__isnull=True) | ~Q(ast_sequence__startswith=AST_SEQUENCE_PREFIX)
+                | Q(lsh_buckets__isnull=True))
+        # empty code has an empty fingerprint and no buckets: nothing to do
+        .exclude(fingerprint=FINGERPRINT_PREFIX, ast_sequence__startswith=AST_SEQUENCE_PREFIX)
+        .distinct()
+        .only("id", "assessment_id", "question_id", "code", "language")
+    )
+    count = 0
+    for submission in missing.iterator():
+        index_submission(submission)
+        count += 1
+    if count:
+        logger.info("Indexed %d fingerprints for assessment=%s question=%s", count, assessment_id, question_id)
+    return count
+
+
+def shared_hash_counts(assessment_id: int, question_id: int, fingerprint: Iterable[int]) -> Dict[int, int]:
+    """submission id -> number of `fingerprint` hashes it shares, from the index."""
+    hashes = [to_signed(h) for h in fingerprint]
+    counts = Counter()
+    for start in range(0, len(hashes), LOOKUP_CHUNK):
+        rows = FingerprintHash.objects.filter(
+            assessment_id=assessment_id, question_id=question_id, hash__in=hashes[start:start + LOOKUP_CHUNK],
+        ).values_list("submission_id", flat=True)
+        counts.update(rows)
+    return counts
+
+
+def find_candidates(assessment_id: int, question_id: int, fingerprint: set,
+                    exclude_user_id: Optional[int] = None, exclude_submission_id: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[Tuple[int, int, float]]:
+    """
+    Submissions of (assessment, question) sharing at least one hash with
+    `fingerprint`, as (submission_id, shared_hashes, token_similarity) sorted
+    by similarity (best first), at most `limit` of them.
+    """
+    if not fingerprint:
+        return []
+    ensure_indexed(assessment_id, question_id)
+    counts = shared_hash_counts(assessment_id, question_id, fingerprint)
+    if exclude_submission_id is not None:
+        counts.pop(exclude_submission_id, None)
+    if not counts:
+        return []
+
+    peers = AssessmentSubmission.objects.filter(pk__in=list(counts))
+    if exclude_user_id is not None:
+        peers = peers.exclude(user_id=exclude_user_id)
+
+    candidates = []
+    for submission_id, stored in peers.values_list("id", "fingerprint"):
+        shared = counts[submission_id]
+        union = len(fingerprint) + fingerprint_size(stored) - shared
+        candidates.append((submission_id, shared, shared / union if union > 0 else 0.0))
+    candidates.sort(key=lambda c: (-c[2], -c[1], c[0]))
+    return candidates[:limit] if limit else candidates
+
+
+def lsh_candidates(assessment_id: int, question_id: int, fingerprint: set,
+                   exclude_user_id: Optional[int] = None) -> Dict[int, int]:
+    """submission id -> number of LSH buckets it shares with `fingerprint` (indexed submissions only)."""
+    keys = lsh_band_keys(minhash_signature(fingerprint))
+    if not keys:
+        return {}
+    rows = LSHBucket.objects.filter(assessment_id=assessment_id, question_id=question_id, bucket__in=keys)
+    if exclude_user_id is not None:
+        rows = rows.exclude(submission__user_id=exclude_user_id)
+    return Counter(rows.values_list("submission_id", flat=True))
+
+
+def plagiarism_peers(assessment_id: int, question_id: int, user_id: int, fingerprint: set,
+                     limit: Optional[int] = None,
+                     exhaustive_below: int = DEFAULT_EXHAUSTIVE_BELOW
+                     ) -> List[Tuple[int, str, Optional[set], Optional[List[int]]]]:
+    """
+    Other students' submissions to compare new code with, as (submission_id,
+    code, fingerprint, AST sequence) tuples sorted by token similarity (best
+    first), at most `limit` of them.
+
+    Every peer of the question is considered: with more than `exhaustive_below`
+    peers only the likely matches are returned, i.e. those sharing an LSH
+    bucket with `fingerprint` plus the best INDEX_CANDIDATES inverted-index
+    matches above INDEX_MIN_SIMILARITY.
+    """
+    ensure_indexed(assessment_id, question_id)
+    peers = (
+        AssessmentSubmission.objects
+        .filter(assessment_id=assessment_id, question_id=question_id)
+        .exclude(user_id=user_id)
+    )
+    if peers.count() > exhaustive_below:
+        chosen = set(lsh_candidates(assessment_id, question_id, fingerprint, exclude_user_id=user_id))
+        chosen.update(sid for sid, _, similarity in find_candidates(assessment_id, question_id, fingerprint,
+                                                                    exclude_user_id=user_id, limit=INDEX_CANDIDATES)
+                      if similarity >= INDEX_MIN_SIMILARITY)
+        peers = peers.filter(pk__in=chosen)
+
+    ranked = []
+    for peer_id, peer_code, stored, stored_ast in peers.values_list("id", "code", "fingerprint", "ast_sequence"):
+        if not peer_code:
+            continue
+        peer_fingerprint = decode_fingerprint(stored)
+        similarity = fingerprint_similarity(fingerprint, peer_fingerprint) if peer_fingerprint else 0.0
+        ranked.append((similarity, peer_id, peer_code, peer_fingerprint, decode_ast_sequence(stored_ast)))
+    ranked.sort(key=lambda peer: peer[0], reverse=True)
+    if limit:
+        ranked = ranked[:limit]
+    return [peer[1:] for peer in ranked]
@@ -56,14 +56,34 @@ class QuestionForm(forms.ModelForm):
 
     class Meta:
         model = Question
-        fields = ['title', 'description', 'module', 'question_type', 'options', 'correct_answer']
+        fields = ['title', 'description', 'module', 'question_type', 'options', 'correct_answer',
+                  'output_policy', 'float_tolerance']
         widgets = {
             "title": forms.TextInput(attrs={"class": "form-control"}),
             "description": forms.Textarea(attrs={"class": "form-control", "rows": 3}),
             "module": forms.Select(attrs={"class": "form-control"}),
             "question_type": forms.Select(attrs={"class": "form-control"}),
+            "output_policy": forms.Select(attrs={"class": "form-control"}),
+            "float_tolerance": forms.NumberInput(attrs={"class": "form-control", "step": "any"}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Optional in the form; blank means the model default
+        self.fields['output_policy'].required = False
+        self.fields['float_tolerance'].required = False
+
+    def clean_output_policy(self):
+        return self.cleaned_data.get('output_policy') or Question._meta.get_field('output_policy').default
+
+    def clean_float_tolerance(self):
+        value = self.cleaned_data.get('float_tolerance')
+        if value is None:
+            return Question._meta.get_field('float_tolerance').default
+        if value < 0:
+            raise forms.ValidationError("Tolerance cannot be negative.")
+        return value
+
     def clean_options(self):
         data = self.cleaned_data.get('options', '').strip()
         if not data:
@@ -0,0 +1,418 @@
+# codingapp/judge_benchmark.py
+"""
+Benchmark / regression harness for the judge (`python manage.py judge_benchmark`).
+
+Drives the real judging entry points with synthetic Python submissions and
+questions over a matrix of test-case counts and code sizes, and reports per
+cell latency percentiles (p50/p95/p99), throughput (submissions per second,
+per core and per CPU second) and peak RSS:
+
+    check_test_cases   tasks_helpers.check_test_cases (subprocess per test)
+    run_judge          tasks._run_judge, the path Celery uses (compile-once, warm pool)
+    fallback           tasks._fallback_check_test_cases against a local Piston stub
+    practice           tasks.process_practice_submission (DB rows included)
+    assessment         tasks.process_assessment_submission, then its deferred
+                       check_assessment_plagiarism (vs. `peers`), back to back
+
+Every submission's source is unique (a tagged header comment), so neither the
+judge result cache nor the output cache can answer it; pass warm=True to
+resubmit identical code and measure the cached path instead.
+
+Database scenarios create their user/question/assessment rows (usernames and
+titles start with "judge-benchmark") and delete them again afterwards.
+
+Reports are plain dicts (JSON-serializable); compare_reports() lists the cells
+whose p95 latency or throughput got worse than a previous report by more than
+a threshold.
+"""
+
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows: no rusage, RSS is reported as unavailable (None)
+    resource = None
+
+SCENARIOS = ("check_test_cases", "run_judge", "fallback", "practice", "assessment")
+DEFAULT_TEST_CASES = (1, 20, 200)
+DEFAULT_CODE_LINES = (10, 200, 2000)
+DEFAULT_ITERATIONS = 3
+DEFAULT_PEERS = 20
+DEFAULT_THRESHOLD = 10.0  # percent
+
+NAME_PREFIX = "judge-benchmark"
+
+
+# ---------------------------
+# Synthetic workload
+# ---------------------------
+def synthetic_code(lines: int, tag: str = "") -> str:
+    """
+    A Python solution (prints the sum of the integers on stdin) padded with
+    helper functions to exactly max(lines, 10) lines.
+    """
+    head = [f"# {NAME_PREFIX} submission {tag}".rstrip(), "import sys", "", ""]
+    tail = [
+        "def main():",
+        "    values = [int(tok) for tok in sys.stdin.read().split()]",
+        "    print(sum(values))",
+        "",
+        "",
+        "main()",
+    ]
+    padding = []
+    while len(head) + len(padding) + len(tail) + 4 <= lines:
+        index = len(padding) // 4
+        padding += [f"def helper_{index}(x):", f"    y = x + {index}", f"    return y - {index}", ""]
+    padding += [""] * max(0, lines - len(head) - len(padding) - len(tail))
+    return "\n".join(head + padding + tail) + "\n"
+
+
+def synthetic_test_cases(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed * 1000003 + count)
+    cases = []
+    for _ in range(count):
+        values = [rng.randint(-1000, 1000) for _ in range(rng.randint(1, 20))]
+        cases.append({"input": " ".join(map(str, values)), "expected_output": [str(sum(values))]})
+    return cases
+
+
+# ---------------------------
+# Local Piston stub
+# ---------------------------
+class PistonStub:
+    """
+    Minimal Piston API on 127.0.0.1: /runtimes lists python, /execute answers
+    with the sum of the integers on stdin (what synthetic_code prints) after
+    `latency` seconds, without running anything.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        stub = self
+        self.latency = float(latency)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes; Nagle + delayed ACK would add ~40ms per request
+            disable_nagle_algorithm = True
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply([{"language": "python", "version": "3.11.0", "aliases": ["py"]}])
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                try:
+                    stdout = f"{sum(int(tok) for tok in str(payload.get('stdin', '')).split())}\n"
+                    run = {"stdout": stdout, "stderr": "", "code": 0}
+                except ValueError as exc:
+                    run = {"stdout": "", "stderr": str(exc), "code": 1}
+                self._reply({"language": payload.get("language"), "version": payload.get("version"), "run": run})
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/v2/piston/execute"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ---------------------------
+# Measurements
+# ---------------------------
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _entries(result) -> List[Dict[str, Any]]:
+    return (result.get("results") or []) if isinstance(result, dict) else []
+
+
+def _status(result) -> str:
+    """check_test_cases-style dicts carry "status", the Celery tasks "final_status"."""
+    if not isinstance(result, dict):
+        return "Error"
+    return result.get("final_status") or result.get("status") or "Error"
+
+
+def run_cell(submit: Callable[[int], dict], iterations: int, concurrency: int = 1) -> Dict[str, Any]:
+    """
+    Call submit(i) for i in range(iterations), `concurrency` at a time, and
+    summarize latency, throughput and resource usage. CPU time is this
+    process' own CPU plus the per-test CPU time the sandbox reported for the
+    submitted programs.
+    """
+    latencies = [0.0] * iterations
+    results = [None] * iterations
+
+    def _timed(i):
+        started = time.perf_counter()
+        try:
+            results[i] = submit(i)
+        except Exception as exc:
+            results[i] = {"status": "Error", "error": str(exc)}
+        latencies[i] = time.perf_counter() - started
+
+    cpu_before = _cpu_seconds()
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(iterations):
+            _timed(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="benchmark") as executor:
+            list(executor.map(_timed, range(iterations)))
+    wall = time.perf_counter() - started
+
+    entries = [e for r in results for e in _entries(r)]
+    cpu = _cpu_seconds() - cpu_before + sum(e.get("cpu_time") or 0 for e in entries)
+    cores = max(1, min(concurrency, os.cpu_count() or 1))
+    # the synthetic solutions are correct: anything but Accepted is a judge failure
+    failures = sum(1 for r in results if _status(r) != "Accepted")
+    return {
+        "submissions": iterations,
+        "failures": failures,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / iterations * 1000, 2) if iterations else 0.0,
+            "max": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "submissions_per_second": round(iterations / wall, 3) if wall else 0.0,
+        "submissions_per_second_per_core": round(iterations / wall / cores, 3) if wall else 0.0,
+        "submissions_per_cpu_second": round(iterations / cpu, 3) if cpu else 0.0,
+        # None when no run reported it (no rusage, or not attributable; see sandbox.py)
+        "peak_rss_kb": max((e["peak_rss_kb"] for e in entries if e.get("peak_rss_kb")), default=None),
+    }
+
+
+# ---------------------------
+# Scenarios
+# ---------------------------
+class _Fixtures:
+    """User/question/assessment rows for the database scenarios; delete() removes everything."""
+
+    def __init__(self, peers: int = 0):
+        from django.contrib.auth import get_user_model
+        from django.utils import timezone
+        from .models import Assessment
+
+        self.run_id = uuid.uuid4().hex[:8]
+        self.user_model = get_user_model()
+        self.users = [self._user("student")]
+        self.peer_users = [self._user(f"peer{i}") for i in range(peers)]
+        self.questions = []
+        now = timezone.now()
+        self.assessment = Assessment.objects.create(
+            title=f"{NAME_PREFIX} {self.run_id}", duration_minutes=60,
+            start_time=now - timezone.timedelta(hours=1), end_time=now + timezone.timedelta(hours=1),
+        )
+
+    def _user(self, name):
+        return self.user_model.objects.create_user(username=f"{NAME_PREFIX}-{self.run_id}-{name}",
+                                                   password=uuid.uuid4().hex)
+
+    def question(self, test_cases, code_lines):
+        from .models import AssessmentQuestion, AssessmentSubmission, Question
+
+        question = Question.objects.create(
+            title=f"{NAME_PREFIX} {self.run_id} {len(test_cases)}x{code_lines}",
+            description="Print the sum of the integers on stdin.",
+            test_cases=test_cases,
+        )
+        AssessmentQuestion.objects.create(assessment=self.assessment, question=question)
+        for i, peer in enumerate(self.peer_users):
+            AssessmentSubmission.objects.create(
+                assessment=self.assessment, question=question, user=peer,
+                code=synthetic_code(code_lines, f"peer {i}"), language="python",
+            )
+        self.questions.append(question)
+        return question
+
+    def delete(self):
+        for question in self.questions:
+            question.delete()
+        self.assessment.delete()
+        for user in self.users + self.peer_users:
+            user.delete()
+
+
+def _scenario_submitter(scenario: str, test_cases, code_lines: int, code_for: Callable[[int], str],
+                        fixtures: _Fixtures = None) -> Callable[[int], dict]:
+    from . import tasks, tasks_helpers
+
+    options = tasks._judge_options(False)
+    if scenario == "check_test_cases":
+        return lambda i: tasks_helpers.check_test_cases(code_for(i), "python", test_cases, **options)
+    if scenario == "run_judge":
+        return lambda i: tasks._run_judge(code_for(i), "python", test_cases, dict(options, compare=None))
+    if scenario == "fallback":
+        return lambda i: tasks._fallback_check_test_cases(code_for(i), "python", test_cases, **options)
+
+    question = fixtures.question(test_cases, code_lines)
+    user = fixtures.users[0]
+    if scenario == "practice":
+        return lambda i: tasks.process_practice_submission(user.id, question.id, code_for(i), "python")
+    if scenario == "assessment":
+        def submit(i):
+            result = tasks.process_assessment_submission(user.id, fixtures.assessment.id, question.id,
+                                                         code_for(i), "python")
+            tasks.check_assessment_plagiarism(result["submission_id"])
+            return result
+        return submit
+    raise ValueError(f"Unknown benchmark scenario: {scenario}")
+
+
+def run_benchmark(scenarios=SCENARIOS, test_case_counts=DEFAULT_TEST_CASES, code_lines=DEFAULT_CODE_LINES,
+                  iterations: int = DEFAULT_ITERATIONS, concurrency: int = 1, peers: int = DEFAULT_PEERS,
+                  warm: bool = False, piston_latency: float = 0.0,
+                  progress: Callable[[str], None] = None) -> Dict[str, Any]:
+    """Run every scenario over the (test cases x code lines) matrix and return the report dict."""
+    from unittest import mock
+
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    from . import tasks
+
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark scenario(s): {', '.join(unknown)}")
+
+    cells = []
+    fixtures = _Fixtures(peers) if {"practice", "assessment"} & set(scenarios) else None
+    try:
+        # embeddings are computed by a separate Celery task, outside the measured path (and no broker here);
+        # the plagiarism phase is run inline by the assessment submitter
+        with PistonStub(piston_latency) as stub, override_settings(PISTON_API_URL=stub.url), \
+                mock.patch.object(tasks.compute_submission_embeddings, "delay"), \
+                mock.patch.object(tasks.check_assessment_plagiarism, "delay"):
+            for scenario in scenarios:
+                for count in test_case_counts:
+                    test_cases = synthetic_test_cases(count)
+                    for lines in code_lines:
+                        run_tag = uuid.uuid4().hex[:8]
+                        if warm:
+                            code = synthetic_code(lines, run_tag)
+                            code_for = lambda i, code=code: code
+                        else:
+                            code_for = lambda i, lines=lines, run_tag=run_tag: synthetic_code(lines, f"{run_tag}-{i}")
+                        submit = _scenario_submitter(scenario, test_cases, lines, code_for, fixtures)
+                        cell = {"scenario": scenario, "test_cases": count, "code_lines": lines}
+                        cell.update(run_cell(submit, iterations, concurrency))
+                        cells.append(cell)
+                        if progress:
+                            progress(f"{scenario} tests={count} lines={lines}: "
+                                     f"p95={cell['latency_ms']['p95']}ms "
+                                     f"{cell['submissions_per_second']}/s failures={cell['failures']}")
+    finally:
+        if fixtures is not None:
+            fixtures.delete()
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF) if resource is not None else None
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN) if resource is not None else None
+    return {
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "options": {
+            "scenarios": list(scenarios),
+            "test_cases": list(test_case_counts),
+            "code_lines": list(code_lines),
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "peers": peers,
+            "warm": warm,
+            "piston_latency": piston_latency,
+        },
+        "settings": {
+            name: getattr(settings, name, None)
+            for name in ("JUDGE_POOL_ENABLED", "JUDGE_POOL_SIZE", "JUDGE_MAX_PARALLEL_TESTS",
+                         "JUDGE_TOTAL_TIMEOUT", "JUDGE_RESULT_CACHE_BACKEND", "JUDGE_OUTPUT_CACHE_MAX_BYTES")
+        },
+        "results": cells,
+        "process": {
+            "peak_rss_kb": self_usage.ru_maxrss if self_usage else None,
+            "children_peak_rss_kb": children_usage.ru_maxrss if children_usage else None,
+        },
+    }
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any],
+                    threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Cells (matched by scenario, test cases and code lines) whose p95 latency
+    rose, or whose submissions/second fell, by more than `threshold` percent.
+    """
+    def _key(cell):
+        return cell.get("scenario"), cell.get("test_cases"), cell.get("code_lines")
+
+    before = {_key(cell): cell for cell in baseline.get("results") or []}
+    regressions = []
+    for cell in current.get("results") or []:
+        old = before.get(_key(cell))
+        if old is None:
+            continue
+        checks = (
+            ("p95_ms", old["latency_ms"]["p95"], cell["latency_ms"]["p95"], 1),
+            ("submissions_per_second", old["submissions_per_second"], cell["submissions_per_second"], -1),
+        )
+        for metric, was, now, direction in checks:
+            if not was:
+                continue
+            change = (now - was) / was * 100.0
+            if change * direction > threshold:
+                regressions.append({
+                    "scenario": cell["scenario"], "test_cases": cell["test_cases"],
+                    "code_lines": cell["code_lines"], "metric": metric,
+                    "baseline": was, "current": now, "change_pct": round(change, 1),
+                })
+    return regressions
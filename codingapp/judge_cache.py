@@ -0,0 +1,295 @@
+# codingapp/judge_cache.py
+"""
+Content-addressed cache of judge results.
+
+Students resubmit byte-identical code all the time (and teachers re-run it),
+and every resubmission used to execute every test case again. A judge result
+only depends on the code, the question's test cases and the language, so we
+key the full check_test_cases result dict on:
+
+    (digest of normalized code, digest of the test cases + output policy, language, mode)
+
+Editing a question's test cases (or its output policy) changes that digest,
+so results judged against the old test cases can never be returned again
+(they simply age out of the backend). Results that depend on timing or infrastructure (timeouts,
+the wall-clock budget, Piston errors, top-level runner errors) are never stored.
+
+Backends (settings.JUDGE_RESULT_CACHE_BACKEND):
+    "locmem"  per-process LRU (default)
+    "django"  the Django cache named by JUDGE_RESULT_CACHE_ALIAS (default "default")
+    "redis"   Redis at JUDGE_RESULT_CACHE_REDIS_URL (shared by all Celery workers)
+    ""        disabled
+
+Every backend counts hits and misses; get_judge_result_cache().stats() reports
+them. `python manage.py judge_cache_stats` runs in its own process, so it only
+reports counters kept in a shared store (redis, or django over a shared cache)
+and refuses the per-process ones (locmem, django over LocMemCache).
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "judge:result:v1"
+STATS_KEY = "judge:result:v1:stats"
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 2048
+
+# error_message prefixes of entries whose outcome depends on timing/infrastructure
+# (the runs output_cache and the native artifact cache refuse to store, too)
+_UNCACHEABLE_PREFIXES = ("Timed out", "Not run:", "Piston API Error", "Piston backend",
+                         "Compilation timed out", "Compiler crashed", "Runner error", "Killed by signal")
+
+
+def normalize_code(code: str) -> str:
+    """Whitespace changes that never change behaviour: line endings and trailing blank space at EOF."""
+    code = "" if code is None else str(code)
+    return code.replace("\r\n", "\n").replace("\r", "\n").rstrip() + "\n"
+
+
+def code_digest(code: str) -> str:
+    return hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+
+
+def test_cases_digest(test_cases) -> str:
+    blob = json.dumps(test_cases or [], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def result_key(code: str, language: str, test_cases, mode: str = "full", compare: dict = None) -> str:
+    """`compare` (the question's output policy) changes verdicts, so it is hashed with the test cases."""
+    judged = {"test_cases": test_cases or [], "compare": compare} if compare else test_cases
+    return ":".join([
+        KEY_PREFIX,
+        (language or "python").lower(),
+        mode,
+        code_digest(code),
+        test_cases_digest(judged),
+    ])
+
+
+def is_cacheable(result) -> bool:
+    """Only deterministic verdicts are worth replaying."""
+    if not isinstance(result, dict) or result.get("error"):
+        return False
+    if result.get("status") not in ("Accepted", "Rejected"):
+        return False
+    for entry in result.get("results") or []:
+        message = str(entry.get("error_message") or "")
+        if message.startswith(_UNCACHEABLE_PREFIXES):
+            return False
+    return True
+
+
+class JudgeResultCache:
+    """Base class: subclasses implement _get/_set/_bump/_counters."""
+
+    backend = "base"
+    # counters visible to other processes (e.g. the judge_cache_stats command)
+    shared = True
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = int(ttl)
+
+    def get(self, key: str):
+        try:
+            value = self._get(key)
+        except Exception:
+            logger.warning("Judge result cache read failed", exc_info=True)
+            value = None
+        self._safe_bump("hits" if value is not None else "misses")
+        return copy.deepcopy(value)
+
+    def set(self, key: str, result: dict) -> bool:
+        if not is_cacheable(result):
+            return False
+        try:
+            self._set(key, copy.deepcopy(result))
+            return True
+        except Exception:
+            logger.warning("Judge result cache write failed", exc_info=True)
+            return False
+
+    def stats(self) -> dict:
+        try:
+            counters = self._counters()
+        except Exception:
+            logger.warning("Judge result cache stats unavailable", exc_info=True)
+            counters = {}
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "backend": self.backend,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": counters.get("entries"),
+        }
+
+    def _safe_bump(self, name: str):
+        try:
+            self._bump(name)
+        except Exception:
+            pass
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def _bump(self, name):
+        raise NotImplementedError
+
+    def _counters(self) -> dict:
+        raise NotImplementedError
+
+
+class LocalMemoryResultCache(JudgeResultCache):
+    """Per-process LRU; TTL is not enforced (entries are immutable facts about code + test cases)."""
+
+    backend = "locmem"
+    shared = False
+
+    def __init__(self, ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._data = OrderedDict()
+        self._counts = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def _set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def _bump(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _counters(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counts = {"hits": 0, "misses": 0}
+
+
+class DjangoCacheResultCache(JudgeResultCache):
+    """Stores results in a configured Django cache (shared if that cache is shared)."""
+
+    backend = "django"
+
+    def __init__(self, alias: str = "default", ttl: int = DEFAULT_TTL):
+        super().__init__(ttl)
+        from django.core.cache import caches
+        from django.core.cache.backends.dummy import DummyCache
+        from django.core.cache.backends.locmem import LocMemCache
+        self.cache = caches[alias]
+        self.shared = not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def _get(self, key):
+        return self.cache.get(key)
+
+    def _set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    def _bump(self, name):
+        counter = f"{STATS_KEY}:{name}"
+        # add() is a no-op when the counter exists; incr() is atomic on shared caches
+        self.cache.add(counter, 0, None)
+        self.cache.incr(counter)
+
+    def _counters(self):
+        names = ("hits", "misses")
+        values = self.cache.get_many([f"{STATS_KEY}:{n}" for n in names])
+        return {n: values.get(f"{STATS_KEY}:{n}", 0) for n in names}
+
+
+class RedisResultCache(JudgeResultCache):
+    """Stores JSON-encoded results in Redis with a TTL; counters live in one hash."""
+
+    backend = "redis"
+
+    def __init__(self, url: str, ttl: int = DEFAULT_TTL):
+        super().__init__(ttl)
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+
+    def _get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def _set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+    def _bump(self, name):
+        self.client.hincrby(STATS_KEY, name, 1)
+
+    def _counters(self):
+        raw = self.client.hgetall(STATS_KEY) or {}
+        return {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in raw.items()}
+
+
+# ---------------------------
+# Per-process singleton
+# ---------------------------
+_cache = None
+_cache_config = None
+_cache_lock = threading.Lock()
+
+
+def build_judge_result_cache(backend: str, **options) -> Optional[JudgeResultCache]:
+    backend = (backend or "").lower()
+    ttl = options.get("ttl", DEFAULT_TTL)
+    if not backend or backend == "none":
+        return None
+    if backend == "locmem":
+        return LocalMemoryResultCache(ttl=ttl, max_entries=options.get("max_entries", DEFAULT_MAX_ENTRIES))
+    if backend == "django":
+        return DjangoCacheResultCache(alias=options.get("alias") or "default", ttl=ttl)
+    if backend == "redis":
+        return RedisResultCache(options["redis_url"], ttl=ttl)
+    raise ValueError(f"Unknown judge result cache backend: {backend}")
+
+
+def get_judge_result_cache() -> Optional[JudgeResultCache]:
+    """Return the configured cache (None when disabled); falls back to locmem if the backend fails to start."""
+    global _cache, _cache_config
+    from django.conf import settings
+
+    options = {
+        "ttl": getattr(settings, "JUDGE_RESULT_CACHE_TTL", DEFAULT_TTL),
+        "max_entries": getattr(settings, "JUDGE_RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+        "alias": getattr(settings, "JUDGE_RESULT_CACHE_ALIAS", "default"),
+        "redis_url": getattr(settings, "JUDGE_RESULT_CACHE_REDIS_URL", None),
+    }
+    config = (getattr(settings, "JUDGE_RESULT_CACHE_BACKEND", "locmem"), tuple(sorted(options.items())))
+
+    with _cache_lock:
+        if _cache_config != config:
+            try:
+                _cache = build_judge_result_cache(config[0], **options)
+            except Exception:
+                logger.exception("Judge result cache backend %r unavailable; using local memory", config[0])
+                _cache = LocalMemoryResultCache(ttl=options["ttl"], max_entries=options["max_entries"])
+            _cache_config = config
+        return _cache
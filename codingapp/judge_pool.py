@@ -0,0 +1,302 @@
+# codingapp/judge_pool.py
+"""
+Pool of warm, reusable Python judge workers.
+
+Starting a fresh interpreter for every test case costs far more than running
+most student solutions. Instead we keep a few long-lived worker processes
+(codingapp/judge_worker.py) per Celery process; each worker receives
+(code, stdin, timeout) over a pipe and runs it in a forked child, so state is
+reset between runs while interpreter startup is paid only once.
+
+Usage:
+    pool = get_judge_pool()
+    if pool is not None:
+        with pool.lease() as worker:
+            stdout, stderr, rc, timed_out = worker.run(code, stdin, timeout=5)
+
+`worker.run` has the same signature/return tuple as
+tasks_helpers._run_python_code, so it can be passed as `runner=` to
+check_test_cases; `worker` itself can be handed to check_test_cases_compiled,
+which loads the compiled submission into it once. The pool is POSIX-only (needs os.fork); get_judge_pool()
+returns None elsewhere or when disabled via settings.JUDGE_POOL_ENABLED.
+"""
+
+import atexit
+import base64
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from .judge_worker import read_message, write_message
+from .sandbox import RunResult
+from .tasks_helpers import _prepare_python_run, _run_python_code
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "judge_worker.py")
+
+# A worker is recycled after this many runs to cap slow leaks in the worker itself
+DEFAULT_MAX_RUNS_PER_WORKER = 500
+# Extra seconds on top of the per-test timeout before we consider the worker hung
+PROTOCOL_GRACE = 2.0
+LEASE_TIMEOUT = 30
+# Workers per Celery process (each Celery prefork child owns its own pool)
+DEFAULT_POOL_SIZE = 2
+
+
+class JudgeWorkerError(Exception):
+    """Raised when a worker process dies or stops speaking the protocol."""
+
+
+def _run_result(response: dict, comparator=None) -> RunResult:
+    if comparator is not None:
+        comparator.adopt(response.get("compare"))
+    return RunResult(
+        response.get("stdout", ""),
+        response.get("stderr", ""),
+        int(response.get("returncode", -1)),
+        bool(response.get("timed_out", False)),
+        cpu_time=response.get("cpu_time"),
+        peak_rss_kb=response.get("peak_rss_kb"),
+        truncated=bool(response.get("truncated", False)),
+        aborted=bool(response.get("aborted", False)),
+    )
+
+
+class JudgeWorker:
+    """One warm interpreter process. Not thread-safe: lease it from JudgeWorkerPool."""
+
+    def __init__(self, python_executable: str = sys.executable, max_runs: int = DEFAULT_MAX_RUNS_PER_WORKER):
+        self.python_executable = python_executable
+        self.max_runs = max_runs
+        self.runs = 0
+        self.proc = None
+        self._loaded = set()
+        self._start()
+
+    def _start(self):
+        self.proc = subprocess.Popen(
+            [self.python_executable, WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+        )
+        self.runs = 0
+        self._loaded = set()
+
+    def _request(self, payload: dict, timeout: float) -> dict:
+        if self.proc is None or self.proc.poll() is not None:
+            raise JudgeWorkerError("worker process is not running")
+
+        result = {}
+
+        def _talk():
+            try:
+                write_message(self.proc.stdin, payload)
+                result["response"] = read_message(self.proc.stdout)
+            except Exception as exc:
+                result["error"] = exc
+
+        t = threading.Thread(target=_talk, daemon=True)
+        t.start()
+        t.join(timeout)
+        if t.is_alive():
+            self.kill()
+            raise JudgeWorkerError("worker did not answer in time")
+        if "error" in result:
+            self.kill()
+            raise JudgeWorkerError(str(result["error"]))
+        response = result.get("response")
+        if response is None:
+            self.kill()
+            raise JudgeWorkerError("worker closed its pipe")
+        if "error" in response:
+            raise JudgeWorkerError(response["error"])
+        return response
+
+    def ping(self, timeout: float = 5.0) -> bool:
+        try:
+            return bool(self._request({"op": "ping"}, timeout).get("ok"))
+        except JudgeWorkerError:
+            return False
+
+    def run(self, code: str, stdin_data: str, timeout: int = 5, comparator=None) -> Tuple[str, str, int, bool]:
+        """
+        Run python code in the warm worker (stdout streams into `comparator` if given).
+
+        Returns:
+          (stdout_text, stderr_text, returncode, timed_out_bool)
+        """
+        if code is None:
+            return ("", "No code provided", 1, False)
+
+        code_src, stdin_fixed = _prepare_python_run(code, stdin_data)
+        try:
+            if not self.alive():
+                self.restart()
+            payload = {"op": "run", "source": code_src, "stdin": stdin_fixed, "timeout": timeout}
+            if comparator is not None:
+                payload["compare"] = comparator.spec()
+            response = self._request(payload, timeout + PROTOCOL_GRACE)
+        except Exception:
+            # Never fail a submission because of the pool: fall back to a one-off subprocess
+            logger.warning("Judge worker failed; falling back to a fresh subprocess", exc_info=True)
+            return _run_python_code(code, stdin_data, timeout=timeout, comparator=comparator)
+        self.runs += 1
+        return _run_result(response, comparator)
+
+    def run_plan(self, plan, stdin_fixed: str, timeout: int = 5, comparator=None) -> Tuple[str, str, int, bool]:
+        """
+        Run a tasks_helpers.PythonExecutionPlan with an already prepared stdin.
+        The plan's bytecode is shipped to this worker once and reused for every test.
+        """
+        payload = {"op": "run", "id": plan.digest, "stdin": stdin_fixed, "timeout": timeout}
+        if comparator is not None:
+            payload["compare"] = comparator.spec()
+        try:
+            if not self.alive():
+                self.restart()
+            response = None
+            for _ in range(2):
+                if plan.digest not in self._loaded:
+                    self._request({
+                        "op": "load",
+                        "id": plan.digest,
+                        "source": plan.code_src,
+                        "bytecode": base64.b64encode(plan.bytecode).decode("ascii"),
+                    }, PROTOCOL_GRACE + 5)
+                    self._loaded.add(plan.digest)
+                response = self._request(payload, timeout + PROTOCOL_GRACE)
+                if not response.get("missing"):
+                    break
+                # worker evicted the program; load it again
+                self._loaded.discard(plan.digest)
+            if response is None or response.get("missing"):
+                raise JudgeWorkerError("worker could not keep the program loaded")
+        except Exception:
+            logger.warning("Judge worker failed; falling back to a fresh subprocess", exc_info=True)
+            return plan._run_subprocess(stdin_fixed, timeout, comparator)
+        self.runs += 1
+        return _run_result(response, comparator)
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def exhausted(self) -> bool:
+        return self.max_runs > 0 and self.runs >= self.max_runs
+
+    def restart(self):
+        self.kill()
+        self._start()
+
+    def kill(self):
+        if self.proc is None:
+            return
+        try:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                if stream:
+                    stream.close()
+            except Exception:
+                pass
+
+
+class JudgeWorkerPool:
+    """Fixed-size pool of JudgeWorker processes handed out with lease()."""
+
+    def __init__(self, size: int = None, python_executable: str = sys.executable,
+                 max_runs_per_worker: int = DEFAULT_MAX_RUNS_PER_WORKER):
+        self.size = max(1, int(size or DEFAULT_POOL_SIZE))
+        self.python_executable = python_executable
+        self.max_runs_per_worker = max_runs_per_worker
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            worker = JudgeWorker(python_executable, max_runs_per_worker)
+            self._all.append(worker)
+            self._idle.put(worker)
+
+    @contextmanager
+    def lease(self, timeout: float = LEASE_TIMEOUT):
+        """Borrow a worker for the duration of the with-block."""
+        if self._closed:
+            raise JudgeWorkerError("pool is closed")
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise JudgeWorkerError("no judge worker became free in time")
+        try:
+            if not worker.alive() or worker.exhausted():
+                worker.restart()
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for worker in self._all:
+                worker.kill()
+            self._all = []
+
+
+# ---------------------------
+# Per-process singleton
+# ---------------------------
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def pool_supported() -> bool:
+    return hasattr(os, "fork") and sys.platform != "win32"
+
+
+def get_judge_pool() -> Optional[JudgeWorkerPool]:
+    """
+    Return this process' judge pool, creating it on first use.
+
+    Created lazily (and re-created after a fork) so every Celery prefork child
+    owns its own workers instead of sharing pipes with its parent.
+    """
+    global _pool, _pool_pid
+    from django.conf import settings
+
+    if not getattr(settings, "JUDGE_POOL_ENABLED", True) or not pool_supported():
+        return None
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            try:
+                _pool = JudgeWorkerPool(
+                    size=getattr(settings, "JUDGE_POOL_SIZE", None),
+                    max_runs_per_worker=getattr(settings, "JUDGE_POOL_MAX_RUNS_PER_WORKER",
+                                                DEFAULT_MAX_RUNS_PER_WORKER),
+                )
+                _pool_pid = os.getpid()
+            except Exception:
+                logger.exception("Could not start judge worker pool; using per-test subprocesses")
+                _pool = None
+                return None
+        return _pool
+
+
+def _close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+
+
+atexit.register(_close_pool)
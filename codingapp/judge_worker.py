@@ -0,0 +1,219 @@
+# codingapp/judge_worker.py
+"""
+Warm Python judge worker (spawned by codingapp/judge_pool.py).
+
+This file is executed as a standalone script (`python judge_worker.py`), it
+must NOT import Django or anything from codingapp. The interpreter stays warm
+between runs; every submission run happens in a forked child so user code
+never sees (or leaks into) the state of a previous run.
+
+Protocol (over the worker's own stdin/stdout pipes):
+    request:  4-byte big-endian length + UTF-8 JSON
+              {"op": "run", "source": "...", "stdin": "...", "timeout": 5, "limits": {...},
+               "compare": {"policy": "whitespace", "expected_lines": [...], "epsilon": 1e-6}}
+              {"op": "load", "id": "<digest>", "source": "...", "bytecode": "<base64 marshal>"}
+              {"op": "run", "id": "<digest>", "stdin": "...", "timeout": 5}
+              {"op": "ping"}
+    response: 4-byte big-endian length + UTF-8 JSON
+              {"stdout": "...", "stderr": "...", "returncode": 0, "timed_out": false,
+               "cpu_time": 0.01, "peak_rss_kb": 9000, "truncated": false, "aborted": false,
+               "compare": {"ok": true, "finished": true, "mismatch": ""}}
+              {"ok": true} for load/ping, {"missing": true} for a run of an unknown id
+
+"load" keeps a precompiled program in the worker so a submission's test
+cases can all run the same code object without re-sending or re-compiling it.
+Every run gets the rlimits and output cap of codingapp/sandbox.py ("limits"
+defaults to sandbox.default_limits(timeout)); with "compare" stdout is checked
+while it streams (codingapp/comparators.py) and a mismatching run is cut short.
+"""
+
+import base64
+import builtins
+import io
+import json
+import linecache
+import marshal
+import os
+import signal
+import struct
+import sys
+import traceback
+from collections import OrderedDict
+
+try:
+    from .comparators import make_comparator
+    from .sandbox import DEFAULT_OUTPUT_BYTES, apply_rlimits, communicate, default_limits
+except ImportError:  # run as a script: these modules sit next to this file on sys.path
+    from comparators import make_comparator
+    from sandbox import DEFAULT_OUTPUT_BYTES, apply_rlimits, communicate, default_limits
+
+_HEADER = struct.Struct(">I")
+SOLUTION_FILENAME = "solution.py"
+# Loaded programs kept per worker (one per in-flight submission is plenty)
+MAX_LOADED_PROGRAMS = 8
+
+_programs = OrderedDict()
+
+
+def _read_exact(stream, n):
+    buf = b""
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def read_message(stream):
+    header = _read_exact(stream, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    body = _read_exact(stream, length)
+    if body is None:
+        return None
+    return json.loads(body.decode("utf-8"))
+
+
+def write_message(stream, obj):
+    body = json.dumps(obj).encode("utf-8")
+    stream.write(_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def _exec_in_child(code_obj, source):
+    """Runs inside the forked child with fds 0/1/2 already redirected. Never returns."""
+    exit_code = 0
+    try:
+        sys.stdin = io.TextIOWrapper(io.FileIO(0, "r", closefd=False), encoding="utf-8")
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), encoding="utf-8")
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), encoding="utf-8",
+                                      line_buffering=True)
+        sys.argv = [SOLUTION_FILENAME]
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+        # lets tracebacks show the offending source line, like a real file would
+        linecache.cache[SOLUTION_FILENAME] = (len(source), None, source.splitlines(True), SOLUTION_FILENAME)
+        if code_obj is None:
+            code_obj = compile(source, SOLUTION_FILENAME, "exec")
+
+        namespace = {"__name__": "__main__", "__builtins__": builtins, "__file__": SOLUTION_FILENAME}
+        exec(code_obj, namespace)
+    except SystemExit as exc:
+        code = exc.code
+        if code is None:
+            exit_code = 0
+        elif isinstance(code, int):
+            exit_code = code
+        else:
+            print(code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as exc:
+        # Hide the worker's own frame so the traceback looks like `python solution.py`
+        tb = exc.__traceback__
+        if tb is not None and tb.tb_frame.f_code is _exec_in_child.__code__:
+            tb = tb.tb_next
+        traceback.print_exception(type(exc), exc, tb)
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+        try:
+            sys.stderr.flush()
+        except Exception:
+            pass
+    os._exit(exit_code & 0xFF)
+
+
+def run_in_fork(source, stdin_data, timeout, code_obj=None, limits=None, comparator=None):
+    """
+    Fork a child that executes `source` (or the precompiled `code_obj`) with
+    `stdin_data` on stdin, under the rlimits/output cap of `limits`, streaming
+    stdout into `comparator` if given.
+    Returns a sandbox.RunResult (stdout, stderr, returncode, timed_out + usage).
+    """
+    limits = limits or default_limits(timeout)
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            os.dup2(in_r, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            for fd in (in_r, in_w, out_r, out_w, err_r, err_w):
+                os.close(fd)
+            apply_rlimits(limits)
+        except Exception:
+            os._exit(1)
+        _exec_in_child(code_obj, source)
+
+    os.close(in_r)
+    os.close(out_w)
+    os.close(err_w)
+    return communicate(pid, in_w, out_r, err_r, (stdin_data or "").encode("utf-8"), timeout,
+                       max_output=limits.get("output_bytes") or DEFAULT_OUTPUT_BYTES,
+                       comparator=comparator)
+
+
+def handle(request):
+    op = request.get("op")
+    if op == "ping":
+        return {"ok": True}
+    if op == "load":
+        code_obj = marshal.loads(base64.b64decode(request["bytecode"]))
+        _programs[request["id"]] = (request.get("source") or "", code_obj)
+        _programs.move_to_end(request["id"])
+        while len(_programs) > MAX_LOADED_PROGRAMS:
+            _programs.popitem(last=False)
+        return {"ok": True}
+    if op == "run":
+        if request.get("id"):
+            if request["id"] not in _programs:
+                return {"missing": True}
+            source, code_obj = _programs[request["id"]]
+        else:
+            source, code_obj = request.get("source") or "", None
+        comparator = make_comparator(**request["compare"]) if request.get("compare") else None
+        result = run_in_fork(
+            source,
+            request.get("stdin") or "",
+            request.get("timeout") or 5,
+            code_obj=code_obj,
+            limits=request.get("limits"),
+            comparator=comparator,
+        )
+        stdout, stderr, rc, timed_out = result
+        response = {"stdout": stdout, "stderr": stderr, "returncode": rc, "timed_out": timed_out,
+                    "cpu_time": result.cpu_time, "peak_rss_kb": result.peak_rss_kb,
+                    "truncated": result.truncated, "aborted": result.aborted}
+        if comparator is not None:
+            response["compare"] = comparator.state()
+        return response
+    return {"error": f"Unknown op: {op}"}
+
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Nothing but protocol frames may reach the parent through fd 1
+    sys.stdout = sys.stderr
+    while True:
+        request = read_message(stdin)
+        if request is None:
+            break
+        try:
+            response = handle(request)
+        except Exception as exc:
+            response = {"error": f"Worker error: {exc}"}
+        write_message(stdout, response)
+
+
+if __name__ == "__main__":
+    main()
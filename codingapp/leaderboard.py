@@ -0,0 +1,198 @@
+# codingapp/leaderboard.py
+"""
+Materialized assessment leaderboards (AssessmentLeaderboardEntry).
+
+assessment_leaderboard used to rebuild the whole board on every page view:
+every submission of the assessment, output JSON re-parsed to infer raw marks,
+three aggregate queries and a participants x questions loop. Instead each
+(assessment, user) has a row, recomputed from that user's rows alone whenever
+something it depends on is written:
+
+    refresh_entries(assessment_id, [user_id])   # grading tasks, assessment quiz / session views
+    refresh_quiz_entries(quiz_id, user_id)      # a quiz attached to assessments
+    refresh_entries(assessment_id)              # everyone (recompute_plagiarism)
+
+and a leaderboard page is one indexed read:
+
+    entries = ranked_entries(assessment)        # participants, best first (paginate it)
+
+Participants without a row yet (e.g. just added to a group) get one on the
+first read (ensure_entries). Every refresh is also pushed to the live
+dashboards as a rank/score delta (leaderboard_live.publish_entries).
+"""
+
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from django.contrib.auth import get_user_model
+from django.db.models import F, Max
+
+from .models import (Assessment, AssessmentLeaderboardEntry, AssessmentQuestion, AssessmentSession,
+                     AssessmentSubmission, QuizSubmission)
+from .leaderboard_live import publish_entries
+from .utils import penalty_factor_from_plagiarism
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+ENTRY_FIELDS = ["question_scores", "quiz_score", "coding_total", "coding_raw_total", "raw_total",
+                "penalized_total", "penalty_factor", "penalty_applied", "max_plagiarism", "max_token_similarity",
+                "max_structural_similarity", "max_ai_generated_prob", "time_taken_seconds", "updated_at"]
+RANK_ORDER = ["-penalized_total", F("time_taken_seconds").asc(nulls_last=True), "user_id"]
+_ACCEPTED = ("accepted", "ok", "passed", "success", "true")
+
+
+def inferred_raw_marks(output, total_tests: Optional[int]) -> float:
+    """Raw marks of a submission saved without raw_score: 5 if all its test results passed, else 0."""
+    try:
+        parsed = json.loads(output) if isinstance(output, str) else output
+    except Exception:
+        parsed = None
+    if isinstance(parsed, dict):
+        outputs = [parsed]
+    elif isinstance(parsed, list):
+        outputs = parsed
+    else:
+        outputs = []
+
+    passed = 0
+    for r in outputs:
+        status = (r.get("status") or r.get("result") or r.get("outcome")) if isinstance(r, dict) else None
+        if status and str(status).strip().lower() in _ACCEPTED:
+            passed += 1
+    if not total_tests:
+        total_tests = len(outputs) or 1
+    return 5.0 if passed == total_tests else 0.0
+
+
+def participants(assessment: Assessment):
+    """Students (not staff) of the groups the assessment is assigned to."""
+    return User.objects.filter(custom_groups__in=assessment.groups.all(), is_staff=False).distinct()
+
+
+def refresh_entries(assessment_id: int, user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recompute the leaderboard rows of `user_ids` (default: every participant and
+    submitter) in the assessment and upsert them; returns how many.
+    """
+    try:
+        assessment = Assessment.objects.get(pk=assessment_id)
+    except Assessment.DoesNotExist:
+        return 0
+    if user_ids is None:
+        user_ids = set(participants(assessment).values_list("id", flat=True))
+        user_ids.update(AssessmentSubmission.objects.filter(assessment=assessment).values_list("user_id", flat=True))
+    user_ids = set(user_ids)
+    if not user_ids:
+        return 0
+
+    question_tests = {}
+    for question_id, test_cases in (AssessmentQuestion.objects.filter(assessment=assessment).order_by("order")
+                                    .values_list("question_id", "question__test_cases")):
+        try:
+            question_tests[question_id] = len(test_cases or [])
+        except TypeError:
+            question_tests[question_id] = None
+
+    submissions = defaultdict(list)
+    for row in (AssessmentSubmission.objects.filter(assessment=assessment, user_id__in=user_ids)
+                .order_by("submitted_at")
+                .values("user_id", "question_id", "score", "raw_score", "output", "plagiarism_percent",
+                        "token_similarity", "structural_similarity", "ai_generated_prob")):
+        submissions[row["user_id"]].append(row)
+
+    best_quiz = {}
+    if assessment.quiz_id:
+        best_quiz = dict(QuizSubmission.objects.filter(quiz_id=assessment.quiz_id, user_id__in=user_ids)
+                         .values_list("user_id").annotate(best=Max("score")))
+    sessions = {s.user_id: s for s in AssessmentSession.objects.filter(assessment=assessment, user_id__in=user_ids,
+                                                                       end_time__isnull=False)}
+
+    entries = [_entry(assessment, uid, question_tests, submissions[uid], best_quiz.get(uid), sessions.get(uid))
+               for uid in user_ids]
+    AssessmentLeaderboardEntry.objects.bulk_create(entries, update_conflicts=True,
+                                                   unique_fields=["assessment", "user"], update_fields=ENTRY_FIELDS)
+    try:
+        publish_entries(assessment, entries)
+    except Exception:
+        logger.exception("Publishing leaderboard deltas failed for assessment %s", assessment_id)
+    return len(entries)
+
+
+def _entry(assessment, user_id, question_tests: Dict[int, Optional[int]], submissions: List[dict],
+           quiz_score, session) -> AssessmentLeaderboardEntry:
+    question_scores = {}
+    coding_total = 0.0
+    max_plag = max_token = max_struct = max_ai = 0.0
+    for sub in submissions:
+        qid = sub["question_id"]
+        penalized = float(sub["score"] or 0.0)
+        coding_total += penalized
+        max_plag = max(max_plag, float(sub["plagiarism_percent"] or 0.0))
+        if sub["raw_score"] is not None:
+            raw = float(sub["raw_score"] or 0.0)
+        else:
+            raw = inferred_raw_marks(sub["output"], question_tests.get(qid))
+        question_scores[str(qid)] = {"penalized": penalized, "raw": raw}
+        if qid in question_tests:
+            max_token = max(max_token, float(sub["token_similarity"] or 0.0))
+            max_struct = max(max_struct, float(sub["structural_similarity"] or 0.0))
+            max_ai = max(max_ai, float(sub["ai_generated_prob"] or 0.0))
+
+    coding_raw_total = float(sum(question_scores.get(str(qid), {}).get("raw", 0.0) for qid in question_tests))
+    quiz_score = float(quiz_score or 0.0)
+    max_plag = round(max_plag, 2)
+    raw_total = round(quiz_score + coding_raw_total, 2)
+
+    time_taken = None
+    if session is not None and session.start_time and session.end_time:
+        time_taken = max(0, int((session.end_time - session.start_time).total_seconds()))
+    # penalty stored on the (ended) session, as finalized by assessment_result / recompute_plagiarism
+    if session is not None and session.penalized_total is not None:
+        penalized_total = float(session.penalized_total)
+        penalty_factor = float(session.penalty_factor if session.penalty_factor is not None else 1.0)
+        penalty_applied = bool(session.penalty_applied)
+    else:
+        penalty_factor = penalty_factor_from_plagiarism(max_plag)
+        penalized_total = round(raw_total * penalty_factor, 2)
+        penalty_applied = penalty_factor < 1.0
+
+    return AssessmentLeaderboardEntry(
+        assessment=assessment, user_id=user_id, question_scores=question_scores, quiz_score=quiz_score,
+        coding_total=coding_total, coding_raw_total=coding_raw_total, raw_total=raw_total,
+        penalized_total=penalized_total, penalty_factor=penalty_factor, penalty_applied=penalty_applied,
+        max_plagiarism=max_plag, max_token_similarity=max_token, max_structural_similarity=max_struct,
+        max_ai_generated_prob=max_ai, time_taken_seconds=time_taken,
+    )
+
+
+def refresh_quiz_entries(quiz_id: int, user_id: int) -> int:
+    """Refresh `user_id`'s rows in every assessment that includes the quiz."""
+    return sum(refresh_entries(assessment_id, [user_id])
+               for assessment_id in Assessment.objects.filter(quiz_id=quiz_id).values_list("id", flat=True))
+
+
+def ensure_entries(assessment: Assessment, users=None) -> int:
+    """Create the rows of `users` (default: the participants) that have none yet; returns how many."""
+    users = participants(assessment) if users is None else users
+    missing = list(users
+                   .exclude(id__in=assessment.leaderboard_entries.values("user_id"))
+                   .values_list("id", flat=True))
+    return refresh_entries(assessment.id, missing) if missing else 0
+
+
+def ranked_entries(assessment: Assessment):
+    """The participants' rows, best first (penalized total, then time taken)."""
+    ensure_entries(assessment)
+    return (AssessmentLeaderboardEntry.objects
+            .filter(assessment=assessment, user__in=participants(assessment))
+            .select_related("user")
+            .order_by(*RANK_ORDER))
+
+
+def format_time_taken(seconds: Optional[int]) -> str:
+    if seconds is None:
+        return "N/A"
+    return f"{seconds // 3600}h {(seconds % 3600) // 60}m {seconds % 60}s"
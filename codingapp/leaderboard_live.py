@@ -0,0 +1,425 @@
+# codingapp/leaderboard_live.py
+"""
+Live assessment leaderboards: rank/score deltas pushed over WebSockets.
+
+Every leaderboard write goes through leaderboard.refresh_entries, which hands
+the rows it upserted to publish_entries(). That places them in a per-
+assessment rank index and sends the teacher dashboards connected to the
+assessment (consumers.LeaderboardConsumer, channel group
+group_name(assessment_id)) only the rows whose rank or score changed:
+
+    {"type": "leaderboard.delta", "assessment_id": 5, "rows": [
+        {"user_id": 12, "rank": 2, "username": "...", "penalized_total": 7.5, ...},   # rescored
+        {"user_id": 31, "rank": 3},                                                  # moved down
+    ]}
+
+A rank is the position of a row's rank_member() string, which sorts like
+leaderboard.RANK_ORDER (penalized total desc, time taken asc with no time
+last, user id). Backends (settings.LEADERBOARD_RANKS_BACKEND):
+    "locmem"  a bisect-sorted list per assessment in this process (default)
+    "redis"   a Redis sorted set per assessment at LEADERBOARD_RANKS_REDIS_URL
+              (shared by all web and Celery processes; a move is one Lua
+              script, so concurrent writers cannot interleave). Always used
+              when the Redis channel layer is configured
+              (settings.CHANNEL_LAYERS_REDIS_URL).
+An index is seeded from the AssessmentLeaderboardEntry rows the first time
+an assessment is published. Nothing is done when no channel layer is
+configured. The in-memory channel layer only reaches dashboards connected to
+this very process, so with it a process publishes only while it serves the
+assessment's group; elsewhere (a Celery worker) the delta is dropped with a
+warning, and its local index forgotten so it is reseeded when next used.
+"""
+
+import bisect
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+try:
+    from asgiref.sync import async_to_sync
+    from channels.layers import InMemoryChannelLayer, get_channel_layer
+except ImportError:  # optional: without Channels there is nobody to push to
+    get_channel_layer = InMemoryChannelLayer = None
+
+from .models import AssessmentLeaderboardEntry
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "leaderboard:ranks:v1"
+_MAX_SCORE_CENTS = 10 ** 12 - 1
+_NO_TIME = 10 ** 10 - 1
+
+
+def group_name(assessment_id: int) -> str:
+    return f"leaderboard.{assessment_id}"
+
+
+def rank_member(user_id: int, penalized_total: float, time_taken_seconds: Optional[int]) -> str:
+    """Fixed-width string whose lexicographic order is the leaderboard order."""
+    cents = min(_MAX_SCORE_CENTS, max(0, int(round((penalized_total or 0.0) * 100))))
+    seconds = _NO_TIME if time_taken_seconds is None else min(_NO_TIME, max(0, int(time_taken_seconds)))
+    return f"{_MAX_SCORE_CENTS - cents:012d}:{seconds:010d}:{user_id:010d}"
+
+
+class RankIndex:
+    """Base class: subclasses implement the per-assessment primitives below."""
+
+    backend = "base"
+
+    def move(self, assessment_id: int, members: Dict[int, str]) -> Dict[int, int]:
+        """
+        Set the members of `members` (user id -> rank_member) and return the new
+        1-based rank of every user whose rank changed, plus of those users.
+        """
+        previous = self._members(assessment_id, list(members))
+        # a row only passes the rows between its old and new position
+        positions = []
+        for user_id, member in members.items():
+            positions.append(self._position(assessment_id, member))
+            if previous.get(user_id) is not None:
+                positions.append(self._position(assessment_id, previous[user_id]))
+            else:
+                # a new row pushes every row below it down
+                positions.append(self._size(assessment_id))
+        lo, hi = min(positions), max(positions)
+        before = {user_id: lo + i for i, user_id in enumerate(self._slice(assessment_id, lo, hi))}
+
+        self._set(assessment_id, members, previous)
+        after = self._ranks(assessment_id, list(before) + list(members))
+        return {user_id: rank + 1 for user_id, rank in after.items()
+                if user_id in members or before.get(user_id) != rank}
+
+    def is_loaded(self, assessment_id: int) -> bool:
+        raise NotImplementedError
+
+    def discard(self, assessment_id: int) -> None:
+        """Forget a process-local index that can no longer be kept current; shared indexes stay."""
+
+    def load(self, assessment_id: int, members: Dict[int, str]) -> None:
+        raise NotImplementedError
+
+    def _members(self, assessment_id: int, user_ids: List[int]) -> Dict[int, Optional[str]]:
+        raise NotImplementedError
+
+    def _position(self, assessment_id: int, member: str) -> int:
+        """How many indexed members sort before `member` (its 0-based insertion point)."""
+        raise NotImplementedError
+
+    def _slice(self, assessment_id: int, lo: int, hi: int) -> List[int]:
+        """User ids at 0-based positions lo..hi (inclusive)."""
+        raise NotImplementedError
+
+    def _size(self, assessment_id: int) -> int:
+        raise NotImplementedError
+
+    def _set(self, assessment_id: int, members: Dict[int, str], previous: Dict[int, Optional[str]]) -> None:
+        raise NotImplementedError
+
+    def _ranks(self, assessment_id: int, user_ids: List[int]) -> Dict[int, int]:
+        raise NotImplementedError
+
+
+class LocalRankIndex(RankIndex):
+    """Sorted member lists in this process (bisect: O(log n) lookups, O(n) memmove per move)."""
+
+    backend = "locmem"
+
+    def __init__(self):
+        self._sorted: Dict[int, List[str]] = {}
+        self._by_user: Dict[int, Dict[int, str]] = {}
+        self._lock = threading.RLock()
+
+    def move(self, assessment_id, members):
+        with self._lock:
+            return super().move(assessment_id, members)
+
+    def is_loaded(self, assessment_id):
+        return assessment_id in self._sorted
+
+    def discard(self, assessment_id):
+        with self._lock:
+            self._sorted.pop(assessment_id, None)
+            self._by_user.pop(assessment_id, None)
+
+    def load(self, assessment_id, members):
+        with self._lock:
+            self._by_user[assessment_id] = dict(members)
+            self._sorted[assessment_id] = sorted(members.values())
+
+    def _members(self, assessment_id, user_ids):
+        by_user = self._by_user.get(assessment_id, {})
+        return {user_id: by_user.get(user_id) for user_id in user_ids}
+
+    def _position(self, assessment_id, member):
+        return bisect.bisect_left(self._sorted.setdefault(assessment_id, []), member)
+
+    def _slice(self, assessment_id, lo, hi):
+        return [int(member.rsplit(":", 1)[1]) for member in self._sorted.get(assessment_id, [])[lo:hi + 1]]
+
+    def _size(self, assessment_id):
+        return len(self._sorted.get(assessment_id, []))
+
+    def _set(self, assessment_id, members, previous):
+        ordered = self._sorted.setdefault(assessment_id, [])
+        by_user = self._by_user.setdefault(assessment_id, {})
+        for user_id, member in members.items():
+            old = previous.get(user_id)
+            if old is not None:
+                del ordered[bisect.bisect_left(ordered, old)]
+            bisect.insort(ordered, member)
+            by_user[user_id] = member
+
+    def _ranks(self, assessment_id, user_ids):
+        ordered = self._sorted.get(assessment_id, [])
+        by_user = self._by_user.get(assessment_id, {})
+        return {user_id: bisect.bisect_left(ordered, by_user[user_id]) for user_id in user_ids if user_id in by_user}
+
+    def clear(self):
+        with self._lock:
+            self._sorted.clear()
+            self._by_user.clear()
+
+
+# RankIndex.move as one atomic script. KEYS: sorted set, hash of user id -> member;
+# ARGV: user id, member, user id, member, ... Returns user id, 0-based rank, ...
+_MOVE_SCRIPT = """
+local ranks, by_user = KEYS[1], KEYS[2]
+local size = redis.call('ZCARD', ranks)
+local lo, hi
+local function widen(position)
+    if lo == nil or position < lo then lo = position end
+    if hi == nil or position > hi then hi = position end
+end
+local previous, moved = {}, {}
+for i = 1, #ARGV, 2 do
+    local user_id, member = ARGV[i], ARGV[i + 1]
+    moved[tonumber(user_id)] = true
+    widen(redis.call('ZLEXCOUNT', ranks, '-', '(' .. member))
+    local old = redis.call('HGET', by_user, user_id)
+    if old then
+        previous[user_id] = old
+        widen(redis.call('ZLEXCOUNT', ranks, '-', '(' .. old))
+    else
+        widen(size)
+    end
+end
+local before = redis.call('ZRANGE', ranks, lo, hi)
+for i = 1, #ARGV, 2 do
+    local user_id, member = ARGV[i], ARGV[i + 1]
+    if previous[user_id] then redis.call('ZREM', ranks, previous[user_id]) end
+    redis.call('ZADD', ranks, 0, member)
+    redis.call('HSET', by_user, user_id, member)
+end
+local changed = {}
+for i, member in ipairs(before) do
+    local user_id = tonumber(string.sub(member, -10))
+    if not moved[user_id] then
+        local rank = redis.call('ZRANK', ranks, member)
+        if rank ~= lo + i - 1 then
+            table.insert(changed, user_id)
+            table.insert(changed, rank)
+        end
+    end
+end
+for i = 1, #ARGV, 2 do
+    table.insert(changed, tonumber(ARGV[i]))
+    table.insert(changed, redis.call('ZRANK', ranks, ARGV[i + 1]))
+end
+return changed
+"""
+
+
+class RedisRankIndex(RankIndex):
+    """
+    One sorted set per assessment (all scores 0, so members are ordered
+    lexicographically) plus a hash of user id -> member.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._move = self.client.register_script(_MOVE_SCRIPT)
+
+    def move(self, assessment_id, members):
+        # the read-compute-write of RankIndex.move runs inside Redis, atomically
+        if not members:
+            return {}
+        args = [value for user_id, member in members.items() for value in (user_id, member)]
+        flat = self._move(keys=list(self._keys(assessment_id)), args=args)
+        return {int(user_id): int(rank) + 1 for user_id, rank in zip(flat[::2], flat[1::2])}
+
+    def _keys(self, assessment_id):
+        return f"{KEY_PREFIX}:{assessment_id}", f"{KEY_PREFIX}:{assessment_id}:members"
+
+    def is_loaded(self, assessment_id):
+        return bool(self.client.exists(f"{KEY_PREFIX}:{assessment_id}:loaded"))
+
+    def load(self, assessment_id, members):
+        ranks, by_user = self._keys(assessment_id)
+        pipe = self.client.pipeline()
+        pipe.delete(ranks, by_user)
+        if members:
+            pipe.zadd(ranks, {member: 0 for member in members.values()})
+            pipe.hset(by_user, mapping={str(user_id): member for user_id, member in members.items()})
+        pipe.set(f"{KEY_PREFIX}:{assessment_id}:loaded", 1)
+        pipe.execute()
+
+    def _members(self, assessment_id, user_ids):
+        if not user_ids:
+            return {}
+        values = self.client.hmget(self._keys(assessment_id)[1], [str(user_id) for user_id in user_ids])
+        return dict(zip(user_ids, values))
+
+    def _position(self, assessment_id, member):
+        return self.client.zlexcount(self._keys(assessment_id)[0], "-", f"({member}")
+
+    def _slice(self, assessment_id, lo, hi):
+        return [int(member.rsplit(":", 1)[1]) for member in self.client.zrange(self._keys(assessment_id)[0], lo, hi)]
+
+    def _size(self, assessment_id):
+        return self.client.zcard(self._keys(assessment_id)[0])
+
+    def _set(self, assessment_id, members, previous):
+        ranks, by_user = self._keys(assessment_id)
+        pipe = self.client.pipeline()
+        stale = [old for old in previous.values() if old is not None]
+        if stale:
+            pipe.zrem(ranks, *stale)
+        pipe.zadd(ranks, {member: 0 for member in members.values()})
+        pipe.hset(by_user, mapping={str(user_id): member for user_id, member in members.items()})
+        pipe.execute()
+
+    def _ranks(self, assessment_id, user_ids):
+        ranks, by_user = self._keys(assessment_id)
+        members = self._members(assessment_id, user_ids)
+        pipe = self.client.pipeline()
+        known = [user_id for user_id, member in members.items() if member is not None]
+        for user_id in known:
+            pipe.zrank(ranks, members[user_id])
+        return {user_id: rank for user_id, rank in zip(known, pipe.execute()) if rank is not None}
+
+
+# ---------------------------
+# Per-process singleton
+# ---------------------------
+_index = None
+_index_config = None
+_index_lock = threading.Lock()
+
+
+def _index_settings():
+    backend = getattr(settings, "LEADERBOARD_RANKS_BACKEND", "locmem")
+    layer_url = getattr(settings, "CHANNEL_LAYERS_REDIS_URL", None)
+    if layer_url:
+        # every process the Redis layer connects must see the same ranks
+        backend = "redis"
+    return backend, getattr(settings, "LEADERBOARD_RANKS_REDIS_URL", None) or layer_url
+
+
+def get_rank_index() -> RankIndex:
+    """Return the configured rank index; falls back to locmem if the backend fails to start."""
+    global _index, _index_config
+    config = _index_settings()
+    with _index_lock:
+        if _index_config != config:
+            try:
+                _index = RedisRankIndex(config[1]) if config[0] == "redis" else LocalRankIndex()
+            except Exception:
+                logger.exception("Leaderboard rank index backend %r unavailable; using local memory", config[0])
+                _index = LocalRankIndex()
+            _index_config = config
+        return _index
+
+
+_warned_in_memory = False
+
+
+def _serves_group(layer, name: str) -> bool:
+    """False for an in-memory layer without a consumer of `name` in this process."""
+    if InMemoryChannelLayer is None or not isinstance(layer, InMemoryChannelLayer):
+        return True
+    return bool(layer.groups.get(name))
+
+
+def _warn_in_memory():
+    global _warned_in_memory
+    if not _warned_in_memory:
+        _warned_in_memory = True
+        logger.warning("Live leaderboard deltas are dropped in this process: the in-memory channel layer "
+                       "only reaches dashboards of the ASGI process. Set CHANNEL_LAYERS_REDIS_URL.")
+
+
+def _delta_row(entry: AssessmentLeaderboardEntry, username: str) -> dict:
+    from .leaderboard import format_time_taken
+    return {
+        "username": username,
+        "quiz_score": entry.quiz_score,
+        "coding_total": entry.coding_total,
+        "raw_total": entry.raw_total,
+        "penalized_total": entry.penalized_total,
+        "penalty_applied": entry.penalty_applied,
+        "max_plagiarism": entry.max_plagiarism,
+        "time_taken": format_time_taken(entry.time_taken_seconds),
+    }
+
+
+def ensure_loaded(assessment, exclude: Iterable[int] = ()) -> RankIndex:
+    """
+    Seed the assessment's rank index from its AssessmentLeaderboardEntry rows
+    (except `exclude`) unless it is loaded; the dashboard consumer does this on
+    connect, so the index starts from the ranks the page showed.
+    """
+    from .leaderboard import participants
+
+    index = get_rank_index()
+    if not index.is_loaded(assessment.id):
+        rows = (AssessmentLeaderboardEntry.objects.filter(assessment_id=assessment.id, user__in=participants(assessment))
+                .exclude(user_id__in=list(exclude))
+                .values_list("user_id", "penalized_total", "time_taken_seconds"))
+        index.load(assessment.id, {user_id: rank_member(user_id, total, seconds) for user_id, total, seconds in rows})
+    return index
+
+
+def publish_entries(assessment, entries: Iterable[AssessmentLeaderboardEntry]) -> List[dict]:
+    """
+    Move the participants' refreshed rows in the rank index and send the
+    connected dashboards the rows that changed; returns them.
+    """
+    layer = get_channel_layer() if get_channel_layer is not None else None
+    if layer is None:
+        return []
+    from .leaderboard import participants
+
+    assessment_id = assessment.id
+    if not _serves_group(layer, group_name(assessment_id)):
+        _warn_in_memory()
+        get_rank_index().discard(assessment_id)
+        return []
+    entries = list(entries)
+    names = dict(participants(assessment).filter(id__in=[e.user_id for e in entries])
+                 .values_list("id", "username"))
+    entries = [e for e in entries if e.user_id in names]
+    if not entries:
+        return []
+
+    # the refreshed rows are already written: seed without them, so they move in as new rows
+    # and every row they push down is reported
+    index = ensure_loaded(assessment, exclude=[e.user_id for e in entries])
+    ranks = index.move(assessment_id, {e.user_id: rank_member(e.user_id, e.penalized_total, e.time_taken_seconds)
+                                       for e in entries})
+
+    refreshed = {e.user_id: e for e in entries}
+    rows = []
+    for user_id, rank in sorted(ranks.items(), key=lambda item: item[1]):
+        row = {"user_id": user_id, "rank": rank}
+        if user_id in refreshed:
+            row.update(_delta_row(refreshed[user_id], names[user_id]))
+        rows.append(row)
+    async_to_sync(layer.group_send)(group_name(assessment_id), {
+        "type": "leaderboard.delta", "assessment_id": assessment_id, "rows": rows,
+    })
+    return rows
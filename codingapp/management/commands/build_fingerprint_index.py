@@ -0,0 +1,45 @@
+# codingapp/management/commands/build_fingerprint_index.py
+"""
+Store winnowing fingerprints and structural sequences and fill the FingerprintHash / LSHBucket indexes for existing
+AssessmentSubmission rows (see codingapp/fingerprint_index.py). New
+submissions are indexed when they are saved; this backfills older ones.
+
+Usage:
+  python manage.py build_fingerprint_index
+  python manage.py build_fingerprint_index --assessment 5 --rebuild
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from codingapp.fingerprint_index import index_submission
+from codingapp.models import AssessmentSubmission
+from codingapp.utils import AST_SEQUENCE_PREFIX, FINGERPRINT_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Compute and index fingerprints (structural sequences, LSH buckets) of assessment submissions missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--assessment", "-a", type=int, help="Limit to this assessment id", required=False)
+        parser.add_argument("--question", "-q", type=int, help="Limit to this question id", required=False)
+        parser.add_argument("--rebuild", action="store_true", help="Re-index submissions that already have a fingerprint")
+
+    def handle(self, *args, **options):
+        subs_qs = AssessmentSubmission.objects.only("id", "assessment_id", "question_id", "code")
+        if options.get("assessment"):
+            subs_qs = subs_qs.filter(assessment_id=options["assessment"])
+        if options.get("question"):
+            subs_qs = subs_qs.filter(question_id=options["question"])
+        if not options.get("rebuild"):
+            subs_qs = (
+                subs_qs.filter(Q(fingerprint__isnull=True) | ~Q(ast_sequence__startswith=AST_SEQUENCE_PREFIX)
+                               | Q(lsh_buckets__isnull=True))
+                .exclude(fingerprint=FINGERPRINT_PREFIX, ast_sequence__startswith=AST_SEQUENCE_PREFIX)
+                .distinct()
+            )
+
+        total = 0
+        for submission in subs_qs.iterator():
+            index_submission(submission)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} submissions."))
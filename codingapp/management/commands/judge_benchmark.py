@@ -0,0 +1,86 @@
+# codingapp/management/commands/judge_benchmark.py
+"""
+Benchmark the judge with synthetic submissions and print a JSON report
+(see codingapp/judge_benchmark.py for the scenarios and metrics).
+
+Usage examples:
+  python manage.py judge_benchmark
+  python manage.py judge_benchmark --scenario run_judge --scenario fallback --test-cases 1,50,200 --iterations 10
+  python manage.py judge_benchmark --output before.json
+  python manage.py judge_benchmark --output after.json --baseline before.json --threshold 15
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from codingapp.judge_benchmark import (DEFAULT_CODE_LINES, DEFAULT_ITERATIONS, DEFAULT_PEERS, DEFAULT_TEST_CASES,
+                                       DEFAULT_THRESHOLD, SCENARIOS, compare_reports, run_benchmark)
+
+
+def _int_list(value):
+    try:
+        return [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma-separated list of integers, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = "Benchmark check_test_cases, the Piston fallback and the submission tasks; prints JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                            help="Scenario to run (repeatable; default: all)")
+        parser.add_argument("--test-cases", default=",".join(map(str, DEFAULT_TEST_CASES)),
+                            help="Comma-separated test-case counts per question")
+        parser.add_argument("--code-lines", default=",".join(map(str, DEFAULT_CODE_LINES)),
+                            help="Comma-separated submission sizes in lines")
+        parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS,
+                            help="Submissions per (scenario, test cases, code lines) cell")
+        parser.add_argument("--concurrency", type=int, default=1, help="Submissions judged at the same time")
+        parser.add_argument("--peers", type=int, default=DEFAULT_PEERS,
+                            help="Other students' submissions the assessment scenario compares against")
+        parser.add_argument("--warm", action="store_true",
+                            help="Resubmit identical code (measures the result/output caches)")
+        parser.add_argument("--piston-latency", type=float, default=0.0,
+                            help="Seconds the local Piston stub waits per request")
+        parser.add_argument("--output", help="Write the report to this file instead of stdout")
+        parser.add_argument("--baseline", help="Earlier report to compare against; fails on regressions")
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help="Allowed p95/throughput change in percent before a cell counts as regressed")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations must be at least 1")
+
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"], encoding="utf-8") as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {exc}")
+
+        report = run_benchmark(
+            scenarios=options["scenario"] or SCENARIOS,
+            test_case_counts=_int_list(options["test_cases"]),
+            code_lines=_int_list(options["code_lines"]),
+            iterations=options["iterations"],
+            concurrency=max(1, options["concurrency"]),
+            peers=max(0, options["peers"]),
+            warm=options["warm"],
+            piston_latency=options["piston_latency"],
+            progress=lambda line: self.stderr.write(line),
+        )
+        if baseline is not None:
+            report["regressions"] = compare_reports(report, baseline, options["threshold"])
+
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+        if report.get("regressions"):
+            raise CommandError(f"{len(report['regressions'])} benchmark regression(s) against {options['baseline']}")
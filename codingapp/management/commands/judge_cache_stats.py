@@ -0,0 +1,28 @@
+# codingapp/management/commands/judge_cache_stats.py
+"""
+Print hit/miss counters of the judge result cache (codingapp/judge_cache.py).
+
+Usage:
+  python manage.py judge_cache_stats
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from codingapp.judge_cache import get_judge_result_cache
+
+
+class Command(BaseCommand):
+    help = "Show judge result cache backend, hits, misses and hit rate"
+
+    def handle(self, *args, **options):
+        cache = get_judge_result_cache()
+        if cache is None:
+            self.stdout.write(self.style.WARNING("Judge result cache is disabled (JUDGE_RESULT_CACHE_BACKEND)."))
+            return
+        if not cache.shared:
+            raise CommandError(
+                f"The {cache.backend!r} judge result cache counts hits and misses inside each worker process, "
+                "so this command would only see its own (always 0). Use JUDGE_RESULT_CACHE_BACKEND='redis', "
+                "or 'django' with a shared cache (JUDGE_RESULT_CACHE_ALIAS), to collect them.")
+        self.stdout.write(json.dumps(cache.stats(), indent=2))
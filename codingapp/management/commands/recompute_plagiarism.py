@@ -12,23 +12,37 @@ Usage examples:
   python manage.py recompute_plagiarism
   python manage.py recompute_plagiarism --assessment 5 --apply-penalty --apply-assessment-penalties
   python manage.py recompute_plagiarism --dry-run --verbose
+  python manage.py recompute_plagiarism --engine=matrix   # all pairs at once, same results
+  python manage.py recompute_plagiarism --engine=matrix --workers 8 --resume
 """
 import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from difflib import SequenceMatcher
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connections, transaction
 from django.utils import timezone
 from django.db.models import Max, Sum
 
 from codingapp.models import (
-    AssessmentSubmission, Assessment, Question, AssessmentSession, AssessmentQuestion
+    AssessmentSubmission, Assessment, AssessmentSession, AssessmentQuestion
 )
 
 # Helpers (preferred from utils)
 try:
     from codingapp.utils import normalize_code, penalty_factor_from_plagiarism, compute_ensemble_plagiarism, apply_plagiarism_penalty
+    from codingapp.utils import decode_ast_sequence, decode_fingerprint, structural_sequence, winnowing_fingerprint
+    from codingapp.fingerprint_index import index_submission
+    from codingapp.plagiarism_matrix import ensemble_signals
+    from codingapp.embeddings import get_embedding_index
 except Exception:
+    winnowing_fingerprint = None
+    ensemble_signals = None
+    get_embedding_index = None
     # conservative fallback implementations
     import re
     def normalize_code(src: str, language: str = "") -> str:
@@ -87,6 +101,104 @@ except Exception:
         return round(raw_marks * factor, 2)
 
 
+BULK_UPDATE_BATCH = 500
+SIGNAL_FIELDS = ["plagiarism_percent", "token_similarity", "structural_similarity", "ai_generated_prob"]
+
+
+def compute_group_signals(rows, engine="pairwise"):
+    """
+    Signals for one (assessment, question) group: rows are (submission id, code,
+    fingerprint or None, AST sequence or None, best embedding similarity or None);
+    returns {submission id: (plag, token, struct, ai)}.
+    Runs in --workers processes, so it only computes (no database access).
+    """
+    codes = []
+    for sid, raw, _, _, _ in rows:
+        codes.append((sid, normalize_code(raw or "", ""), raw or ""))
+    fingerprints = {sid: fingerprint for sid, _, fingerprint, _, _ in rows if fingerprint is not None}
+    ast_sequences = {sid: sequence for sid, _, _, sequence, _ in rows if sequence is not None}
+    embedding_sims = {sid: similarity for sid, _, _, _, similarity in rows}
+
+    # --engine=matrix: every submission's signals against the group in one pass
+    matrix_signals = None
+    if engine == "matrix" and ensemble_signals is not None:
+        matrix_signals = ensemble_signals([raw for _, _, raw in codes],
+                                          [fingerprints.get(sid) for sid, _, _ in codes] if fingerprints else None,
+                                          [ast_sequences.get(sid) for sid, _, _ in codes] if ast_sequences else None,
+                                          embedding_similarities=[embedding_sims.get(sid) for sid, _, _ in codes])
+
+    signals_by_id = {}
+    for idx, (sid, my_norm, my_raw) in enumerate(codes):
+        if not my_norm:
+            signals_by_id[sid] = (0.0, 0.0, 0.0, 0.0)
+            continue
+        # prepare list of other raw codes
+        others = [(oid, other_raw) for (oid, onorm, other_raw) in codes if oid != sid and other_raw]
+        other_raws = [other_raw for (oid, other_raw) in others]
+        if not other_raws:
+            signals_by_id[sid] = (0.0, 0.0, 0.0, 0.0)
+            continue
+        # compute ensemble signals comparing my_raw to all others and take best-match signals
+        try:
+            if matrix_signals is not None:
+                signals = matrix_signals[idx]
+            elif fingerprints:
+                signals = compute_ensemble_plagiarism(
+                    my_raw, other_raws, fingerprint=fingerprints.get(sid),
+                    other_fingerprints=[fingerprints.get(oid) for (oid, other_raw) in others],
+                    ast_sequence=ast_sequences.get(sid),
+                    other_ast_sequences=[ast_sequences.get(oid) for (oid, other_raw) in others],
+                    embedding_similarity=embedding_sims.get(sid),
+                )
+            else:
+                signals = compute_ensemble_plagiarism(my_raw, other_raws)
+            signals_by_id[sid] = (
+                float(signals.get("plag_percent", 0.0)),
+                float(signals.get("token_similarity", 0.0)),
+                float(signals.get("structural_similarity", 0.0)),
+                float(signals.get("ai_generated_prob", 0.0)),
+            )
+        except Exception:
+            # fallback: use sequence matcher on normalized strings
+            max_sim = 0.0
+            for other_id, other_norm, other_raw in codes:
+                if other_id == sid or not other_norm:
+                    continue
+                try:
+                    sim = SequenceMatcher(None, my_norm, other_norm).ratio()
+                except Exception:
+                    sim = 0.0
+                if sim > max_sim:
+                    max_sim = sim
+            signals_by_id[sid] = (round(max_sim * 100.0, 2), round(max_sim, 4), round(max_sim, 4), 0.0)
+    return signals_by_id
+
+
+def _group_watermark(subs, engine, apply_penalty):
+    """What --resume compares: the group's size and latest updated_at, and the options it ran with."""
+    latest = max((s.updated_at for s in subs if getattr(s, "updated_at", None)), default=None)
+    return {"count": len(subs), "updated_at": latest.isoformat() if latest else None,
+            "engine": engine, "apply_penalty": bool(apply_penalty)}
+
+
+def _load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"groups": {}}
+    state.setdefault("groups", {})
+    return state
+
+
+def _save_state(path, state):
+    # write-then-rename so an interrupted run never leaves a truncated state file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
 class Command(BaseCommand):
     help = (
         "Recompute plagiarism_percent and similarity signals for AssessmentSubmission rows; optionally apply penalties.\n"
@@ -100,6 +212,15 @@ class Command(BaseCommand):
         parser.add_argument("--apply-penalty", action="store_true", help="Also apply plagiarism penalty to per-submission score")
         parser.add_argument("--apply-assessment-penalties", action="store_true", help="Also compute and save assessment-level penalties to AssessmentSession")
         parser.add_argument("--verbose", action="store_true", help="Verbose output")
+        parser.add_argument("--engine", choices=["pairwise", "matrix"], default="pairwise",
+                            help="pairwise: compute_ensemble_plagiarism per submission; "
+                                 "matrix: all-pairs similarity matrix per question (same results, much faster)")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Processes to shard question groups across (results are written by this process)")
+        parser.add_argument("--resume", action="store_true",
+                            help="Skip question groups with no submission changed since they were last completed")
+        parser.add_argument("--state-file",
+                            help="Where completed groups are recorded (default: settings.PLAGIARISM_RECOMPUTE_STATE_FILE)")
 
     def handle(self, *args, **options):
         assessment_id = options.get("assessment")
@@ -108,6 +229,13 @@ class Command(BaseCommand):
         apply_penalty_flag = options.get("apply_penalty", False)
         apply_assessment_penalties_flag = options.get("apply_assessment_penalties", False)
         verbose = options.get("verbose", False)
+        engine = options.get("engine") or "pairwise"
+        workers = max(1, options.get("workers") or 1)
+        resume = options.get("resume", False)
+
+        if engine == "matrix" and ensemble_signals is None:
+            self.stdout.write(self.style.WARNING("plagiarism_matrix not available; using --engine=pairwise"))
+            engine = "pairwise"
 
         if apply_penalty_flag and apply_plagiarism_penalty is None:
             self.stdout.write(self.style.WARNING("apply_plagiarism_penalty not available; --apply-penalty ignored"))
@@ -130,71 +258,57 @@ class Command(BaseCommand):
             self.stdout.write(self.style.NOTICE("No submissions found for filters"))
             return
 
+        # --resume: skip groups unchanged (same size, no newer updated_at) since they were last completed
+        # with the same --engine and --apply-penalty
+        state_file = options.get("state_file") or getattr(
+            settings, "PLAGIARISM_RECOMPUTE_STATE_FILE", ".recompute_plagiarism_state.json")
+        state = _load_state(state_file)
+        pending = []
+        for key, subs in groups.items():
+            if resume and state["groups"].get(f"{key[0]}:{key[1]}") == _group_watermark(subs, engine, apply_penalty_flag):
+                continue
+            pending.append(key)
+        if resume and len(pending) < len(groups):
+            self.stdout.write(f"Resuming: skipping {len(groups) - len(pending)} unchanged question group(s)")
+
+        # Winnowing fingerprints and structural sequences once per submission (stored ones are reused;
+        # missing ones are indexed, except in a dry run) instead of once per compared pair
+        group_rows = {}
+        for key in pending:
+            # best code-embedding similarities from the question's index (submissions embedded so far)
+            embedding_best = get_embedding_index(*key).best_similarities() if get_embedding_index else {}
+            rows = []
+            for s in groups[key]:
+                fingerprint = sequence = None
+                if winnowing_fingerprint is not None:
+                    fingerprint = decode_fingerprint(s.fingerprint)
+                    sequence = decode_ast_sequence(s.ast_sequence)
+                    if fingerprint is None or sequence is None:
+                        if dry_run:
+                            fingerprint = winnowing_fingerprint(s.code or "")
+                            sequence = structural_sequence(s.code or "", s.language)
+                        else:
+                            fingerprint = index_submission(s)
+                            sequence = decode_ast_sequence(s.ast_sequence)
+                rows.append((s.id, s.code or "", fingerprint, sequence, embedding_best.get(s.id)))
+            group_rows[key] = rows
+
         total_checked = 0
         total_updated = 0
+        total_subs = sum(len(groups[key]) for key in pending)
+        done_subs = 0
+        started = time.monotonic()
 
-        for (a_id, q_id), subs in groups.items():
-            try:
-                assessment = Assessment.objects.get(pk=a_id)
-            except Assessment.DoesNotExist:
-                assessment = None
-            try:
-                question = Question.objects.get(pk=q_id)
-            except Question.DoesNotExist:
-                question = None
-
+        for done, ((a_id, q_id), signals_by_id) in enumerate(self._iter_signals(group_rows, engine, workers), 1):
+            subs = groups[(a_id, q_id)]
             if verbose:
                 self.stdout.write(f"Processing assessment={a_id} question={q_id} ({len(subs)} submissions)")
+            question = next((s.question for s in subs if s.question_id == q_id), None)
 
-            # Precompute normalized codes & raw codes
-            codes = []
-            for s in subs:
-                raw = s.code or ""
-                norm = normalize_code(raw or "", "")
-                codes.append((s.id, norm, s.user_id, raw))
-
-            # For each submission compute max similarity and other signals against other codes
+            changed_subs = []
             for sub in subs:
                 total_checked += 1
-                my_raw = sub.code or ""
-                my_norm = normalize_code(my_raw or "", "")
-
-                if not my_norm:
-                    new_plag = 0.0
-                    token_sim = 0.0
-                    struct_sim = 0.0
-                    ai_prob = 0.0
-                else:
-                    # prepare list of other raw codes
-                    other_raws = [other_raw for (oid, onorm, ouid, other_raw) in codes if oid != sub.id and other_raw]
-                    if not other_raws:
-                        new_plag = 0.0
-                        token_sim = struct_sim = ai_prob = 0.0
-                    else:
-                        # compute ensemble signals comparing my_raw to all others and take best-match signals
-                        try:
-                            signals = compute_ensemble_plagiarism(my_raw, other_raws)
-                            new_plag = float(signals.get("plag_percent", 0.0))
-                            token_sim = float(signals.get("token_similarity", 0.0))
-                            struct_sim = float(signals.get("structural_similarity", 0.0))
-                            ai_prob = float(signals.get("ai_generated_prob", 0.0))
-                        except Exception as e:
-                            # fallback: use sequence matcher on normalized strings
-                            max_sim = 0.0
-                            best_token = 0.0
-                            best_struct = 0.0
-                            for other_id, other_norm, other_user, other_raw in codes:
-                                if other_id == sub.id or not other_norm:
-                                    continue
-                                try:
-                                    sim = SequenceMatcher(None, my_norm, other_norm).ratio()
-                                except Exception:
-                                    sim = 0.0
-                                if sim > max_sim:
-                                    max_sim = sim
-                            new_plag = round(max_sim * 100.0, 2)
-                            token_sim = struct_sim = round(max_sim, 4)
-                            ai_prob = 0.0
+                new_plag, token_sim, struct_sim, ai_prob = signals_by_id[sub.id]
 
                 # reconstruct marks_before_penalty (simple inference from sub.output or sub.raw_score)
                 marks_before_penalty = 0
@@ -220,63 +334,51 @@ class Command(BaseCommand):
                     except Exception:
                         new_score = marks_before_penalty
 
-                # Compare and save if needed (or dry-run)
+                msgs = []
+                if float(sub.plagiarism_percent or 0.0) != float(new_plag or 0.0):
+                    msgs.append(f"plag {sub.plagiarism_percent}->{new_plag}")
+                    sub.plagiarism_percent = new_plag
+                if float(sub.token_similarity or 0.0) != float(token_sim or 0.0):
+                    msgs.append(f"token {sub.token_similarity}->{token_sim}")
+                    sub.token_similarity = token_sim
+                if float(sub.structural_similarity or 0.0) != float(struct_sim or 0.0):
+                    msgs.append(f"struct {sub.structural_similarity}->{struct_sim}")
+                    sub.structural_similarity = struct_sim
+                if float(sub.ai_generated_prob or 0.0) != float(ai_prob or 0.0):
+                    msgs.append(f"ai {sub.ai_generated_prob}->{ai_prob}")
+                    sub.ai_generated_prob = ai_prob
+                if apply_penalty_flag and float(sub.score or 0) != float(new_score or 0):
+                    msgs.append(f"score {sub.score}->{new_score}")
+                    sub.score = new_score
+                if not msgs:
+                    continue
+
+                total_updated += 1
                 if dry_run:
-                    changed = False
-                    msgs = []
-                    if float(sub.plagiarism_percent or 0.0) != float(new_plag or 0.0):
-                        changed = True
-                        msgs.append(f"plag {sub.plagiarism_percent}->{new_plag}")
-                    # save token/struct/ai decimal changes if your model stores them
-                    if getattr(sub, "token_similarity", None) is not None and float(getattr(sub, "token_similarity") or 0.0) != float(token_sim or 0.0):
-                        changed = True
-                        msgs.append(f"token {getattr(sub,'token_similarity')}->{token_sim}")
-                    if getattr(sub, "structural_similarity", None) is not None and float(getattr(sub, "structural_similarity") or 0.0) != float(struct_sim or 0.0):
-                        changed = True
-                        msgs.append(f"struct {getattr(sub,'structural_similarity')}->{struct_sim}")
-                    if getattr(sub, "ai_generated_prob", None) is not None and float(getattr(sub, "ai_generated_prob") or 0.0) != float(ai_prob or 0.0):
-                        changed = True
-                        msgs.append(f"ai {getattr(sub,'ai_generated_prob')}->{ai_prob}")
-                    if apply_penalty_flag and float(sub.score or 0) != float(new_score or 0):
-                        changed = True
-                        msgs.append(f"score {sub.score}->{new_score}")
-                    if changed:
-                        total_updated += 1
-                        self.stdout.write(f"[DRY] submission id={sub.id} user={sub.user_id} changes: " + "; ".join(msgs))
+                    self.stdout.write(f"[DRY] submission id={sub.id} user={sub.user_id} changes: " + "; ".join(msgs))
                 else:
-                    updated_fields = []
-                    with transaction.atomic():
-                        if float(sub.plagiarism_percent or 0.0) != float(new_plag or 0.0):
-                            sub.plagiarism_percent = new_plag
-                            updated_fields.append("plagiarism_percent")
-                        # write token/struct/ai if model fields exist
-                        if hasattr(sub, "token_similarity"):
-                            if float(getattr(sub, "token_similarity") or 0.0) != float(token_sim or 0.0):
-                                sub.token_similarity = token_sim
-                                updated_fields.append("token_similarity")
-                        if hasattr(sub, "structural_similarity"):
-                            if float(getattr(sub, "structural_similarity") or 0.0) != float(struct_sim or 0.0):
-                                sub.structural_similarity = struct_sim
-                                updated_fields.append("structural_similarity")
-                        if hasattr(sub, "ai_generated_prob"):
-                            if float(getattr(sub, "ai_generated_prob") or 0.0) != float(ai_prob or 0.0):
-                                sub.ai_generated_prob = ai_prob
-                                updated_fields.append("ai_generated_prob")
-
-                        if apply_penalty_flag and float(sub.score or 0) != float(new_score or 0):
-                            sub.score = new_score
-                            updated_fields.append("score")
-
-                        # update timestamp if present
-                        if hasattr(sub, "updated_at"):
-                            sub.updated_at = timezone.now()
-                            updated_fields.append("updated_at")
-
-                        if updated_fields:
-                            sub.save(update_fields=updated_fields)
-                            total_updated += 1
-                            if verbose:
-                                self.stdout.write(self.style.SUCCESS(f"Updated submission id={sub.id} user={sub.user_id}: plag={new_plag} token={token_sim} struct={struct_sim} ai={ai_prob} score={getattr(sub,'score',None)}"))
+                    sub.updated_at = timezone.now()
+                    changed_subs.append(sub)
+                    if verbose:
+                        self.stdout.write(self.style.SUCCESS(f"Updated submission id={sub.id} user={sub.user_id}: plag={new_plag} token={token_sim} struct={struct_sim} ai={ai_prob} score={getattr(sub,'score',None)}"))
+
+            if not dry_run:
+                fields = SIGNAL_FIELDS + (["score"] if apply_penalty_flag else []) + ["updated_at"]
+                with transaction.atomic():
+                    AssessmentSubmission.objects.bulk_update(changed_subs, fields, batch_size=BULK_UPDATE_BATCH)
+                state["groups"][f"{a_id}:{q_id}"] = _group_watermark(subs, engine, apply_penalty_flag)
+                _save_state(state_file, state)
+
+            done_subs += len(subs)
+            elapsed = time.monotonic() - started
+            eta = elapsed / done_subs * (total_subs - done_subs) if done_subs else 0.0
+            self.stderr.write(f"[{done}/{len(pending)}] assessment={a_id} question={q_id}: {len(subs)} submissions, "
+                              f"{len(changed_subs) if not dry_run else 0} updated; "
+                              f"elapsed {elapsed:.1f}s, ETA {eta:.1f}s")
+
+        if not dry_run:
+            state["last_completed"] = timezone.now().isoformat()
+            _save_state(state_file, state)
 
         # Step 2: assessment-level penalties (existing logic, unchanged but uses recomputed per-submission fields)
         if apply_assessment_penalties_flag:
@@ -375,4 +477,27 @@ class Command(BaseCommand):
                                 if verbose:
                                     self.stdout.write(self.style.SUCCESS(f"Updated session for user={uid} assessment={a_id}: penalty={round(max_plag,2)} factor={factor} raw_total={raw_total} penalized={penalized_total}"))
 
+        # Step 3: the materialized leaderboards of the recomputed assessments
+        if not dry_run:
+            from codingapp.leaderboard import refresh_entries
+            for a_id in sorted({a for (a, q) in groups.keys()} | ({assessment_id} if assessment_id else set())):
+                refreshed = refresh_entries(a_id)
+                if verbose:
+                    self.stdout.write(f"Refreshed {refreshed} leaderboard rows for assessment={a_id}")
+
         self.stdout.write(self.style.SUCCESS(f"Done. Checked {total_checked} submissions. {'(dry-run)' if dry_run else ''} Updated {total_updated} rows."))
+
+    def _iter_signals(self, group_rows, engine, workers):
+        """Yield ((assessment_id, question_id), signals) as groups finish, sharded over `workers` processes."""
+        # biggest groups first: they dominate the run time
+        keys = sorted(group_rows, key=lambda key: len(group_rows[key]), reverse=True)
+        if workers <= 1 or len(keys) <= 1 or not hasattr(os, "fork"):
+            for key in keys:
+                yield key, compute_group_signals(group_rows[key], engine)
+            return
+        # the forked workers never touch the database; don't let them inherit open connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            futures = {pool.submit(compute_group_signals, group_rows[key], engine): key for key in keys}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0041_externalprofile_hackerrank_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='output_policy',
+            field=models.CharField(choices=[('whitespace', 'Ignore whitespace differences'), ('exact', 'Exact lines'), ('float', 'Numbers within tolerance'), ('unordered', 'Lines in any order')], default='whitespace', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='float_tolerance',
+            field=models.FloatField(default=1e-06, help_text="Allowed absolute/relative error for the 'float' policy."),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0042_question_output_policy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assessmentsubmission',
+            name='fingerprint',
+            field=models.TextField(blank=True, help_text='Winnowing fingerprint (utils.encode_fingerprint), set when the submission is saved', null=True),
+        ),
+        migrations.CreateModel(
+            name='FingerprintHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.BigIntegerField()),
+                ('assessment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='codingapp.assessment')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='codingapp.question')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint_hashes', to='codingapp.assessmentsubmission')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['assessment', 'question', 'hash'], name='fingerprint_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0043_fingerprinthash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField()),
+                ('assessment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='codingapp.assessment')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='codingapp.question')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='codingapp.assessmentsubmission')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['assessment', 'question', 'bucket'], name='lsh_bucket_lookup_idx')],
+            },
+        ),
+    ]
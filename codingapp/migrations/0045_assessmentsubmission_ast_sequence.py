@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0044_lshbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentsubmission',
+            name='ast_sequence',
+            field=models.TextField(blank=True, help_text='AST node-type codes (utils.encode_ast_sequence), set with the fingerprint', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0045_assessmentsubmission_ast_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assessmentsubmission',
+            name='ast_sequence',
+            field=models.TextField(blank=True, help_text='Structural sequence (utils.encode_ast_sequence): AST node types, or token classes for C/C++/Java/JS', null=True),
+        ),
+    ]
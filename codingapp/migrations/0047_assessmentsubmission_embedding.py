@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0046_alter_assessmentsubmission_ast_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentsubmission',
+            name='embedding',
+            field=models.TextField(blank=True, help_text='Hashed token n-gram counts (embeddings.encode_embedding), set by compute_submission_embeddings', null=True),
+        ),
+    ]
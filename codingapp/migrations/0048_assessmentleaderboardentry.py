@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0047_assessmentsubmission_embedding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssessmentLeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_scores', models.JSONField(blank=True, default=dict, help_text='{"<question id>": {"penalized": .., "raw": ..}}')),
+                ('quiz_score', models.FloatField(default=0.0)),
+                ('coding_total', models.FloatField(default=0.0, help_text='Sum of the penalized per-question scores')),
+                ('coding_raw_total', models.FloatField(default=0.0)),
+                ('raw_total', models.FloatField(default=0.0)),
+                ('penalized_total', models.FloatField(default=0.0)),
+                ('penalty_factor', models.FloatField(default=1.0)),
+                ('penalty_applied', models.BooleanField(default=False)),
+                ('max_plagiarism', models.FloatField(default=0.0)),
+                ('max_token_similarity', models.FloatField(default=0.0)),
+                ('max_structural_similarity', models.FloatField(default=0.0)),
+                ('max_ai_generated_prob', models.FloatField(default=0.0)),
+                ('time_taken_seconds', models.PositiveIntegerField(blank=True, help_text='Null until the session has ended', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assessment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='codingapp.assessment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['assessment', '-penalized_total', 'time_taken_seconds'], name='leaderboard_rank_idx')],
+                'unique_together': {('assessment', 'user')},
+            },
+        ),
+    ]
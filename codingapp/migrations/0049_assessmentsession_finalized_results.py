@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codingapp', '0048_assessmentleaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='finalized_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='plagiarism_per_question',
+            field=models.JSONField(blank=True, default=dict, help_text='{"<question id>": plagiarism %}'),
+        ),
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='plagiarism_avg',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='quiz_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='coding_raw_total',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='assessmentsession',
+            name='coding_penalized_total',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
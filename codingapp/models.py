@@ -182,10 +182,27 @@ class Question(models.Model):
         validators=[validate_test_cases],
         help_text="List of dicts with 'input' and 'expected_output' keys."
     )
+    # How program output is compared with expected_output (see codingapp/comparators.py)
+    OUTPUT_POLICIES = [
+        ('whitespace', 'Ignore whitespace differences'),
+        ('exact', 'Exact lines'),
+        ('float', 'Numbers within tolerance'),
+        ('unordered', 'Lines in any order'),
+    ]
+    output_policy = models.CharField(
+        max_length=20, choices=OUTPUT_POLICIES, default='whitespace'
+    )
+    float_tolerance = models.FloatField(
+        default=1e-6, help_text="Allowed absolute/relative error for the 'float' policy."
+    )
 
     def __str__(self):
         return self.title
 
+    def compare_options(self):
+        """Output comparison settings handed to the judge."""
+        return {"policy": self.output_policy, "epsilon": self.float_tolerance}
+
     class Meta:
         unique_together = ['module', 'title']
 
@@ -265,7 +282,9 @@ class AssessmentSubmission(models.Model):
     embedding_similarity = models.FloatField(null=True, blank=True, help_text="Embedding cosine similarity (0.0-1.0)")
     ai_generated_prob = models.FloatField(null=True, blank=True, help_text="Estimated probability code is AI-generated (0.0-1.0)")
     # cache / diagnostic
-    fingerprint = models.TextField(null=True, blank=True, help_text="Optional fingerprint or hash for quick comparisons")
+    fingerprint = models.TextField(null=True, blank=True, help_text="Winnowing fingerprint (utils.encode_fingerprint), set when the submission is saved")
+    ast_sequence = models.TextField(null=True, blank=True, help_text="Structural sequence (utils.encode_ast_sequence): AST node types, or token classes for C/C++/Java/JS")
+    embedding = models.TextField(null=True, blank=True, help_text="Hashed token n-gram counts (embeddings.encode_embedding), set by compute_submission_embeddings")
     # inside AssessmentSubmission model
     raw_score = models.FloatField(null=True, blank=True, help_text="Raw marks before plagiarism penalty (0-5).")
     # If you want an updated timestamp:
@@ -279,6 +298,46 @@ class AssessmentSubmission(models.Model):
         return f"{self.user.username} - {self.assessment.title} - {self.question.title}"
 
 
+class FingerprintHash(models.Model):
+    """
+    Inverted index of submission fingerprints: one row per winnowing hash of an
+    AssessmentSubmission, so the submissions sharing hashes with new code are
+    found by lookup per (assessment, question) (see codingapp/fingerprint_index.py).
+    """
+    assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    submission = models.ForeignKey(AssessmentSubmission, on_delete=models.CASCADE, related_name="fingerprint_hashes")
+    # unsigned 64-bit winnowing hash stored as signed bigint
+    hash = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["assessment", "question", "hash"], name="fingerprint_lookup_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.submission_id}: {self.hash}"
+
+
+class LSHBucket(models.Model):
+    """
+    MinHash LSH buckets of a submission (one row per band, utils.lsh_band_keys):
+    submissions sharing a bucket within (assessment, question) are likely copies.
+    """
+    assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    submission = models.ForeignKey(AssessmentSubmission, on_delete=models.CASCADE, related_name="lsh_buckets")
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["assessment", "question", "bucket"], name="lsh_bucket_lookup_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.submission_id}: {self.bucket}"
+
+
 # in codingapp/models.py — modify AssessmentSession
 class AssessmentSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -297,11 +356,52 @@ class AssessmentSession(models.Model):
     raw_total = models.FloatField(null=True, blank=True)
     penalized_total = models.FloatField(null=True, blank=True)
     penalty_applied = models.BooleanField(default=False)
+    # result of the session, computed once when it ends (plagiarism_incremental.finalize_session) and
+    # kept current by the plagiarism checks; assessment_result only reads it
+    finalized_at = models.DateTimeField(null=True, blank=True)
+    plagiarism_per_question = models.JSONField(default=dict, blank=True, help_text='{"<question id>": plagiarism %}')
+    plagiarism_avg = models.FloatField(default=0.0)
+    quiz_score = models.FloatField(default=0.0)
+    coding_raw_total = models.FloatField(default=0.0)
+    coding_penalized_total = models.FloatField(default=0.0)
 
     class Meta:
         unique_together = ['user', 'assessment']
 
 
+class AssessmentLeaderboardEntry(models.Model):
+    """
+    Materialized leaderboard row of one user in one assessment, recomputed
+    from that user's submissions, quiz and session whenever they are written
+    (see codingapp/leaderboard.py). Similarity maxima are 0..1.
+    """
+    assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE, related_name="leaderboard_entries")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question_scores = models.JSONField(default=dict, blank=True, help_text='{"<question id>": {"penalized": .., "raw": ..}}')
+    quiz_score = models.FloatField(default=0.0)
+    coding_total = models.FloatField(default=0.0, help_text="Sum of the penalized per-question scores")
+    coding_raw_total = models.FloatField(default=0.0)
+    raw_total = models.FloatField(default=0.0)
+    penalized_total = models.FloatField(default=0.0)
+    penalty_factor = models.FloatField(default=1.0)
+    penalty_applied = models.BooleanField(default=False)
+    max_plagiarism = models.FloatField(default=0.0)
+    max_token_similarity = models.FloatField(default=0.0)
+    max_structural_similarity = models.FloatField(default=0.0)
+    max_ai_generated_prob = models.FloatField(default=0.0)
+    time_taken_seconds = models.PositiveIntegerField(null=True, blank=True, help_text="Null until the session has ended")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['assessment', 'user']
+        indexes = [
+            models.Index(fields=["assessment", "-penalized_total", "time_taken_seconds"], name="leaderboard_rank_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.assessment_id}: {self.user_id} ({self.penalized_total})"
+
+
 
 # -----------------------------
 # User profile and RBAC fields
@@ -0,0 +1,383 @@
+# codingapp/native_runner.py
+"""
+Local judge for C, C++, Java and JavaScript submissions.
+
+These languages used to go to Piston, i.e. one HTTP round-trip per test case,
+and Piston compiles the program again for every one of them. Here a
+submission is compiled once (NativeExecutionPlan) and every test case runs the
+resulting artifact in the sandbox (codingapp/sandbox.py), exactly like the
+Python compile-once path in tasks_helpers.
+
+Artifacts live in an on-disk cache keyed by the hash of (language, compiler
+command line, source): a resubmission of the same code, or a second Celery
+process judging it, reuses the binary / class files without compiling. Compile
+errors are cached too, so a broken submission is rejected without running the
+compiler again; compiler timeouts/crashes are not cached. A compile error
+short-circuits: every test case reports it and nothing is executed.
+
+JavaScript has no artifact; `node --check` plays the compiler so syntax errors
+are reported once instead of per test case.
+
+Settings (all optional):
+    JUDGE_NATIVE_LANGUAGES              languages judged locally (when the toolchain is installed)
+    JUDGE_ARTIFACT_DIR                  compile cache directory (default: <tmp>/judge_artifacts)
+    JUDGE_ARTIFACT_CACHE_MAX_ENTRIES    artifacts kept; least recently used are deleted first
+
+Usage:
+    if native_language_available("cpp"):
+        result = check_test_cases_native(code, "cpp", test_cases, max_workers=4)
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .output_cache import cached_run
+from .sandbox import default_limits, run_sandboxed
+from .tasks_helpers import (PER_TEST_TIMEOUT, TOTAL_TIMEOUT, _ensure_trailing_newline, _is_deterministic_run,
+                            _judge_all, _safe_normalize_newlines, _unsupported_language)
+
+logger = logging.getLogger(__name__)
+
+COMPILE_TIMEOUT = 30
+COMPILE_MEMORY_BYTES = 1024 * 1024 * 1024
+COMPILE_OUTPUT_BYTES = 64 * 1024
+DEFAULT_MAX_ARTIFACTS = 256
+# Bump when the artifact layout changes so old cache entries are ignored
+ARTIFACT_VERSION = "v1"
+
+_OK_MARKER = ".ok"
+_ERROR_FILE = "compile_error.txt"
+
+# "{dir}" is the artifact directory, "{source}" the source file name, "{main}" the Java main class.
+# memory_bytes=None: the runtime reserves far more address space than it uses (JVM, V8),
+# so RLIMIT_AS would kill it at startup; the heap is capped with runtime flags instead.
+TOOLCHAINS = {
+    "c": {
+        "source": "main.c",
+        "compile": ["gcc", "-O2", "-std=gnu11", "-pipe", "-o", "main", "main.c", "-lm"],
+        "run": ["{dir}/main"],
+    },
+    "cpp": {
+        "source": "main.cpp",
+        "compile": ["g++", "-O2", "-std=gnu++17", "-pipe", "-o", "main", "main.cpp"],
+        "run": ["{dir}/main"],
+    },
+    "java": {
+        "source": "{main}.java",
+        "compile": ["javac", "-J-Xmx512m", "-encoding", "UTF-8", "-d", ".", "{source}"],
+        "run": ["java", "-Xmx256m", "-Xss64m", "-XX:+UseSerialGC", "-XX:TieredStopAtLevel=1",
+                "-cp", "{dir}", "{main}"],
+        "memory_bytes": None,
+        "processes": 512,
+    },
+    "javascript": {
+        "source": "main.js",
+        "compile": ["node", "--check", "main.js"],
+        "run": ["node", "--max-old-space-size=256", "{dir}/main.js"],
+        "memory_bytes": None,
+    },
+}
+
+LANGUAGE_ALIASES = {"c++": "cpp", "js": "javascript", "node": "javascript"}
+
+_PUBLIC_CLASS = re.compile(r"\bpublic\s+(?:(?:final|abstract)\s+)*class\s+([A-Za-z_$][\w$]*)")
+_CLASS = re.compile(r"\bclass\s+([A-Za-z_$][\w$]*)")
+_JAVA_MAIN = re.compile(r"\bstatic\s+void\s+main\s*\(")
+
+
+def normalize_language(language: str) -> str:
+    language = (language or "").lower()
+    return LANGUAGE_ALIASES.get(language, language)
+
+
+def java_main_class(code: str) -> str:
+    """The public class (javac requires the file to be named after it), else the class declaring main()."""
+    match = _PUBLIC_CLASS.search(code or "")
+    if match:
+        return match.group(1)
+    main = _JAVA_MAIN.search(code or "")
+    classes = [m for m in _CLASS.finditer(code or "") if main is None or m.start() < main.start()]
+    return classes[-1].group(1) if classes else "Main"
+
+
+@functools.lru_cache(maxsize=None)
+def _tools_installed(language: str) -> bool:
+    toolchain = TOOLCHAINS[language]
+    tools = {toolchain["compile"][0], toolchain["run"][0]}
+    return all(shutil.which(tool) for tool in tools if not tool.startswith("{"))
+
+
+def native_language_available(language: str) -> bool:
+    """True when `language` is enabled for local judging and its compiler/runtime is installed."""
+    language = normalize_language(language)
+    if language not in TOOLCHAINS:
+        return False
+    try:
+        from django.conf import settings
+        enabled = getattr(settings, "JUDGE_NATIVE_LANGUAGES", list(TOOLCHAINS))
+    except Exception:
+        enabled = list(TOOLCHAINS)
+    return language in enabled and _tools_installed(language)
+
+
+# ---------------------------
+# Compile artifact cache
+# ---------------------------
+class ArtifactCache:
+    """
+    Directory of compiled submissions, one subdirectory per key.
+
+    A build happens in a private temporary directory which is renamed into
+    place when complete, so concurrent builders (threads or processes) never
+    see a half-written artifact; the loser of a rename race just discards its
+    copy. Using an entry refreshes its mtime, and the oldest entries beyond
+    `max_entries` are deleted after every build.
+    """
+
+    def __init__(self, root: str, max_entries: int = DEFAULT_MAX_ARTIFACTS):
+        self.root = root
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _lookup(self, path: str) -> Optional[Tuple[str, str]]:
+        if os.path.exists(os.path.join(path, _OK_MARKER)):
+            error = ""
+        elif os.path.exists(os.path.join(path, _ERROR_FILE)):
+            with open(os.path.join(path, _ERROR_FILE), encoding="utf-8") as f:
+                error = f.read()
+        else:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path, error
+
+    def get_or_build(self, key: str, build: Callable[[str], Tuple[str, bool]]) -> Tuple[Optional[str], str]:
+        """
+        Return (artifact_dir, compile_error). On a miss `build(workdir)` compiles
+        into `workdir` and returns (compile_error, cacheable); an uncacheable
+        failure (compiler timeout/crash) returns (None, compile_error).
+        """
+        final = os.path.join(self.root, key)
+        found = self._lookup(final)
+        with self._lock:
+            if found is not None:
+                self.hits += 1
+                return found
+            self.misses += 1
+
+        workdir = tempfile.mkdtemp(prefix=".build-", dir=self.root)
+        try:
+            error, cacheable = build(workdir)
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        if error and not cacheable:
+            shutil.rmtree(workdir, ignore_errors=True)
+            return None, error
+
+        if error:
+            with open(os.path.join(workdir, _ERROR_FILE), "w", encoding="utf-8") as f:
+                f.write(error)
+        else:
+            open(os.path.join(workdir, _OK_MARKER), "w").close()
+        try:
+            os.rename(workdir, final)
+        except OSError:
+            # someone else finished the same build first; theirs is identical
+            shutil.rmtree(workdir, ignore_errors=True)
+            found = self._lookup(final)
+            if found is None:
+                raise
+            return found
+        self.prune()
+        return final, error
+
+    def prune(self):
+        try:
+            entries = [e for e in os.scandir(self.root) if e.is_dir() and not e.name.startswith(".")]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[: len(entries) - self.max_entries]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"root": self.root, "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_config = None
+_cache_lock = threading.Lock()
+
+
+def get_artifact_cache() -> ArtifactCache:
+    global _cache, _cache_config
+    root = os.path.join(tempfile.gettempdir(), "judge_artifacts")
+    max_entries = DEFAULT_MAX_ARTIFACTS
+    try:
+        from django.conf import settings
+        root = getattr(settings, "JUDGE_ARTIFACT_DIR", None) or root
+        max_entries = getattr(settings, "JUDGE_ARTIFACT_CACHE_MAX_ENTRIES", max_entries)
+    except Exception:
+        pass
+    with _cache_lock:
+        if _cache_config != (root, max_entries):
+            _cache = ArtifactCache(root, max_entries)
+            _cache_config = (root, max_entries)
+        return _cache
+
+
+# ---------------------------
+# Compile-once execution plan
+# ---------------------------
+def _format(argv, **values):
+    return [part.format(**values) for part in argv]
+
+
+class NativeExecutionPlan:
+    """
+    A C/C++/Java/JavaScript submission compiled once (or fetched from the
+    artifact cache), then run against many stdins. Use as a context manager so
+    the scratch directory the program runs in gets removed.
+    """
+
+    def __init__(self, code: str, language: str):
+        self.language = normalize_language(language)
+        self.toolchain = TOOLCHAINS[self.language]
+        # unlike Python sources, C/Java/JS code is full of "\n" escapes in string literals: don't unescape it
+        self.code_src = _ensure_trailing_newline(code or "")
+        self.main_class = java_main_class(self.code_src) if self.language == "java" else ""
+        self.source_name = self.toolchain["source"].format(main=self.main_class)
+        self.compile_argv = _format(self.toolchain["compile"], source=self.source_name)
+        self.digest = hashlib.sha256(json.dumps(
+            [ARTIFACT_VERSION, self.language, self.compile_argv, self.code_src]).encode("utf-8")).hexdigest()
+        self.artifact_dir, self.compile_error = get_artifact_cache().get_or_build(self.digest, self._build)
+        self._scratch = None
+        self._scratch_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _build(self, workdir: str) -> Tuple[str, bool]:
+        with open(os.path.join(workdir, self.source_name), "w", encoding="utf-8") as f:
+            f.write(self.code_src)
+        limits = default_limits(COMPILE_TIMEOUT)
+        # javac and node need no address-space limit either (see TOOLCHAINS)
+        memory = None if "memory_bytes" in self.toolchain else COMPILE_MEMORY_BYTES
+        limits.update(memory_bytes=memory, processes=512, open_files=256,
+                      output_bytes=COMPILE_OUTPUT_BYTES, stderr_bytes=COMPILE_OUTPUT_BYTES)
+        stdout, stderr, returncode, timed_out = run_sandboxed(self.compile_argv, "", COMPILE_TIMEOUT,
+                                                              limits=limits, cwd=workdir)
+        if timed_out:
+            return f"Compilation timed out after {COMPILE_TIMEOUT}s", False
+        if returncode != 0:
+            message = (stderr.strip() or stdout.strip() or f"Compiler exited with code {returncode}")
+            message = message.replace(workdir + os.sep, "")
+            # compiler crashes (signals) may be transient; real compile errors are deterministic
+            if returncode < 0:
+                return f"Compiler crashed: {message}", False
+            return message, True
+        return "", True
+
+    def stdin_for(self, stdin_data: str) -> str:
+        stdin_data = "" if stdin_data is None else str(stdin_data)
+        return _ensure_trailing_newline(_safe_normalize_newlines(stdin_data))
+
+    def run(self, stdin_data: str, timeout: int = PER_TEST_TIMEOUT, comparator=None) -> Tuple[str, str, int, bool]:
+        """
+        Run the compiled submission with one test's stdin (stdout streams into `comparator` if given).
+
+        Returns:
+          (stdout_text, stderr_text, returncode, timed_out_bool)
+        """
+        if self.compile_error:
+            return ("", self.compile_error, 1, False)
+        stdin_fixed = self.stdin_for(stdin_data)
+        return cached_run(self.language, self.code_src, stdin_fixed, timeout,
+                          lambda: self._run_subprocess(stdin_fixed, timeout, comparator),
+                          cacheable=_is_deterministic_run)
+
+    def _limits(self, timeout: float) -> dict:
+        limits = default_limits(timeout)
+        for name in ("memory_bytes", "processes"):
+            if name in self.toolchain:
+                limits[name] = self.toolchain[name]
+        return limits
+
+    def _scratch_dir(self) -> str:
+        """Working directory for the program, so stray files it writes don't land in the artifact cache."""
+        with self._scratch_lock:
+            if self._scratch is None:
+                self._scratch = tempfile.mkdtemp(prefix="judge_")
+        return self._scratch
+
+    def _run_subprocess(self, stdin_fixed: str, timeout: int, comparator=None) -> Tuple[str, str, int, bool]:
+        argv = _format(self.toolchain["run"], dir=self.artifact_dir, main=self.main_class)
+        try:
+            return run_sandboxed(argv, stdin_fixed, timeout, limits=self._limits(timeout),
+                                 comparator=comparator, cwd=self._scratch_dir())
+        except Exception as exc:
+            return ("", f"Runner error: {str(exc)}", -1, False)
+
+    def close(self):
+        if self._scratch:
+            shutil.rmtree(self._scratch, ignore_errors=True)
+        self._scratch = None
+
+
+def check_test_cases_native(code: str, language: str, test_cases, *,
+                            max_workers: int = 1,
+                            stop_on_first_failure: bool = False,
+                            total_timeout: float = TOTAL_TIMEOUT,
+                            compare: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Same contract and result dict as tasks_helpers.check_test_cases, for the
+    languages in TOOLCHAINS: the submission is compiled once and every test
+    case runs the cached artifact. A compile error short-circuits (each test
+    reports it, none is executed).
+    """
+    if normalize_language(language) not in TOOLCHAINS:
+        return _unsupported_language(language)
+
+    fan_out_options = {
+        "compare": compare,
+        "max_workers": max_workers,
+        "stop_on_first_failure": stop_on_first_failure,
+        "total_timeout": total_timeout,
+    }
+
+    if code is None:
+        return _judge_all(test_cases, lambda tc_input, timeout, comparator: ("", "No code provided", 1, False),
+                          **fan_out_options)
+
+    try:
+        plan = NativeExecutionPlan(code, language)
+    except Exception as exc:
+        logger.exception("Could not prepare %s submission", language)
+        return {"score": 0, "results": [], "error": f"Compilation failed: {exc}", "status": "Error"}
+
+    with plan:
+        if plan.compile_error:
+            fan_out_options["max_workers"] = 1
+        return _judge_all(test_cases,
+                          lambda tc_input, timeout, comparator: plan.run(tc_input, timeout, comparator=comparator),
+                          **fan_out_options)
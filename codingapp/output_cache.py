@@ -0,0 +1,158 @@
+# codingapp/output_cache.py
+"""
+Per-test-case output cache: (language, code digest, stdin digest) -> run result.
+
+The judge result cache (judge_cache.py) only helps when code AND the whole
+test-case list are unchanged. Many questions share inputs ("read two ints,
+print the sum") and canonical solutions get run against the same stdin over and
+over, so this second level remembers single runs: a partially edited test-case
+list only executes the new or changed cases.
+
+Entries are kept in an LRU bounded by a byte budget
+(settings.JUDGE_OUTPUT_CACHE_MAX_BYTES, 0 disables). A stored run is only
+replayed when it finished within the caller's current timeout. Timeouts,
+runner/backend errors and code that looks nondeterministic (random, clocks,
+uuids) are never stored.
+
+Usage:
+    result = cached_run("python", code_src, stdin, timeout,
+                        lambda: _run_python_subprocess(code_src, stdin, timeout))
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Rough per-entry bookkeeping cost (key, tuple, OrderedDict node)
+ENTRY_OVERHEAD = 256
+
+_NONDETERMINISTIC = re.compile(
+    # the modules anywhere in an import ("import os, random", "from numpy import random")
+    r"^\s*(?:import|from)\b[^\n]*\b(?:random|time|datetime|uuid|secrets)\b"
+    r"|\bnp\.random\b|\brandom\.|\burandom\b|\bsrand\s*\(|\brand\s*\(|\btime\s*\(|\bclock\s*\("
+    r"|\bMath\.random\b|\bnew\s+Random\b|\bDate\.now\b|\bSystem\.(?:nanoTime|currentTimeMillis)\b",
+    re.MULTILINE,
+)
+
+
+def looks_nondeterministic(code: str) -> bool:
+    return bool(_NONDETERMINISTIC.search(code or ""))
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def output_key(language: str, code: str, stdin: str) -> tuple:
+    return ((language or "python").lower(), _digest(code), _digest(stdin))
+
+
+def _size_of(value) -> int:
+    return ENTRY_OVERHEAD + sum(len(v.encode("utf-8")) for v in value if isinstance(v, str))
+
+
+class OutputCache:
+    """Thread-safe LRU of run results bounded by `max_bytes`."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max(0, int(max_bytes))
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (value, elapsed, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, timeout: float = None):
+        with self._lock:
+            entry = self._data.get(key)
+            # a run that needed longer than the current limit would now time out
+            if entry is None or (timeout is not None and entry[1] > timeout):
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value: tuple, elapsed: float = 0.0) -> bool:
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[2]
+            self._data[key] = (value, elapsed, size)
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes and self._data:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes_used -= evicted
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes_used = 0
+            self.hits = self.misses = 0
+
+
+# ---------------------------
+# Per-process singleton
+# ---------------------------
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _configured_max_bytes() -> int:
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, "JUDGE_OUTPUT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+    except Exception:
+        pass
+    return DEFAULT_MAX_BYTES
+
+
+def get_output_cache() -> Optional[OutputCache]:
+    """This process' output cache, or None when the byte budget is 0."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OutputCache(_configured_max_bytes())
+    return _cache if _cache.max_bytes > 0 else None
+
+
+def cached_run(language: str, code: str, stdin: str, timeout: Optional[float],
+               execute: Callable[[], tuple], cacheable: Callable[[tuple], bool] = None) -> tuple:
+    """
+    Return the stored result of running `code` on `stdin`, or call `execute()`
+    and store its result when `cacheable(result)` says it is deterministic.
+    """
+    cache = get_output_cache()
+    if cache is None or looks_nondeterministic(code):
+        return execute()
+
+    key = output_key(language, code, stdin)
+    hit = cache.get(key, timeout)
+    if hit is not None:
+        return hit
+
+    started = time.monotonic()
+    result = execute()
+    elapsed = time.monotonic() - started
+    if cacheable is None or cacheable(result):
+        cache.put(key, result, elapsed)
+    return result
@@ -0,0 +1,304 @@
+# codingapp/piston_client.py
+"""
+Connection-pooled client for the Piston code-execution API.
+
+Every call used to be a bare `requests.post`, i.e. a new TCP/TLS handshake per
+test case. PistonClient keeps one keep-alive `requests.Session` per process
+with a bounded connection pool and a small retry budget, resolves each
+language's runtime version once from Piston's /runtimes endpoint, and stops
+calling a failing backend for a while (circuit breaker) instead of piling up
+timeouts on it.
+
+Usage:
+    client = get_piston_client()
+    run = client.run(code, "cpp", stdin="1 2")          # raw Piston "run" dict, raises PistonError
+    stdout, stderr = client.execute(code, "cpp", "1 2") # never raises, like run_piston_api
+    outputs = client.execute_many(code, "cpp", ["1 2", "3 4"])  # concurrent, order kept
+
+Settings (all optional):
+    PISTON_API_URL                      execute endpoint (runtimes URL is derived from it)
+    PISTON_API_TIMEOUT                  per-request timeout in seconds
+    PISTON_POOL_SIZE                    keep-alive connections / concurrent requests per process
+    PISTON_MAX_RETRIES                  retries on connection errors and 502/503/504
+    PISTON_CIRCUIT_FAILURE_THRESHOLD    consecutive failures that open the circuit
+    PISTON_CIRCUIT_RESET_TIMEOUT        seconds the circuit stays open before a trial call
+    PISTON_RUNTIMES_TTL                 seconds the runtime/version table is cached
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 8
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+DEFAULT_RUNTIMES_TTL = 3600
+# Used when /runtimes cannot be fetched or does not list the language
+ANY_VERSION = "*"
+
+
+class PistonError(Exception):
+    """Raised when Piston cannot be reached, answers with an error, or the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed     -> calls go through; `failure_threshold` failures in a row open it
+    open       -> calls are refused until `reset_timeout` seconds have passed
+    half-open  -> one trial call is let through; success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def runtimes_url_for(execute_url: str) -> str:
+    """https://host/api/v2/piston/execute -> https://host/api/v2/piston/runtimes"""
+    base = execute_url.rstrip("/")
+    if base.endswith("/execute"):
+        base = base[: -len("/execute")]
+    return base + "/runtimes"
+
+
+def _version_key(version: str):
+    return tuple(int(part) if part.isdigit() else 0 for part in str(version).split("."))
+
+
+class PistonClient:
+    """Thread-safe; share one instance per process (see get_piston_client)."""
+
+    def __init__(self, execute_url: str, timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+                 runtimes_ttl: float = DEFAULT_RUNTIMES_TTL):
+        self.execute_url = execute_url
+        self.runtimes_url = runtimes_url_for(execute_url)
+        self.timeout = float(timeout)
+        self.pool_size = max(1, int(pool_size))
+        self.runtimes_ttl = float(runtimes_ttl)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        retry = Retry(
+            total=max(0, int(max_retries)),
+            connect=max(0, int(max_retries)),
+            read=0,  # a read timeout means the program ran; don't run it again
+            status=max(0, int(max_retries)),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            backoff_factor=0.2,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._runtimes = None
+        self._runtimes_at = 0.0
+        self._runtimes_lock = threading.Lock()
+
+    # ---------------------------
+    # Runtime / version resolution
+    # ---------------------------
+    def runtimes(self) -> Dict[str, str]:
+        """Map of language name and aliases -> newest installed version (cached)."""
+        with self._runtimes_lock:
+            fresh = self._runtimes is not None and time.monotonic() - self._runtimes_at < self.runtimes_ttl
+            if not fresh:
+                try:
+                    resp = self.session.get(self.runtimes_url, timeout=self.timeout)
+                    resp.raise_for_status()
+                    self._runtimes = self._parse_runtimes(resp.json())
+                except Exception as exc:
+                    logger.warning("Could not fetch Piston runtimes (%s); using version '*'", exc)
+                    # keep a stale table if we have one, and retry on the next TTL
+                    if self._runtimes is None:
+                        self._runtimes = {}
+                self._runtimes_at = time.monotonic()
+            return self._runtimes
+
+    @staticmethod
+    def _parse_runtimes(data) -> Dict[str, str]:
+        table = {}
+        for runtime in data or []:
+            language = str(runtime.get("language", "")).lower()
+            version = runtime.get("version")
+            if not language or not version:
+                continue
+            for name in [language] + [str(a).lower() for a in runtime.get("aliases") or []]:
+                if name not in table or _version_key(version) > _version_key(table[name]):
+                    table[name] = version
+        return table
+
+    def resolve_version(self, language: str) -> str:
+        return self.runtimes().get((language or "").lower(), ANY_VERSION)
+
+    def warm(self):
+        """Fetch the runtime table now instead of on the first submission."""
+        self.runtimes()
+
+    # ---------------------------
+    # Execution
+    # ---------------------------
+    def run(self, code: str, language: str, stdin: str = "", timeout: float = None,
+            filename: str = "solution") -> dict:
+        """
+        Execute one program. Returns Piston's "run" dict (stdout, stderr, code, ...).
+        Raises PistonError on transport/HTTP errors or while the circuit is open.
+        """
+        if not self.breaker.allow():
+            raise PistonError("Piston backend unavailable (circuit open)")
+
+        payload = {
+            "language": language,
+            "version": self.resolve_version(language),
+            "files": [{"name": filename, "content": code}],
+            "stdin": stdin or "",
+        }
+        request_timeout = self.timeout if timeout is None else min(self.timeout, timeout)
+        try:
+            resp = self.session.post(self.execute_url, json=payload, timeout=request_timeout)
+            if resp.status_code >= 500:
+                raise PistonError(f"Piston returned HTTP {resp.status_code}")
+        except PistonError:
+            self.breaker.record_failure()
+            raise
+        except requests.exceptions.RequestException as exc:
+            self.breaker.record_failure()
+            raise PistonError(str(exc)) from exc
+        except Exception as exc:
+            # anything else (e.g. an unwrapped urllib3 error) still ends a half-open trial
+            self.breaker.record_failure()
+            raise PistonError(f"Piston request failed: {exc}") from exc
+        self.breaker.record_success()
+
+        # 4xx (e.g. unknown language) is the caller's problem, not the backend's
+        try:
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as exc:
+            raise PistonError(str(exc)) from exc
+        if not isinstance(data, dict):
+            return {}
+        compile_info = data.get("compile") or {}
+        run_info = dict(data.get("run") or {})
+        if compile_info.get("code") not in (None, 0) and not run_info.get("stderr"):
+            run_info["stderr"] = compile_info.get("stderr") or compile_info.get("output") or ""
+        return run_info
+
+    def execute(self, code: str, language: str, stdin: str = "", timeout: float = None,
+                filename: str = "solution") -> Tuple[str, str]:
+        """Like run(), but returns stripped (stdout, stderr) and reports failures in stderr."""
+        try:
+            run_info = self.run(code, language, stdin, timeout=timeout, filename=filename)
+        except PistonError as exc:
+            logger.warning("Piston API call failed: %s", exc)
+            return "", f"Piston API Error: {exc}"
+        return (run_info.get("stdout") or "").strip(), (run_info.get("stderr") or "").strip()
+
+    def execute_many(self, code: str, language: str, stdins: List[str],
+                     timeout: float = None) -> List[Tuple[str, str]]:
+        """execute() for every stdin concurrently over the pooled connections; order is preserved."""
+        stdins = list(stdins)
+        if len(stdins) <= 1:
+            return [self.execute(code, language, s, timeout=timeout) for s in stdins]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(stdins))) as executor:
+            return list(executor.map(lambda s: self.execute(code, language, s, timeout=timeout), stdins))
+
+    def close(self):
+        self.session.close()
+
+
+# ---------------------------
+# Per-process singleton
+# ---------------------------
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_piston_client() -> Optional[PistonClient]:
+    """
+    Return this process' PistonClient, or None when PISTON_API_URL is not set.
+
+    Re-created after a fork (sockets must not be shared with the parent) and
+    when the configured URL changes.
+    """
+    global _client, _client_key
+    from django.conf import settings
+
+    url = getattr(settings, "PISTON_API_URL", None)
+    if not url:
+        return None
+
+    key = (os.getpid(), url)
+    with _client_lock:
+        if _client is None or _client_key != key:
+            _client = PistonClient(
+                url,
+                timeout=getattr(settings, "PISTON_API_TIMEOUT", DEFAULT_TIMEOUT),
+                pool_size=getattr(settings, "PISTON_POOL_SIZE", DEFAULT_POOL_SIZE),
+                max_retries=getattr(settings, "PISTON_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+                failure_threshold=getattr(settings, "PISTON_CIRCUIT_FAILURE_THRESHOLD",
+                                          DEFAULT_FAILURE_THRESHOLD),
+                reset_timeout=getattr(settings, "PISTON_CIRCUIT_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT),
+                runtimes_ttl=getattr(settings, "PISTON_RUNTIMES_TTL", DEFAULT_RUNTIMES_TTL),
+            )
+            _client_key = key
+        return _client
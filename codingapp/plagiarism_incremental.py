@@ -0,0 +1,300 @@
+# codingapp/plagiarism_incremental.py
+"""
+Incremental plagiarism maintenance: keep both sides of every comparison current.
+
+A plagiarism check compares a new submission with its likely matches, which
+used to update only the newcomer: if B copies A later, A's best-match maxima
+(and with them A's plagiarism_percent, score and AssessmentSession totals)
+stayed stale until someone ran `recompute_plagiarism`. After a check,
+tasks.check_assessment_plagiarism now also runs
+
+    changed = raise_peer_maxima(similarities)          # {peer id: (token, structural)} to the newcomer
+    changed += recompute_submissions(replaced_match_peers(submission, old_fingerprint))
+    refresh_session_totals(assessment_id, {s.user_id for s in changed} | {submission.user_id})
+
+refresh_session_totals also maintains what the result page shows; a
+session's result is first computed when it ends (finalize_session).
+
+Maxima only grow when a submission is added, so raising them is enough;
+when a student replaces their code, the peers whose best token match was
+the old code are recomputed in full. Only the affected rows are read
+and written.
+"""
+
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Max, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .fingerprint_index import find_candidates, plagiarism_peers
+from .models import AssessmentSession, AssessmentSubmission, QuizSubmission
+from .utils import (apply_plagiarism_penalty, code_features, combine_plagiarism_signals, decode_ast_sequence,
+                    decode_fingerprint, peer_similarities, penalty_factor_from_plagiarism)
+
+logger = logging.getLogger(__name__)
+
+# similarity changes below this are rounding noise, not a new best match
+EPSILON = 1e-6
+SIGNAL_FIELDS = ["plagiarism_percent", "token_similarity", "structural_similarity",
+                 "embedding_similarity", "ai_generated_prob", "score"]
+# what rescore() derives from the maxima (which only raise_peer_maxima's GREATEST update writes)
+RESCORE_FIELDS = ["plagiarism_percent", "embedding_similarity", "ai_generated_prob", "score"]
+
+
+def compare_with_peers(submission: AssessmentSubmission, fingerprint: Optional[set] = None,
+                       ast_sequence: Optional[List[int]] = None
+                       ) -> Tuple[Optional[Dict], Dict[int, Tuple[float, float]]]:
+    """
+    Plagiarism signals of `submission`'s code against the likely matches among
+    the other students' submissions of its question (as compute_ensemble_plagiarism
+    returns them; None when there is nobody to compare with), and its
+    (token, structural) similarity to each of those peers by submission id.
+    Fingerprint and structural sequence default to the stored ones.
+    """
+    code = submission.code or ""
+    if fingerprint is None:
+        fingerprint = decode_fingerprint(submission.fingerprint)
+        if fingerprint is None:
+            fingerprint = code_features(code).fingerprint
+    if ast_sequence is None:
+        ast_sequence = decode_ast_sequence(submission.ast_sequence)
+        if ast_sequence is None:
+            ast_sequence = code_features(code).structure(submission.language)
+
+    # every peer is considered; LSH buckets pick the likely matches for the expensive comparison
+    peers = plagiarism_peers(
+        submission.assessment_id, submission.question_id, submission.user_id, fingerprint,
+        limit=getattr(settings, "PLAGIARISM_MAX_CANDIDATES", 500),
+        exhaustive_below=getattr(settings, "PLAGIARISM_EXHAUSTIVE_BELOW", 50),
+    )
+    if not peers:
+        return None, {}
+    pairs = peer_similarities(code, [peer_code for _, peer_code, _, _ in peers], fingerprint=fingerprint,
+                              other_fingerprints=[fp for _, _, fp, _ in peers], ast_sequence=ast_sequence,
+                              other_ast_sequences=[seq for _, _, _, seq in peers], language=submission.language)
+    best_token = max(t for t, _ in pairs)
+    best_struct = max(s for _, s in pairs)
+    # a stored embedding similarity is the real one; otherwise the structural fallback
+    best_embed = submission.embedding_similarity if submission.embedding else best_struct
+    signals = combine_plagiarism_signals(code, best_token, best_struct, best_embed or 0.0)
+    return signals, {peer_id: pair for (peer_id, _, _, _), pair in zip(peers, pairs)}
+
+
+def _penalized(submission: AssessmentSubmission, plagiarism_percent: float) -> float:
+    raw_marks = submission.raw_score if submission.raw_score is not None else submission.score
+    try:
+        return apply_plagiarism_penalty(raw_marks=raw_marks, plagiarism_percent=plagiarism_percent,
+                                        code=submission.code, question=submission.question)
+    except Exception:
+        logger.exception("apply_plagiarism_penalty failed for submission %s", submission.pk)
+        return raw_marks
+
+
+def rescore(submission: AssessmentSubmission) -> None:
+    """
+    Recompute plagiarism_percent, ai_generated_prob and score (in memory) from
+    the stored similarity maxima; left alone while they are unknown.
+    """
+    if submission.token_similarity is None or submission.structural_similarity is None:
+        return
+    if not submission.embedding:
+        submission.embedding_similarity = submission.structural_similarity
+    signals = combine_plagiarism_signals(submission.code or "", submission.token_similarity,
+                                         submission.structural_similarity, submission.embedding_similarity or 0.0)
+    submission.plagiarism_percent = float(signals["plag_percent"])
+    submission.ai_generated_prob = float(signals["ai_generated_prob"])
+    submission.score = _penalized(submission, submission.plagiarism_percent)
+
+
+def rescore_submissions(submission_ids: Iterable[int]) -> List[AssessmentSubmission]:
+    """
+    rescore() and save the given submissions; returns the ones saved. The
+    maxima are only read: a row is written (RESCORE_FIELDS) while its code and
+    maxima are still the ones read, since a resubmission is scored on its own
+    and whoever raised the maxima meanwhile rescores the row after them.
+    """
+    subs = list(AssessmentSubmission.objects.filter(pk__in=list(submission_ids)).select_related("question"))
+    saved = []
+    for sub in subs:
+        rescore(sub)
+        written = AssessmentSubmission.objects.filter(
+            pk=sub.pk, code=sub.code,
+            token_similarity=sub.token_similarity, structural_similarity=sub.structural_similarity,
+        ).update(**{field: getattr(sub, field) for field in RESCORE_FIELDS})
+        if written:
+            saved.append(sub)
+    return saved
+
+
+def raise_peer_maxima(similarities: Dict[int, Tuple[float, float]]) -> List[AssessmentSubmission]:
+    """
+    Fold a new submission's (token, structural) similarity to each peer into
+    the peers' stored maxima and rescore the peers whose maxima rose; returns
+    those. Peers whose own check has not run yet are skipped: it will see the
+    new submission anyway.
+    """
+    if not similarities:
+        return []
+    stored = (AssessmentSubmission.objects
+              .filter(pk__in=list(similarities), token_similarity__isnull=False, structural_similarity__isnull=False)
+              .values_list("id", "token_similarity", "structural_similarity"))
+    raised = [sid for sid, token, structure in stored
+              if similarities[sid][0] > token + EPSILON or similarities[sid][1] > structure + EPSILON]
+    for sid in raised:
+        token, structure = similarities[sid]
+        # GREATEST in SQL: concurrent checks raising the same peer can't lower each other's maximum
+        AssessmentSubmission.objects.filter(pk=sid).update(
+            token_similarity=Greatest("token_similarity", Value(token)),
+            structural_similarity=Greatest("structural_similarity", Value(structure)),
+        )
+    return rescore_submissions(raised) if raised else []
+
+
+def replaced_match_peers(submission: AssessmentSubmission, old_fingerprint: Optional[set]) -> List[int]:
+    """
+    Other students' submissions whose best token match may have been
+    `submission`'s previous code (fingerprint `old_fingerprint`): their stored
+    token_similarity is no higher than their similarity to that code.
+    """
+    if not old_fingerprint:
+        return []
+    candidates = {sid: similarity for sid, _, similarity in find_candidates(
+        submission.assessment_id, submission.question_id, old_fingerprint, exclude_user_id=submission.user_id)}
+    if not candidates:
+        return []
+    stored = (AssessmentSubmission.objects
+              .filter(pk__in=list(candidates), token_similarity__isnull=False)
+              .values_list("id", "token_similarity"))
+    return [sid for sid, token in stored if token <= candidates[sid] + EPSILON]
+
+
+def recompute_submissions(submission_ids: Iterable[int]) -> List[AssessmentSubmission]:
+    """
+    Recompute the plagiarism signals and score of the given (already checked)
+    submissions in full; returns the ones saved. Like rescore_submissions, a row
+    is only written while its code and maxima are still the ones read.
+    """
+    subs = list(AssessmentSubmission.objects
+                .filter(pk__in=list(submission_ids), token_similarity__isnull=False)
+                .select_related("question"))
+    saved = []
+    for sub in subs:
+        read = {"code": sub.code, "token_similarity": sub.token_similarity,
+                "structural_similarity": sub.structural_similarity}
+        signals, _ = compare_with_peers(sub)
+        if signals is None:
+            sub.token_similarity = sub.structural_similarity = sub.ai_generated_prob = 0.0
+            sub.plagiarism_percent = 0.0
+            if not sub.embedding:
+                sub.embedding_similarity = 0.0
+        else:
+            sub.token_similarity = float(signals["token_similarity"])
+            sub.structural_similarity = float(signals["structural_similarity"])
+            sub.embedding_similarity = float(signals["embedding_similarity"])
+            sub.ai_generated_prob = float(signals["ai_generated_prob"])
+            sub.plagiarism_percent = float(signals["plag_percent"])
+        sub.score = _penalized(sub, sub.plagiarism_percent)
+        if AssessmentSubmission.objects.filter(pk=sub.pk, **read).update(
+                **{field: getattr(sub, field) for field in SIGNAL_FIELDS}):
+            saved.append(sub)
+    return saved
+
+
+def _raw_marks(raw_score: Optional[float], score, output: Optional[str]) -> float:
+    # same fallback as `recompute_plagiarism --apply-assessment-penalties` for rows without raw_score;
+    # `score` is already penalized, so it is only used when the output cannot be read
+    if raw_score is not None:
+        return float(raw_score)
+    try:
+        results = json.loads(output or "[]")
+        return 5.0 if results and all(r.get("status") == "Accepted" for r in results) else 0.0
+    except Exception:
+        return 5.0 if score == 5 else 0.0
+
+
+SESSION_RESULT_FIELDS = ["penalty_percent", "penalty_factor", "raw_total", "penalized_total", "penalty_applied",
+                         "plagiarism_per_question", "plagiarism_avg", "quiz_score", "coding_raw_total",
+                         "coding_penalized_total"]
+
+
+def refresh_session_totals(assessment_id: int, user_ids: Iterable[int]) -> int:
+    """
+    Recompute the result fields of the AssessmentSessions of `user_ids` in the
+    assessment: the penalty (penalty_percent, penalty_factor, raw_total,
+    penalized_total, penalty_applied, as `recompute_plagiarism
+    --apply-assessment-penalties` computes them) and what assessment_result
+    shows (per-question and average plagiarism, quiz score, coding totals).
+    Reads the stored per-submission signals: one query for the submissions,
+    one for the quiz. Returns how many sessions changed.
+    """
+    user_ids = set(user_ids)
+    sessions = list(AssessmentSession.objects.filter(assessment_id=assessment_id, user_id__in=user_ids)
+                    .select_related("assessment"))
+    if not sessions:
+        return 0
+
+    per_question = defaultdict(dict)
+    coding_raw = defaultdict(float)
+    coding_penalized = defaultdict(float)
+    rows = AssessmentSubmission.objects.filter(assessment_id=assessment_id, user_id__in=user_ids)
+    for uid, question_id, percent, raw_score, score, output in rows.values_list(
+            "user_id", "question_id", "plagiarism_percent", "raw_score", "score", "output"):
+        per_question[uid][str(question_id)] = round(float(percent or 0.0), 2)
+        coding_raw[uid] += _raw_marks(raw_score, score, output)
+        coding_penalized[uid] += float(score or 0.0)
+
+    quiz = sessions[0].assessment.quiz_id
+    best_quiz = {}
+    if quiz:
+        best_quiz = dict(QuizSubmission.objects.filter(quiz_id=quiz, user_id__in=user_ids)
+                         .values_list("user_id").annotate(best=Max("score")))
+
+    changed = []
+    for session in sessions:
+        uid = session.user_id
+        plagiarism = per_question[uid]
+        max_plag = max(plagiarism.values(), default=0.0)
+        quiz_score = float(best_quiz.get(uid) or 0.0)
+        raw_total = round(quiz_score + coding_raw[uid], 2)
+        factor = penalty_factor_from_plagiarism(max_plag)
+        values = {
+            "penalty_percent": round(max_plag, 2),
+            "penalty_factor": factor,
+            "raw_total": raw_total,
+            "penalized_total": round(raw_total * factor, 2),
+            "penalty_applied": factor < 1.0,
+            "plagiarism_per_question": plagiarism,
+            "plagiarism_avg": round(sum(plagiarism.values()) / len(plagiarism), 2) if plagiarism else 0.0,
+            "quiz_score": quiz_score,
+            "coding_raw_total": round(coding_raw[uid], 2),
+            "coding_penalized_total": round(coding_penalized[uid], 2),
+        }
+        if any(getattr(session, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(session, field, value)
+            changed.append(session)
+    AssessmentSession.objects.bulk_update(changed, SESSION_RESULT_FIELDS)
+    return len(changed)
+
+
+def finalize_session(session: AssessmentSession) -> bool:
+    """
+    Compute the result of an ended session once: the first call claims it
+    (finalized_at, set atomically) and fills in its result fields; later
+    calls do nothing and return False. Afterwards the plagiarism checks keep
+    the fields current through refresh_session_totals.
+    """
+    if session.finalized_at is not None:
+        return False
+    now = timezone.now()
+    if not AssessmentSession.objects.filter(pk=session.pk, finalized_at__isnull=True).update(finalized_at=now):
+        session.refresh_from_db()
+        return False
+    refresh_session_totals(session.assessment_id, [session.user_id])
+    session.refresh_from_db()
+    return True
@@ -0,0 +1,164 @@
+# codingapp/plagiarism_matrix.py
+"""
+All-pairs plagiarism signals for a whole (assessment, question) group at once.
+
+compute_ensemble_plagiarism(code, others) re-fingerprints and re-parses every
+peer, so recomputing a group of n submissions costs n^2 tokenizations and AST
+parses. ensemble_signals() computes (or reuses the stored) fingerprint and AST
+node sequence of each submission once and returns, for every submission, the
+same dict compute_ensemble_plagiarism would (used by `recompute_plagiarism
+--engine=matrix`):
+
+    signals = ensemble_signals([s.code for s in subs], fingerprints=[...])
+
+- token similarity: all Jaccard similarities come from one sparse product of
+  the submission x fingerprint-hash incidence matrix with its transpose
+  (SciPy when installed, an inverted hash list otherwise);
+- structural similarity: the same product over the n-gram shingles of the
+  submissions' structural sequences (utils.structural_sequence / ast_shingles);
+- the per-code inputs (fingerprints, sequences, token counts, AI-heuristic
+  counts) come from one utils.CodeFeatures pass per distinct code
+  (batch_features), and the AI score and final combination are computed for
+  all submissions at once (ai_scores, combine_signal_arrays).
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:  # optional: the inverted-list fallback gives the same counts
+    sparse = None
+
+from .utils import CodeFeatures, ast_shingles
+
+
+def shared_hash_matrix(fingerprints: List[set]) -> np.ndarray:
+    """n x n matrix of the number of items (hashes, shingles) each pair of sets shares (diagonal = sizes)."""
+    n = len(fingerprints)
+    columns = {}
+    rows, cols = [], []
+    for i, fingerprint in enumerate(fingerprints):
+        for h in fingerprint or ():
+            rows.append(i)
+            cols.append(columns.setdefault(h, len(columns)))
+    if sparse is not None:
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, len(columns)),
+        )
+        return (incidence @ incidence.T).toarray().astype(np.int64)
+
+    shared = np.zeros((n, n), dtype=np.int64)
+    postings = {}
+    for i, col in zip(rows, cols):
+        postings.setdefault(col, []).append(i)
+    for members in postings.values():
+        idx = np.asarray(members)
+        shared[np.ix_(idx, idx)] += 1
+    return shared
+
+
+def token_similarity_matrix(fingerprints: List[set]) -> np.ndarray:
+    """n x n Jaccard similarities of the sets (utils.fingerprint_similarity for every pair)."""
+    shared = shared_hash_matrix(fingerprints)
+    sizes = np.diag(shared).copy()
+    union = sizes[:, None] + sizes[None, :] - shared
+    nonempty = (sizes[:, None] > 0) & (sizes[None, :] > 0) & (union > 0)
+    similarity = np.zeros(shared.shape, dtype=np.float64)
+    np.divide(shared, union, out=similarity, where=nonempty)
+    return similarity
+
+
+def structural_similarity_matrix(sequences: List[List[int]]) -> np.ndarray:
+    """n x n utils.ast_profile_similarity (Jaccard over AST shingles) for every pair of sequences."""
+    return token_similarity_matrix([ast_shingles(seq) for seq in sequences])
+
+
+def batch_features(codes: List[str]) -> List[CodeFeatures]:
+    """utils.CodeFeatures of each code, computed once per distinct code (bypassing the per-process LRU)."""
+    by_code = {}
+    return [by_code[code] if code in by_code else by_code.setdefault(code, CodeFeatures(code))
+            for code in (c or "" for c in codes)]
+
+
+def ai_scores(features: List[CodeFeatures]) -> np.ndarray:
+    """utils.heuristic_ai_score of every code, from its feature counts, as one vector."""
+    counts = np.array([(f.text_tokens, f.unique_text_tokens, f.short_text_tokens, f.boilerplate_markers)
+                       for f in features], dtype=np.float64).reshape(-1, 4)
+    diversity = counts[:, 1] / np.maximum(1.0, counts[:, 0])
+    score = ((0.55 * (1.0 - np.minimum(1.0, diversity)))
+             + (0.3 * np.minimum(1.0, counts[:, 3] / 3.0))
+             + (0.15 * np.minimum(1.0, counts[:, 2] / 15.0)))
+    score = np.clip(score, 0.0, 1.0)
+    score[np.array([not f.code for f in features], dtype=bool)] = 0.0
+    return score
+
+
+def combine_signal_arrays(features: List[CodeFeatures], best_token: np.ndarray, best_struct: np.ndarray,
+                          best_embed: np.ndarray, *, short_length_threshold: int = 25, token_weight: float = 0.4,
+                          struct_weight: float = 0.35, embed_weight: float = 0.25,
+                          ai_boost: float = 0.15) -> List[Dict]:
+    """utils.combine_plagiarism_signals (same arguments and defaults) for every code at once."""
+    ai = ai_scores(features)
+    num_tokens = np.array([f.num_tokens for f in features], dtype=np.float64)
+    length_factor = np.ones(len(features), dtype=np.float64)
+    if short_length_threshold > 0:
+        short = num_tokens < short_length_threshold
+        length_factor[short] = np.minimum(1.0, num_tokens[short] / float(short_length_threshold))
+
+    base = (best_token * token_weight) + (best_struct * struct_weight) + (best_embed * embed_weight)
+    base = base * (1.0 + ai_boost * ai)
+    base = base * length_factor
+    percent = np.minimum(1.0, base) * 100.0
+    return [
+        {
+            "token_similarity": round(float(best_token[i]), 4),
+            "structural_similarity": round(float(best_struct[i]), 4),
+            "embedding_similarity": round(float(best_embed[i]), 4),
+            "ai_generated_prob": round(float(ai[i]), 4),
+            "plag_percent": round(float(percent[i]), 2),
+        }
+        for i in range(len(features))
+    ]
+
+
+def ensemble_signals(codes: List[str], fingerprints: Optional[List[Optional[set]]] = None,
+                     ast_sequences: Optional[List[Optional[List[int]]]] = None,
+                     languages: Optional[List[str]] = None,
+                     embedding_similarities: Optional[List[Optional[float]]] = None, **weights) -> List[Dict]:
+    """
+    compute_ensemble_plagiarism(codes[i], <the other non-empty codes>) for every i,
+    computed all-pairs. `fingerprints` and `ast_sequences` (aligned with codes,
+    None entries allowed) are reused instead of re-fingerprinting / re-parsing;
+    missing sequences are computed for `languages` (default: all Python).
+    Known best embedding similarities (None entries allowed) replace the
+    structural fallback for the embedding component.
+    `weights` are passed through to combine_signal_arrays.
+    """
+    codes = [c or "" for c in codes]
+    n = len(codes)
+    if not n:
+        return []
+    features = batch_features(codes)
+    fingerprints = list(fingerprints or [None] * n)
+    fingerprints = [fp if fp is not None else f.fingerprint for fp, f in zip(fingerprints, features)]
+    ast_sequences = list(ast_sequences or [None] * n)
+    languages = list(languages or ["python"] * n)
+    ast_sequences = [seq if seq is not None else f.structure(language)
+                     for seq, f, language in zip(ast_sequences, features, languages)]
+    peers = np.array([bool(c) for c in codes], dtype=bool)
+
+    tokens = token_similarity_matrix(fingerprints)
+    tokens[:, ~peers] = 0.0
+    np.fill_diagonal(tokens, 0.0)
+    best_token = tokens.max(axis=1)
+    structure = structural_similarity_matrix(ast_sequences)
+    structure[:, ~peers] = 0.0
+    np.fill_diagonal(structure, 0.0)
+    best_struct = structure.max(axis=1)
+
+    embedding_similarities = list(embedding_similarities or [None] * n)
+    best_embed = np.array([best_struct[i] if value is None else value
+                           for i, value in enumerate(embedding_similarities)], dtype=np.float64)
+    return combine_signal_arrays(features, best_token, best_struct, best_embed, **weights)
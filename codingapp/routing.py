@@ -0,0 +1,9 @@
+# codingapp/routing.py
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path("ws/assessments/<int:assessment_id>/leaderboard/", consumers.LeaderboardConsumer.as_asgi(),
+         name="assessment_leaderboard_ws"),
+]
@@ -0,0 +1,311 @@
+# codingapp/sandbox.py
+"""
+Resource-limited execution of untrusted submissions (POSIX).
+
+A wall-clock timeout alone does not protect the Celery worker: a submission can
+allocate gigabytes, fork, open thousands of files or print an endless stream
+that we would buffer in full. Every run therefore gets Linux rlimits
+(CPU seconds, address space, open files, processes) and its stdout/stderr are
+read incrementally with a hard byte cap; the process is killed as soon as the
+cap is exceeded.
+
+Each run reports CPU time and peak RSS (from wait4's rusage) on the returned
+RunResult, which still unpacks as (stdout, stderr, returncode, timed_out).
+Linux carries the RSS high-water mark of the forking process across exec, so
+a spawned program's peak is only known when it exceeds the spawner's own
+(peak_rss_kb is None otherwise).
+
+Like judge_worker.py this module must not import Django or anything from
+codingapp: the warm worker script imports it directly.
+"""
+
+import codecs
+import math
+import os
+import select
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from .comparators import CONTEXT_BYTES
+except ImportError:  # imported by the judge worker script
+    from comparators import CONTEXT_BYTES
+
+# Default limits per run; cpu seconds are derived from the test's timeout
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_OPEN_FILES = 64
+DEFAULT_PROCESSES = 64
+DEFAULT_OUTPUT_BYTES = 1024 * 1024
+DEFAULT_STDERR_BYTES = 64 * 1024
+
+_READ_CHUNK = 65536
+
+# Exec wrappers for run_sandboxed (see limited_argv)
+_PRLIMIT = shutil.which("prlimit")
+_PRLIMIT_OPTIONS = (("RLIMIT_CPU", "cpu"), ("RLIMIT_AS", "as"), ("RLIMIT_NOFILE", "nofile"),
+                    ("RLIMIT_NPROC", "nproc"), ("RLIMIT_CORE", "core"))
+_EXEC_WRAPPER = (
+    "import os, resource, sys\n"
+    "for pair in filter(None, sys.argv[1].split(',')):\n"
+    "    which, value = map(int, pair.split('='))\n"
+    "    try:\n"
+    "        resource.setrlimit(which, (value, value))\n"
+    "    except (ValueError, OSError):\n"
+    "        pass\n"
+    "os.execvp(sys.argv[2], sys.argv[2:])\n"
+)
+
+_SIGNAL_MESSAGES = {
+    getattr(signal, "SIGXCPU", None): "CPU time limit exceeded",
+    getattr(signal, "SIGKILL", None): "Killed (resource limit exceeded)",
+    getattr(signal, "SIGSEGV", None): "Segmentation fault (memory limit exceeded?)",
+}
+
+
+class RunResult(tuple):
+    """
+    (stdout, stderr, returncode, timed_out) plus cpu_time (s), peak_rss_kb,
+    truncated (output cap hit) and aborted (killed early on an output mismatch).
+    """
+
+    def __new__(cls, stdout, stderr, returncode, timed_out, cpu_time=None, peak_rss_kb=None,
+                truncated=False, aborted=False):
+        result = super().__new__(cls, (stdout, stderr, returncode, timed_out))
+        result.cpu_time = cpu_time
+        result.peak_rss_kb = peak_rss_kb
+        result.truncated = truncated
+        result.aborted = aborted
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.cpu_time, self.peak_rss_kb, self.truncated, self.aborted)
+
+
+def sandbox_supported() -> bool:
+    return resource is not None and hasattr(os, "wait4")
+
+
+def default_limits(timeout: float) -> dict:
+    return {
+        "cpu_seconds": int(math.ceil(float(timeout))) + 1,
+        "memory_bytes": DEFAULT_MEMORY_BYTES,
+        "open_files": DEFAULT_OPEN_FILES,
+        "processes": DEFAULT_PROCESSES,
+        "output_bytes": DEFAULT_OUTPUT_BYTES,
+    }
+
+
+def rlimit_pairs(limits: dict) -> list:
+    """(resource, value) pairs for `limits`, each capped at this process's hard limit (inherited by children)."""
+    if resource is None:
+        return []
+    pairs = (
+        (resource.RLIMIT_CPU, limits.get("cpu_seconds")),
+        (resource.RLIMIT_AS, limits.get("memory_bytes")),
+        (resource.RLIMIT_NOFILE, limits.get("open_files")),
+        (getattr(resource, "RLIMIT_NPROC", None), limits.get("processes")),
+        (resource.RLIMIT_CORE, 0),
+    )
+    capped = []
+    for which, value in pairs:
+        if which is None or value is None:
+            continue
+        try:
+            _, hard = resource.getrlimit(which)
+        except (ValueError, OSError):
+            continue
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        capped.append((which, int(value)))
+    return capped
+
+
+def apply_rlimits(limits: dict):
+    """Call in the child right before running user code. Limits above the hard limit are skipped."""
+    for which, value in rlimit_pairs(limits):
+        try:
+            resource.setrlimit(which, (value, value))
+        except (ValueError, OSError):
+            pass
+
+
+def limited_argv(argv, limits: dict) -> list:
+    """
+    `argv` behind an exec wrapper that sets the rlimits and then execs it, so
+    no Python code has to run in the forked child (preexec_fn is not safe
+    in a threaded parent): util-linux prlimit when installed, otherwise a
+    short-lived interpreter that calls setrlimit and execs.
+    """
+    pairs = rlimit_pairs(limits)
+    if not pairs:
+        return list(argv)
+    if _PRLIMIT:
+        names = {getattr(resource, attr, None): option for attr, option in _PRLIMIT_OPTIONS}
+        return ([_PRLIMIT] + [f"--{names[which]}={value}:{value}" for which, value in pairs if which in names]
+                + ["--"] + list(argv))
+    spec = ",".join(f"{which}={value}" for which, value in pairs)
+    return [sys.executable, "-S", "-c", _EXEC_WRAPPER, spec] + list(argv)
+
+
+def communicate(pid: int, stdin_fd, stdout_fd, stderr_fd, stdin_bytes: bytes, timeout: float,
+                max_output: int = DEFAULT_OUTPUT_BYTES, max_stderr: int = DEFAULT_STDERR_BYTES,
+                comparator=None, inherited_rss_kb: int = 0) -> RunResult:
+    """
+    Feed stdin and drain stdout/stderr of child `pid` (its own process group)
+    until it exits, `timeout` passes, or stdout exceeds `max_output` bytes.
+    Closes the given fds and reaps the child. A peak RSS not above
+    `inherited_rss_kb` (the forking process's own, for a child that exec'd)
+    may not be the child's and is reported as None.
+
+    With a comparators.OutputComparator, stdout is compared as it arrives and
+    the child is killed CONTEXT_BYTES after the first mismatch (result.aborted).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    abort_at = None
+    aborted = False
+    chunks = {stdout_fd: [], stderr_fd: []}
+    sizes = {stdout_fd: 0, stderr_fd: 0}
+    caps = {stdout_fd: max_output, stderr_fd: max_stderr}
+    open_readers = [stdout_fd, stderr_fd]
+    pending_in = stdin_bytes or b""
+    writer = [stdin_fd] if pending_in else []
+    if not pending_in:
+        os.close(stdin_fd)
+
+    deadline = time.monotonic() + float(timeout)
+    timed_out = False
+    truncated = False
+    try:
+        while open_readers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            readable, writable, _ = select.select(open_readers, writer, [], remaining)
+            for fd in writable:
+                try:
+                    # <= PIPE_BUF bytes never blocks once select reports the pipe writable
+                    written = os.write(fd, pending_in[:select.PIPE_BUF])
+                    pending_in = pending_in[written:]
+                except OSError:
+                    pending_in = b""
+                if not pending_in:
+                    os.close(fd)
+                    writer = []
+            for fd in readable:
+                data = os.read(fd, _READ_CHUNK)
+                if not data:
+                    open_readers.remove(fd)
+                    os.close(fd)
+                    continue
+                room = caps[fd] - sizes[fd]
+                if room > 0:
+                    chunks[fd].append(data[:room])
+                sizes[fd] += len(data)
+                if fd != stdout_fd:
+                    continue
+                if sizes[fd] > caps[fd]:
+                    truncated = True
+                elif comparator is not None and abort_at is None and not comparator.feed(decoder.decode(data)):
+                    abort_at = sizes[fd] + CONTEXT_BYTES
+                if abort_at is not None and sizes[fd] >= abort_at:
+                    aborted = True
+            if truncated or aborted:
+                break
+        else:
+            # the program closed stdout: everything it wrote has been compared
+            if comparator is not None:
+                if abort_at is None:
+                    comparator.feed(decoder.decode(b"", final=True))
+                comparator.finish()
+        if aborted:
+            comparator.finish()
+    finally:
+        if timed_out or truncated or aborted:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        for fd in open_readers + writer:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    _, status, usage = os.wait4(pid, 0)
+    cpu_time = round(usage.ru_utime + usage.ru_stime, 4)
+    peak_rss_kb = usage.ru_maxrss if usage.ru_maxrss > inherited_rss_kb else None
+    if timed_out:
+        return RunResult("", f"Timed out after {timeout}s", -1, True, cpu_time, peak_rss_kb)
+
+    stdout = b"".join(chunks[stdout_fd]).decode("utf-8", errors="replace")
+    stderr = b"".join(chunks[stderr_fd]).decode("utf-8", errors="replace")
+    returncode = os.waitstatus_to_exitcode(status)
+    if truncated:
+        stderr = f"Output limit exceeded: more than {max_output} bytes written to stdout\n" + stderr
+    elif returncode < 0 and not stderr.strip() and not aborted:
+        stderr = _SIGNAL_MESSAGES.get(-returncode) or f"Killed by signal {-returncode}"
+    return RunResult(stdout, stderr, returncode, False, cpu_time, peak_rss_kb, truncated, aborted)
+
+
+def run_sandboxed(argv, stdin_data: str, timeout: float, limits: dict = None, comparator=None,
+                  cwd: str = None) -> RunResult:
+    """Run `argv` (in `cwd`) with rlimits applied, streaming its output with a byte cap (and into `comparator`)."""
+    limits = limits or default_limits(timeout)
+    stdin_bytes = (stdin_data or "").encode("utf-8")
+
+    if not sandbox_supported():
+        # No rlimits/wait4 (e.g. Windows dev boxes): plain subprocess, cap applied afterwards
+        try:
+            proc = subprocess.run(argv, input=stdin_bytes, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, timeout=timeout, cwd=cwd)
+        except subprocess.TimeoutExpired:
+            return RunResult("", f"Timed out after {timeout}s", -1, True)
+        cap = limits.get("output_bytes") or DEFAULT_OUTPUT_BYTES
+        stderr = proc.stderr.decode("utf-8", errors="replace")
+        truncated = len(proc.stdout) > cap
+        if truncated:
+            stderr = f"Output limit exceeded: more than {cap} bytes written to stdout\n" + stderr
+        return RunResult(proc.stdout[:cap].decode("utf-8", errors="replace"), stderr,
+                         -9 if truncated else proc.returncode, False, truncated=truncated)
+
+    # what the child's ru_maxrss starts from: our own high-water mark, inherited across exec
+    inherited_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # own session (the whole group is killed on timeout); rlimits come from the exec wrapper
+    proc = subprocess.Popen(
+        limited_argv(argv, limits),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+        close_fds=True,
+        cwd=cwd,
+    )
+    # We reap the child ourselves with wait4 (for rusage); detach the pipe objects
+    # so Popen neither closes our fds nor tries to wait on the pid again.
+    stdin_fd, stdout_fd, stderr_fd = (os.dup(s.fileno()) for s in (proc.stdin, proc.stdout, proc.stderr))
+    for stream in (proc.stdin, proc.stdout, proc.stderr):
+        stream.close()
+    try:
+        result = communicate(proc.pid, stdin_fd, stdout_fd, stderr_fd, stdin_bytes, timeout,
+                             max_output=limits.get("output_bytes") or DEFAULT_OUTPUT_BYTES,
+                             max_stderr=limits.get("stderr_bytes") or DEFAULT_STDERR_BYTES,
+                             comparator=comparator, inherited_rss_kb=inherited_rss_kb)
+    except Exception:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            os.waitpid(proc.pid, 0)
+        except OSError:
+            pass
+        proc.returncode = -1
+        raise
+    proc.returncode = result[2]
+    return result
@@ -1,8 +1,9 @@
 # codingapp/tasks.py
 """
 Celery tasks for CodeLoop:
-- practice submission runner (via Piston)
-- assessment submission processing (testcases, plagiarism signals, penalty, save)
+- practice submission runner (local runners, Piston for other languages)
+- assessment submission processing: verdict (testcases, save) first, then plagiarism signals and penalty
+- batched code embeddings for the plagiarism embedding signal
 """
 
 import json
@@ -22,61 +23,61 @@ User = get_user_model()
 from .models import Submission, AssessmentSubmission, Question, Assessment
 
 # Try to import helpers from utils / tasks_helpers
-from .utils import compute_ensemble_plagiarism, apply_plagiarism_penalty
+from .utils import apply_plagiarism_penalty, code_features
+from .fingerprint_index import index_submission, indexed_fingerprint
+from .plagiarism_incremental import (compare_with_peers, raise_peer_maxima, recompute_submissions,
+                                     refresh_session_totals, replaced_match_peers, rescore)
+from .leaderboard import refresh_entries
+from .output_cache import cached_run
+from .comparators import comparator_lines, make_comparator
 try:
     # preferred: a lightweight runner placed in codingapp/tasks_helpers.py
-    from .tasks_helpers import check_test_cases  # type: ignore
+    from .tasks_helpers import check_test_cases, check_test_cases_compiled, fan_out_test_cases  # type: ignore
 except Exception:
     check_test_cases = None
+    check_test_cases_compiled = None
+    fan_out_test_cases = None
     logger.debug("codingapp.tasks_helpers.check_test_cases not available; will use fallback runner.")
 
 
 # ---------------------------
 # Small execution helper (Piston)
 # ---------------------------
-def run_piston_api(code: str, language: str, test_case_input: str) -> Tuple[str, str]:
+def run_piston_api(code: str, language: str, test_case_input: str, timeout: float = None) -> Tuple[str, str]:
     """
     Execute code using configured Piston API (or return error strings).
-    Returns (stdout, stderr).
+    Returns (stdout, stderr). Requests go through the process' pooled
+    PistonClient (keep-alive connections, cached runtime versions, circuit breaker);
+    repeated (code, stdin) runs are answered from the output cache.
     """
-    PISTON_URL = getattr(settings, "PISTON_API_URL", None)
-    TIMEOUT = getattr(settings, "PISTON_API_TIMEOUT", 10)
+    from .piston_client import get_piston_client
 
-    if not PISTON_URL:
+    client = get_piston_client()
+    if client is None:
         return "", "Piston API URL not configured."
-
-    payload = {
-        "language": language,
-        "version": "*",
-        "files": [{"name": "solution", "content": code}],
-        "stdin": test_case_input
-    }
-
-    try:
-        import requests  # local import to avoid top-level dependency if not used
-        resp = requests.post(PISTON_URL, json=payload, timeout=TIMEOUT)
-        resp.raise_for_status()
-        data = resp.json()
-        run_info = data.get("run", {}) if isinstance(data, dict) else {}
-        stdout = (run_info.get("stdout") or "").strip()
-        stderr = (run_info.get("stderr") or "").strip()
-        return stdout, stderr
-    except Exception as exc:
-        logger.exception("Piston API call failed")
-        return "", f"Piston API Error: {str(exc)}"
+    return cached_run(
+        language, code, test_case_input or "", timeout,
+        lambda: client.execute(code, language, test_case_input, timeout=timeout),
+        cacheable=lambda result: not result[1].startswith("Piston API Error"),
+    )
 
 
 # ---------------------------
 # Fallback check_test_cases (only used if tasks_helpers not present)
 # ---------------------------
-def _fallback_check_test_cases(code: str, language: str, test_cases):
+def _fallback_check_test_cases(code: str, language: str, test_cases, *,
+                               max_workers: int = 1,
+                               stop_on_first_failure: bool = False,
+                               total_timeout: float = None,
+                               compare: dict = None):
     """
     Minimal runner that uses Piston API for each test case.
     Structured return consistent with your other code:
       { 'score': int, 'results': [...], 'error': '', 'status': 'Accepted'/'Rejected'/'Error' }
+    Test cases are sent concurrently when max_workers > 1 (order is preserved);
+    concurrency is capped by the Piston client's connection pool (PISTON_POOL_SIZE).
+    Output is compared with the question's policy (`compare`, see comparators.py).
     """
-    results = []
-    passed = 0
     overall_error = None
 
     if language is None:
@@ -91,45 +92,51 @@ def _fallback_check_test_cases(code: str, language: str, test_cases):
             "status": "Error"
         }
 
+    def judge_one(tc, timeout=None):
+        input_data = tc.get("input", "")
+        expected = tc.get("expected_output", []) or []
+        if isinstance(expected, str):
+            expected_lines = [expected.strip()]
+        else:
+            expected_lines = [str(x).strip() for x in expected]
+
+        stdout, stderr = run_piston_api(code, language, input_data, timeout=timeout)
+
+        actual_lines = [ln.strip() for ln in (stdout or "").splitlines() if ln.strip()]
+        status = "Accepted"
+        error_message = ""
+
+        if stderr:
+            status = "Error"
+            error_message = stderr
+        else:
+            comparator = make_comparator(comparator_lines(expected, (compare or {}).get("policy")),
+                                         **(compare or {}))
+            if not comparator.check(stdout):
+                status = "Rejected"
+                error_message = f"Expected {expected_lines}, got {actual_lines} ({comparator.mismatch})"
+
+        return {
+            "input": input_data,
+            "expected_output": expected_lines,
+            "actual_output": actual_lines,
+            "status": status,
+            "error_message": error_message
+        }
+
     try:
-        for tc in (test_cases or []):
-            input_data = tc.get("input", "")
-            expected = tc.get("expected_output", []) or []
-            if isinstance(expected, str):
-                expected_lines = [expected.strip()]
-            else:
-                expected_lines = [str(x).strip() for x in expected]
-
-            stdout, stderr = run_piston_api(code, language, input_data)
-
-            actual_lines = [ln.strip() for ln in (stdout or "").splitlines() if ln.strip()]
-            status = "Accepted"
-            error_message = ""
-
-            if stderr:
-                status = "Error"
-                error_message = stderr
-            else:
-                # tolerant compare
-                if expected_lines == actual_lines:
-                    status = "Accepted"
-                else:
-                    if " ".join(expected_lines).strip() == " ".join(actual_lines).strip():
-                        status = "Accepted"
-                    else:
-                        status = "Rejected"
-                        error_message = f"Expected {expected_lines}, got {actual_lines}"
-
-            if status == "Accepted":
-                passed += 1
-
-            results.append({
-                "input": input_data,
-                "expected_output": expected_lines,
-                "actual_output": actual_lines,
-                "status": status,
-                "error_message": error_message
-            })
+        if fan_out_test_cases is not None:
+            results = fan_out_test_cases(
+                test_cases,
+                judge_one,
+                max_workers=max_workers,
+                stop_on_first_failure=stop_on_first_failure,
+                total_timeout=total_timeout,
+                per_test_timeout=getattr(settings, "PISTON_API_TIMEOUT", 10),
+            )
+        else:
+            results = [judge_one(tc) for tc in (test_cases or [])]
+        passed = sum(1 for r in results if r["status"] == "Accepted")
 
         final_status = "Accepted" if (passed == len(test_cases or []) and len(test_cases or []) > 0) else "Rejected"
         return {"score": passed, "results": results, "error": overall_error or "", "status": final_status}
@@ -143,6 +150,68 @@ if not check_test_cases:
     check_test_cases = _fallback_check_test_cases
 
 
+def _judge_options(practice: bool) -> dict:
+    """Concurrency / early-exit / wall-clock budget for a submission, from settings."""
+    return {
+        "max_workers": getattr(settings, "JUDGE_MAX_PARALLEL_TESTS", 1),
+        "stop_on_first_failure": practice and getattr(settings, "PRACTICE_STOP_ON_FIRST_FAILURE", False),
+        "total_timeout": getattr(settings, "JUDGE_TOTAL_TIMEOUT", 30),
+    }
+
+
+def _judge_submission(code: str, language: str, test_cases, practice: bool = False, compare: dict = None):
+    """
+    Run a submission's test cases, replaying the stored result when this exact
+    code was already judged against these exact test cases (see judge_cache.py).
+    `compare` is the question's output policy (Question.compare_options()).
+    """
+    options = _judge_options(practice)
+    options["compare"] = compare
+    try:
+        from .judge_cache import get_judge_result_cache, result_key
+        cache = get_judge_result_cache()
+    except Exception:
+        logger.exception("Judge result cache unavailable")
+        cache = None
+
+    if cache is None:
+        return _run_judge(code, language, test_cases, options)
+
+    mode = "first-failure" if options["stop_on_first_failure"] else "full"
+    key = result_key(code, language, test_cases, mode, compare=compare)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    result = _run_judge(code, language, test_cases, options)
+    cache.set(key, result)
+    return result
+
+
+def _run_judge(code: str, language: str, test_cases, options: dict):
+    """
+    Python submissions are compiled once (check_test_cases_compiled) and fan out
+    over the warm judge worker pool when it is available; C/C++/Java/JS are
+    compiled once and judged locally when their toolchain is installed
+    (native_runner.py); anything else is sent to Piston concurrently.
+    """
+    options = dict(options)
+    if (language or "python").lower() != "python":
+        from .native_runner import check_test_cases_native, native_language_available
+        if native_language_available(language):
+            return check_test_cases_native(code, language, test_cases, **options)
+        options["max_workers"] = getattr(settings, "PISTON_POOL_SIZE", options["max_workers"])
+        return _fallback_check_test_cases(code, language, test_cases, **options)
+    if check_test_cases_compiled is not None and (language or "python").lower() == "python":
+        try:
+            from .judge_pool import get_judge_pool
+            pool = get_judge_pool()
+        except Exception:
+            logger.exception("Judge pool unavailable")
+            pool = None
+        return check_test_cases_compiled(code, language, test_cases, pool=pool, **options)
+    return check_test_cases(code, language, test_cases, **options)
+
+
 # ---------------------------
 # Practice submission task
 # ---------------------------
@@ -160,7 +229,8 @@ def process_practice_submission(self, user_id, question_id, code, language):
         return {"status": "Error", "error": "User or Question not found."}
 
     try:
-        task_results = check_test_cases(code, language, question.test_cases)
+        task_results = _judge_submission(code, language, question.test_cases, practice=True,
+                                         compare=question.compare_options())
     except Exception as e:
         logger.exception("Practice check_test_cases failed")
         task_results = {"score": 0, "results": [], "error": str(e), "status": "Error"}
@@ -213,8 +283,14 @@ def process_practice_submission(self, user_id, question_id, code, language):
 @shared_task(bind=True)
 def process_assessment_submission(self, user_id, assessment_id, question_id, code, language):
     """
-    Evaluate an assessment coding submission, compute plagiarism signals,
-    apply penalty and save the submission row into AssessmentSubmission.
+    Evaluate an assessment coding submission and save it into
+    AssessmentSubmission with its unpenalized marks.
+
+    The plagiarism signals and penalty are computed afterwards by
+    check_assessment_plagiarism (queued on the low-priority
+    PLAGIARISM_QUEUE), so the verdict does not wait for the comparison with
+    the other students' submissions. Until then the similarity fields are
+    None and the returned dict has "plagiarism_pending": True.
 
     Returns a dict suitable for polling by the frontend.
     """
@@ -228,7 +304,8 @@ def process_assessment_submission(self, user_id, assessment_id, question_id, cod
 
     # 1) Run test cases
     try:
-        task_results = check_test_cases(code, language, question.test_cases)
+        task_results = _judge_submission(code, language, question.test_cases,
+                                         compare=question.compare_options())
     except Exception as e:
         logger.exception("Assessment check_test_cases failed")
         task_results = {"score": 0, "results": [], "error": str(e), "status": "Error"}
@@ -253,71 +330,28 @@ def process_assessment_submission(self, user_id, assessment_id, question_id, cod
     error_message = task_results.get("error", "") or ""
     final_status = task_results.get("status", "Error")
 
-    # 2) Plagiarism ensemble: compare to other submissions (cap for perf)
-    plagiarism_percent = 0.0
-    structural_sim = 0.0
-    token_sim = 0.0
-    embedding_sim = 0.0
-    ai_prob = 0.0
-
-    try:
-        MAX_COMPARE = getattr(settings, "PLAGIARISM_COMPARE_LIMIT", 200)
-        other_codes_qs = (
-            AssessmentSubmission.objects
-            .filter(assessment=assessment, question=question)
-            .exclude(user=user)
-            .order_by("-submitted_at")
-            .values_list("code", flat=True)[:MAX_COMPARE]
-        )
-        other_codes = [c for c in other_codes_qs if c]
-        if other_codes:
-            signals = compute_ensemble_plagiarism(code or "", other_codes)
-            plagiarism_percent = float(signals.get("plag_percent", 0.0))
-            token_sim = float(signals.get("token_similarity", 0.0))
-            structural_sim = float(signals.get("structural_similarity", 0.0))
-            embedding_sim = float(signals.get("embedding_similarity", 0.0))
-            ai_prob = float(signals.get("ai_generated_prob", 0.0))
-        else:
-            # no comparators -> everything remains zero
-            plagiarism_percent = 0.0
-    except Exception:
-        logger.exception("Plagiarism computation failed for assessment submission")
-        plagiarism_percent = 0.0
-        token_sim = structural_sim = embedding_sim = ai_prob = 0.0
-
-    # 3) Apply plagiarism penalty
+    # 2) Persist submission (update_or_create). The plagiarism signals of any
+    #    previous code are cleared; check_assessment_plagiarism fills them in.
     try:
-        final_marks = apply_plagiarism_penalty(
-            raw_marks=marks_before_penalty,
-            plagiarism_percent=plagiarism_percent,
-            code=code,
-            question=question
-        )
-    except Exception:
-        logger.exception("apply_plagiarism_penalty failed")
-        final_marks = marks_before_penalty
-
-    # 4) Persist submission (update_or_create). Build defaults dict carefully.
-    try:
-        # Build defaults (do NOT include 'updated_at' if you don't want to force it)
         defaults = {
             "code": code,
             "language": language,
             "output": results_json,
             "error": error_message,
-            "score": final_marks,
+            "score": marks_before_penalty,
             "raw_score": marks_before_penalty,
-            "plagiarism_percent": plagiarism_percent,
-            "structural_similarity": structural_sim,
-            "token_similarity": token_sim,
-            "embedding_similarity": embedding_sim,
-            "ai_generated_prob": ai_prob,
+            "plagiarism_percent": 0.0,
+            "structural_similarity": None,
+            "token_similarity": None,
+            "embedding_similarity": None,
+            "ai_generated_prob": None,
+            "fingerprint": None,
+            "ast_sequence": None,
+            "embedding": None,
             "submitted_at": timezone.now(),
         }
-        # Remove None values so we don't pass invalid values into DB
-        defaults = {k: v for k, v in defaults.items() if v is not None}
 
-        AssessmentSubmission.objects.update_or_create(
+        submission, _ = AssessmentSubmission.objects.update_or_create(
             user=user,
             assessment=assessment,
             question=question,
@@ -329,25 +363,211 @@ def process_assessment_submission(self, user_id, assessment_id, question_id, cod
             "status": "Error",
             "error": f"DB save failed: {str(e)}",
             "results": task_results.get("results", []),
-            "plagiarism_percent": plagiarism_percent,
-            "score": final_marks
+            "plagiarism_percent": None,
+            "score": marks_before_penalty
         }
 
-    # 5) Return results for frontend polling
+    _refresh_leaderboard(assessment.id, [user.id])
+
+    # 3) Plagiarism and penalty: off the student-facing path
+    try:
+        check_assessment_plagiarism.delay(submission.id)
+    except Exception:
+        logger.exception("Could not queue plagiarism check for assessment submission; running it inline")
+        check_assessment_plagiarism(submission.id)
+
+    # 4) Return results for frontend polling
     return {
         "task_id": self.request.id,
+        "submission_id": submission.id,
         "final_status": final_status,
         "results": task_results.get("results", []),
         "error": error_message,
+        "plagiarism_pending": True,
+        "plagiarism_percent": None,
+        "raw_score": marks_before_penalty,
+        "score": marks_before_penalty,
+    }
+
+
+@shared_task(bind=True)
+def check_assessment_plagiarism(self, submission_id):
+    """
+    Second phase of assessment grading: compute the plagiarism ensemble of
+    the submission's current code against the likely matches among all other
+    submissions of the question, apply the penalty to raw_score, index the
+    submission and queue its embedding.
+
+    The comparison is propagated to the other side (plagiarism_incremental):
+    peers whose best match is now this code, or was the code it replaced,
+    are rescored along with the affected AssessmentSession totals.
+
+    Nothing is written if the code was resubmitted in the meantime (the
+    newer submission's own check takes over).
+    """
+    try:
+        submission = AssessmentSubmission.objects.select_related("question").get(pk=submission_id)
+    except AssessmentSubmission.DoesNotExist:
+        logger.warning("Plagiarism check: assessment submission %s no longer exists", submission_id)
+        return {"status": "Missing", "submission_id": submission_id}
+
+    # what the index holds is still the previous code's fingerprint (if any)
+    old_fingerprint = indexed_fingerprint(submission_id)
+
+    code = submission.code or ""
+    plagiarism_percent = 0.0
+    structural_sim = 0.0
+    token_sim = 0.0
+    embedding_sim = 0.0
+    ai_prob = 0.0
+    similarities = {}
+
+    # Fingerprinted and parsed once (utils.code_features): looked up in the index now and stored below
+    features = code_features(code)
+    fingerprint = features.fingerprint
+    ast_sequence = features.structure(submission.language)
+
+    try:
+        signals, similarities = compare_with_peers(submission, fingerprint, ast_sequence)
+        if signals is not None:
+            plagiarism_percent = float(signals.get("plag_percent", 0.0))
+            token_sim = float(signals.get("token_similarity", 0.0))
+            structural_sim = float(signals.get("structural_similarity", 0.0))
+            embedding_sim = float(signals.get("embedding_similarity", 0.0))
+            ai_prob = float(signals.get("ai_generated_prob", 0.0))
+    except Exception:
+        logger.exception("Plagiarism computation failed for assessment submission %s", submission_id)
+        plagiarism_percent = 0.0
+        token_sim = structural_sim = embedding_sim = ai_prob = 0.0
+
+    raw_marks = submission.raw_score if submission.raw_score is not None else submission.score
+    try:
+        final_marks = apply_plagiarism_penalty(
+            raw_marks=raw_marks,
+            plagiarism_percent=plagiarism_percent,
+            code=code,
+            question=submission.question
+        )
+    except Exception:
+        logger.exception("apply_plagiarism_penalty failed")
+        final_marks = raw_marks
+
+    # queryset update guarded by the code: a resubmission in the meantime wins
+    updated = AssessmentSubmission.objects.filter(pk=submission_id, code=submission.code).update(
+        score=final_marks,
+        plagiarism_percent=plagiarism_percent,
+        structural_similarity=structural_sim,
+        token_similarity=token_sim,
+        embedding_similarity=embedding_sim,
+        ai_generated_prob=ai_prob,
+    )
+    if not updated:
+        return {"status": "Superseded", "submission_id": submission_id}
+
+    try:
+        index_submission(submission, fingerprint, ast_sequence)
+    except Exception:
+        logger.exception("Fingerprint indexing failed for assessment submission")
+
+    # the other side of the comparison: peers (and sessions) affected by this code
+    peers_updated = 0
+    affected_users = {submission.user_id}
+    try:
+        changed = {peer.pk: peer for peer in raise_peer_maxima(similarities)}
+        if old_fingerprint and old_fingerprint != fingerprint:
+            replaced = [sid for sid in replaced_match_peers(submission, old_fingerprint) if sid not in changed]
+            changed.update((peer.pk, peer) for peer in recompute_submissions(replaced))
+        peers_updated = len(changed)
+        affected_users.update(peer.user_id for peer in changed.values())
+        refresh_session_totals(submission.assessment_id, affected_users)
+    except Exception:
+        logger.exception("Plagiarism propagation failed for assessment submission %s", submission_id)
+    _refresh_leaderboard(submission.assessment_id, affected_users)
+
+    # the embedding signal is computed in batches, off the grading path
+    try:
+        compute_submission_embeddings.delay([submission_id])
+    except Exception:
+        logger.exception("Could not queue embedding computation for assessment submission")
+
+    return {
+        "status": "Done",
+        "submission_id": submission_id,
         "plagiarism_percent": plagiarism_percent,
         "structural_similarity": structural_sim,
         "token_similarity": token_sim,
         "embedding_similarity": embedding_sim,
         "ai_generated_prob": ai_prob,
-        "raw_score": marks_before_penalty,
+        "raw_score": raw_marks,
         "score": final_marks,
+        "peers_updated": peers_updated,
     }
 
+
+def _refresh_leaderboard(assessment_id, user_ids):
+    """Keep the materialized leaderboard rows (leaderboard.py) of `user_ids` current; never fails the task."""
+    try:
+        refresh_entries(assessment_id, user_ids)
+    except Exception:
+        logger.exception("Leaderboard refresh failed for assessment %s", assessment_id)
+
+
+# ---------------------------
+# Embedding signal (batched)
+# ---------------------------
+@shared_task(bind=True)
+def compute_submission_embeddings(self, submission_ids=None, batch_size=None):
+    """
+    Embed the given AssessmentSubmissions plus up to `batch_size` others still
+    without an embedding, then refresh embedding_similarity (closest other
+    student's submission in the question's EmbeddingIndex) of every row of
+    those questions whose value changed and, where the other signals are
+    known, their plagiarism_percent, penalized score and session totals.
+    """
+    from .embeddings import code_embedding, encode_embedding, get_embedding_index
+
+    batch_size = batch_size or getattr(settings, "EMBEDDING_BATCH_SIZE", 200)
+    ids = set(submission_ids or [])
+    ids.update(AssessmentSubmission.objects.filter(embedding__isnull=True)
+               .exclude(pk__in=ids).order_by("id").values_list("id", flat=True)[:batch_size])
+    subs = list(AssessmentSubmission.objects.filter(pk__in=ids).only("id", "code", "assessment_id", "question_id"))
+    if not subs:
+        return {"embedded": 0}
+
+    # every write is guarded by the code that was read: a resubmission in the meantime
+    # resets its row and is embedded and scored on its own
+    now = timezone.now()
+    embedded = []
+    for sub in subs:
+        # bumps the question's index stamp so cached EmbeddingIndexes are rebuilt
+        if AssessmentSubmission.objects.filter(pk=sub.pk, code=sub.code).update(
+                embedding=encode_embedding(code_embedding(sub.code)), updated_at=now):
+            embedded.append(sub)
+    subs = embedded
+
+    # a new embedding can change the best match of the question's other rows too
+    updated = 0
+    for key in sorted({(sub.assessment_id, sub.question_id) for sub in subs}):
+        best = {sid: round(value, 4) for sid, value in get_embedding_index(*key).best_similarities().items()}
+        stored = (AssessmentSubmission.objects
+                  .filter(assessment_id=key[0], question_id=key[1], embedding__isnull=False)
+                  .values_list("id", "embedding_similarity"))
+        stale = [sid for sid, value in stored if sid in ids or value != best.get(sid, 0.0)]
+        rows = []
+        for row in AssessmentSubmission.objects.filter(pk__in=stale).select_related("question"):
+            row.embedding_similarity = best.get(row.id, 0.0)
+            rescore(row)
+            if AssessmentSubmission.objects.filter(pk=row.pk, code=row.code).update(
+                    embedding_similarity=row.embedding_similarity, plagiarism_percent=row.plagiarism_percent,
+                    ai_generated_prob=row.ai_generated_prob, score=row.score):
+                rows.append(row)
+        refresh_session_totals(key[0], {row.user_id for row in rows})
+        if rows:
+            _refresh_leaderboard(key[0], {row.user_id for row in rows})
+        updated += len(rows)
+    return {"embedded": len(subs), "updated": updated}
+
+
 from celery import shared_task
 from django.utils import timezone
 
@@ -2,9 +2,18 @@
 """
 Small, safe (for local/dev) check_test_cases implementation.
 
-It only supports Python submissions for now. It executes each test case
+It only supports Python submissions (C/C++/Java/JS are judged by
+codingapp/native_runner.py, which reuses this module's judging). It executes each test case
 in a subprocess using the system python executable with a timeout,
 feeds the test input on stdin, collects stdout, and compares to expected output.
+Callers may pass `runner=` (e.g. a leased codingapp.judge_pool worker) to run
+tests in a warm interpreter instead of a fresh subprocess, `max_workers=` to
+run test cases concurrently, `stop_on_first_failure=True` to skip the rest of
+the tests once one fails, and `total_timeout=` as a wall-clock budget for the
+whole submission (defaults to TOTAL_TIMEOUT), and `compare=` to pick the
+output policy (codingapp/comparators.py). Individual runs are memoized
+per (code, stdin) by codingapp/output_cache.py, and every run is resource
+limited (CPU, memory, files, processes, output size) by codingapp/sandbox.py.
 
 Expected `test_cases` format (list of dicts):
     [{"input": "1\n2\n", "expected_output": ["3"]}, ... ]
@@ -13,7 +22,8 @@ Return value:
     {
         "score": <int passed_count>,
         "results": [
-            {"input": "...", "expected_output": [...], "actual_output": [...], "status": "Accepted"/"Rejected", "error_message": "..."},
+            {"input": "...", "expected_output": [...], "actual_output": [...], "status": "Accepted"/"Rejected"/"Skipped", "error_message": "...",
+             "cpu_time": <seconds>, "peak_rss_kb": <int or None>},   # usage only for tests that actually ran
             ...
         ],
         "error": "",           # execution-level error string if any
@@ -21,19 +31,35 @@ Return value:
     }
 """
 
-from subprocess import run, PIPE, TimeoutExpired
 import tempfile
 import sys
 import os
 import json
 import re
-from typing import Tuple, List, Dict, Any
+import hashlib
+import importlib.util
+import marshal
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Any, Callable
+
+from .comparators import comparator_lines, make_comparator
+from .output_cache import cached_run
+from .sandbox import run_sandboxed
 
 PYTHON_EXECUTABLE = sys.executable  # uses the same Python interpreter
 
 # Safety/time limits — adjust if necessary
 PER_TEST_TIMEOUT = 5  # seconds per test input
-TOTAL_TIMEOUT = 30    # overall cap (not strictly enforced here)
+TOTAL_TIMEOUT = 30    # overall wall-clock cap per submission
+
+SKIPPED_MESSAGE = "Not run: an earlier test case failed."
+
+# File name user code runs under (matches judge_worker.SOLUTION_FILENAME)
+SOLUTION_FILENAME = "solution.py"
 
 
 def _safe_normalize_newlines(s: str) -> str:
@@ -62,34 +88,27 @@ def _ensure_trailing_newline(s: str) -> str:
     return s
 
 
-def _run_python_code(code: str, stdin_data: str, timeout: int = PER_TEST_TIMEOUT) -> Tuple[str, str, int, bool]:
-    """
-    Run python code in a subprocess using a temporary file.
-
-    Returns:
-      (stdout_text, stderr_text, returncode, timed_out_bool)
-    """
-    if code is None:
-        return ("", "No code provided", 1, False)
-
-    # Normalize escaped newline sequences in code and stdin
+def _normalize_python_source(code: str) -> str:
+    """Normalize escaped newlines and make sure the source ends with a newline."""
     try:
         code = _safe_normalize_newlines(code)
     except Exception:
         pass
+    return code if code.endswith("\n") else code + "\n"
 
-    # Ensure the code file ends with a newline
-    code_src = code if code.endswith("\n") else code + "\n"
 
-    # Normalize stdin and ensure it has enough lines for input() calls
-    stdin_data = "" if stdin_data is None else str(stdin_data)
-    stdin_data = _safe_normalize_newlines(stdin_data)
-
-    # Heuristic: count input() occurrences so we can ensure stdin has enough lines
+def _count_input_calls(code_src: str) -> int:
+    """Heuristic: count input() occurrences so we can ensure stdin has enough lines."""
     try:
-        input_calls = len(re.findall(r'\binput\s*\(', code_src))
+        return len(re.findall(r'\binput\s*\(', code_src))
     except Exception:
-        input_calls = 0
+        return 0
+
+
+def _prepare_stdin(stdin_data: str, input_calls: int) -> str:
+    """Normalize stdin and pad it with blank lines so every input() call gets one."""
+    stdin_data = "" if stdin_data is None else str(stdin_data)
+    stdin_data = _safe_normalize_newlines(stdin_data)
 
     stdin_lines = stdin_data.splitlines()
     if stdin_data.strip() == "":
@@ -105,7 +124,55 @@ def _run_python_code(code: str, stdin_data: str, timeout: int = PER_TEST_TIMEOUT
     # ensure at least a newline
     if stdin_fixed == "":
         stdin_fixed = "\n"
+    return stdin_fixed
+
+
+def _prepare_python_run(code: str, stdin_data: str) -> Tuple[str, str]:
+    """
+    Normalize source and stdin the way every Python runner expects them.
+
+    Returns:
+      (code_src, stdin_fixed)
+    """
+    code_src = _normalize_python_source(code)
+    return code_src, _prepare_stdin(stdin_data, _count_input_calls(code_src))
+
+
+def _run_python_code(code: str, stdin_data: str, timeout: int = PER_TEST_TIMEOUT,
+                     comparator=None) -> Tuple[str, str, int, bool]:
+    """
+    Run python code in a subprocess using a temporary file.
+
+    Returns:
+      (stdout_text, stderr_text, returncode, timed_out_bool)
+    """
+    if code is None:
+        return ("", "No code provided", 1, False)
+
+    code_src, stdin_fixed = _prepare_python_run(code, stdin_data)
+    return cached_run("python", code_src, stdin_fixed, timeout,
+                      lambda: _run_python_subprocess(code_src, stdin_fixed, timeout, comparator),
+                      cacheable=_is_deterministic_run)
 
+
+def _is_deterministic_run(result: Tuple[str, str, int, bool]) -> bool:
+    """
+    Timeouts, runner failures and stray kills say nothing about the program, and
+    a run cut short on an output mismatch depends on the expected output; don't
+    cache them.
+    """
+    stdout, stderr, returncode, timed_out = result
+    if timed_out or getattr(result, "aborted", False):
+        return False
+    if returncode == -1 and stderr.startswith("Runner error"):
+        return False
+    # killed by a signal nobody expects from the limits (e.g. the OOM killer under load)
+    return not (returncode < 0 and stderr.startswith("Killed by signal"))
+
+
+def _run_python_subprocess(code_src: str, stdin_fixed: str, timeout: int,
+                           comparator=None) -> Tuple[str, str, int, bool]:
+    """Run already prepared source/stdin in a fresh, resource-limited interpreter via a temporary file."""
     tmp_path = None
     try:
         # Write to a temporary file and execute via the same interpreter
@@ -113,18 +180,7 @@ def _run_python_code(code: str, stdin_data: str, timeout: int = PER_TEST_TIMEOUT
             f.write(code_src)
             tmp_path = f.name
 
-        proc = run(
-            [PYTHON_EXECUTABLE, tmp_path],
-            input=stdin_fixed.encode("utf-8"),
-            stdout=PIPE,
-            stderr=PIPE,
-            timeout=timeout,
-        )
-        stdout = proc.stdout.decode("utf-8", errors="replace")
-        stderr = proc.stderr.decode("utf-8", errors="replace")
-        return (stdout, stderr, proc.returncode, False)
-    except TimeoutExpired:
-        return ("", f"Timed out after {timeout}s", -1, True)
+        return run_sandboxed([PYTHON_EXECUTABLE, tmp_path], stdin_fixed, timeout, comparator=comparator)
     except Exception as exc:
         # Return runner-level error message, don't raise (Celery worker shouldn't die)
         return ("", f"Runner error: {str(exc)}", -1, False)
@@ -151,87 +207,151 @@ def _normalize_output_to_lines(s: str) -> List[str]:
     return [ln for ln in lines if ln != ""]
 
 
-def check_test_cases(code: str, language: str, test_cases) -> Dict[str, Any]:
+def _expected_lines(expected) -> List[str]:
+    """Normalize expected output to list of strings."""
+    if isinstance(expected, str):
+        return [expected.strip()] if expected.strip() != "" else []
+    return [str(x).strip() for x in (expected or []) if str(x).strip() != ""]
+
+
+def _mismatch_message(expected_lines: List[str], actual_lines: List[str], comparator) -> str:
+    exp_preview = json.dumps(expected_lines[:3], ensure_ascii=False)
+    act_preview = json.dumps(actual_lines[:3], ensure_ascii=False)
+    return f"Expected {exp_preview}, got {act_preview} ({comparator.mismatch})"
+
+
+def _not_run_entry(tc, status: str, error_message: str) -> Dict[str, Any]:
+    """Results entry for a test case that was never executed."""
+    tc_input = tc.get("input", "") if isinstance(tc, dict) else ""
+    expected = tc.get("expected_output", []) if isinstance(tc, dict) else []
+    return {
+        "input": "" if tc_input is None else str(tc_input),
+        "expected_output": _expected_lines(expected),
+        "actual_output": [],
+        "status": status,
+        "error_message": error_message,
+    }
+
+
+def _judge_test_case(tc, execute: Callable[..., Tuple[str, str, int, bool]],
+                     timeout: float = PER_TEST_TIMEOUT, compare: Dict[str, Any] = None) -> Dict[str, Any]:
     """
-    Primary exported function expected by the Celery task.
-    Only 'python' language is supported here (local/dev).
+    Run a single test case through `execute(tc_input, timeout, comparator)` and build its results entry.
+    `compare` selects the output policy ({"policy": ..., "epsilon": ...}, see comparators.py);
+    runners that stream stdout into the comparator may stop the program at the first mismatch.
     """
-    if language is None:
-        language = "python"
+    # TC input and expected may come as different shapes in your DB; handle gracefully
+    tc_input = tc.get("input", "") if isinstance(tc, dict) else ""
+    expected = tc.get("expected_output", []) if isinstance(tc, dict) else []
+
+    # Normalize inputs (convert escaped newlines if present)
+    tc_input = "" if tc_input is None else str(tc_input)
+
+    expected_lines = _expected_lines(expected)
+    compare = compare or {}
+    comparator = (make_comparator(comparator_lines(expected, compare.get("policy")), **compare)
+                  if expected_lines else None)
+
+    # Run the code for a single test case
+    result = execute(tc_input, timeout, comparator)
+    stdout, stderr, rc, timed_out = result
+
+    actual_lines = _normalize_output_to_lines(stdout)
+
+    status = "Accepted"
+    error_message = ""
+
+    # If timed out or non-zero return code with stderr, mark rejected with reason
+    if timed_out:
+        status = "Rejected"
+        error_message = f"Timed out after {round(timeout, 2):g}s"
+    elif getattr(result, "aborted", False):
+        # stopped early: the output had already diverged from the expected output
+        status = "Rejected"
+        error_message = _mismatch_message(expected_lines, actual_lines, comparator)
+    elif rc != 0 and stderr:
+        status = "Rejected"
+        error_message = stderr.strip()
+    elif comparator is None:
+        # If expected empty, accept as long as program produced something
+        status = "Accepted" if actual_lines else "Rejected"
+        if status == "Rejected":
+            error_message = f"No output produced; expected something."
+    else:
+        # runners that did not stream (or cached results) are compared here
+        if not comparator.finished:
+            comparator.check(stdout)
+        if not comparator.ok:
+            status = "Rejected"
+            error_message = _mismatch_message(expected_lines, actual_lines, comparator)
+
+    entry = {
+        "input": tc_input,
+        "expected_output": expected_lines,
+        "actual_output": actual_lines,
+        "status": status,
+        "error_message": error_message,
+    }
+    # resource usage reported by the sandbox (sandbox.RunResult)
+    if getattr(result, "cpu_time", None) is not None:
+        entry["cpu_time"] = result.cpu_time
+        entry["peak_rss_kb"] = result.peak_rss_kb
+    return entry
+
+
+def fan_out_test_cases(test_cases, judge_one: Callable[[Any, float], Dict[str, Any]], *,
+                       max_workers: int = 1,
+                       stop_on_first_failure: bool = False,
+                       total_timeout: float = None,
+                       per_test_timeout: float = PER_TEST_TIMEOUT) -> List[Dict[str, Any]]:
+    """
+    Judge test cases, optionally on a bounded thread pool, and return their
+    results entries in test-case order.
 
-    results: List[Dict[str, Any]] = []
-    passed = 0
+    `judge_one(tc, timeout)` judges one test case. Each test gets
+    min(per_test_timeout, time left in total_timeout); tests that would start
+    after the budget is spent are Rejected without running. With
+    stop_on_first_failure, tests not yet started once one fails are "Skipped".
+    """
+    cases = list(test_cases or [])
+    deadline = time.monotonic() + total_timeout if total_timeout else None
+    failed = threading.Event()
+
+    def _one(tc):
+        if failed.is_set():
+            return _not_run_entry(tc, "Skipped", SKIPPED_MESSAGE)
+        timeout = per_test_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return _not_run_entry(tc, "Rejected", f"Not run: total time limit of {total_timeout}s exceeded.")
+            timeout = min(timeout, remaining)
+        entry = judge_one(tc, timeout)
+        if stop_on_first_failure and entry.get("status") != "Accepted":
+            failed.set()
+        return entry
+
+    workers = max(1, min(int(max_workers or 1), len(cases)))
+    if workers == 1:
+        return [_one(tc) for tc in cases]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="judge") as executor:
+        # map() yields in submission order, so results keep the test-case order
+        return list(executor.map(_one, cases))
+
+
+def _judge_all(test_cases, execute: Callable[..., Tuple[str, str, int, bool]], compare: Dict[str, Any] = None,
+               **fan_out_options) -> Dict[str, Any]:
+    """Judge every test case with `execute` and build the standard result dict."""
     overall_error = ""
 
-    if language.lower() != "python":
-        return {
-            "score": 0,
-            "results": [],
-            "error": f"Language {language} not supported by this runner.",
-            "status": "Error"
-        }
-
     try:
         # test_cases expected to be list-like of dicts
-        for tc in test_cases or []:
-            # TC input and expected may come as different shapes in your DB; handle gracefully
-            tc_input = tc.get("input", "") if isinstance(tc, dict) else ""
-            expected = tc.get("expected_output", []) if isinstance(tc, dict) else []
-
-            # Normalize inputs (convert escaped newlines if present)
-            tc_input = "" if tc_input is None else str(tc_input)
-
-            # Run the code for a single test case
-            stdout, stderr, rc, timed_out = _run_python_code(code, tc_input, timeout=PER_TEST_TIMEOUT)
-
-            actual_lines = _normalize_output_to_lines(stdout)
-
-            # Normalize expected output to list of strings
-            if isinstance(expected, str):
-                expected_lines = [expected.strip()] if expected.strip() != "" else []
-            else:
-                expected_lines = [str(x).strip() for x in (expected or []) if str(x).strip() != ""]
-
-            status = "Accepted"
-            error_message = ""
-
-            # If timed out or non-zero return code with stderr, mark rejected with reason
-            if timed_out:
-                status = "Rejected"
-                error_message = f"Timed out after {PER_TEST_TIMEOUT}s"
-            elif rc != 0 and stderr:
-                status = "Rejected"
-                error_message = stderr.strip()
-            else:
-                # Compare expected_lines vs actual_lines
-                if len(expected_lines) == 0:
-                    # If expected empty, accept as long as program produced something
-                    status = "Accepted" if actual_lines else "Rejected"
-                    if status == "Rejected":
-                        error_message = f"No output produced; expected something."
-                else:
-                    if actual_lines == expected_lines:
-                        status = "Accepted"
-                    else:
-                        # tolerant compare: compare joined whitespace-stripped strings
-                        if " ".join(actual_lines).strip() == " ".join(expected_lines).strip():
-                            status = "Accepted"
-                        else:
-                            status = "Rejected"
-                            exp_preview = json.dumps(expected_lines[:3], ensure_ascii=False)
-                            act_preview = json.dumps(actual_lines[:3], ensure_ascii=False)
-                            error_message = f"Expected {exp_preview}, got {act_preview}"
-
-            if status == "Accepted":
-                passed += 1
-
-            results.append({
-                "input": tc_input,
-                "expected_output": expected_lines,
-                "actual_output": actual_lines,
-                "status": status,
-                "error_message": error_message,
-            })
+        results = fan_out_test_cases(
+            test_cases,
+            lambda tc, timeout: _judge_test_case(tc, execute, timeout, compare),
+            **fan_out_options
+        )
+        passed = sum(1 for entry in results if entry["status"] == "Accepted")
 
         final_status = "Accepted" if (passed == len(test_cases or []) and len(test_cases or []) > 0) else "Rejected"
         return {
@@ -247,3 +367,181 @@ def check_test_cases(code: str, language: str, test_cases) -> Dict[str, Any]:
             "error": str(e),
             "status": "Error"
         }
+
+
+def _unsupported_language(language: str) -> Dict[str, Any]:
+    return {
+        "score": 0,
+        "results": [],
+        "error": f"Language {language} not supported by this runner.",
+        "status": "Error"
+    }
+
+
+def check_test_cases(code: str, language: str, test_cases, runner: Callable = None, *,
+                     max_workers: int = 1,
+                     stop_on_first_failure: bool = False,
+                     total_timeout: float = TOTAL_TIMEOUT,
+                     compare: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Primary exported function expected by the Celery task.
+    Only 'python' language is supported here (local/dev).
+
+    `runner` executes a single test and must match _run_python_code's
+    signature/return tuple (including the `comparator=` keyword it may stream
+    stdout into); pass a leased judge_pool worker's `.run` to reuse a
+    warm interpreter instead of starting a subprocess per test case. A single
+    leased worker is not thread-safe, so keep max_workers=1 when passing one.
+    """
+    if runner is None:
+        runner = _run_python_code
+    if language is None:
+        language = "python"
+
+    if language.lower() != "python":
+        return _unsupported_language(language)
+
+    return _judge_all(
+        test_cases,
+        lambda tc_input, timeout, comparator: runner(code, tc_input, timeout=timeout, comparator=comparator),
+        compare=compare,
+        max_workers=max_workers,
+        stop_on_first_failure=stop_on_first_failure,
+        total_timeout=total_timeout,
+    )
+
+
+# ---------------------------
+# Compile-once execution plan
+# ---------------------------
+class PythonExecutionPlan:
+    """
+    A submission normalized and compiled exactly once, then run against many stdins.
+
+    The bytecode is produced in-process; a leased judge_pool worker receives it
+    once and forks per test, while the subprocess path writes a single
+    `solution.pyc` and runs it directly (no per-test parse/compile or temp file).
+    Use as a context manager so the artifact directory gets removed.
+    """
+
+    def __init__(self, code: str):
+        self.code_src = _normalize_python_source(code or "")
+        self.input_calls = _count_input_calls(self.code_src)
+        self.digest = hashlib.sha256(self.code_src.encode("utf-8")).hexdigest()
+        self.compile_error = ""
+        self.bytecode = b""
+        try:
+            code_obj = compile(self.code_src, SOLUTION_FILENAME, "exec", dont_inherit=True)
+            self.bytecode = marshal.dumps(code_obj)
+        except (SyntaxError, ValueError) as exc:
+            # same text `python solution.py` would print for a syntax error
+            self.compile_error = "".join(traceback.format_exception_only(type(exc), exc))
+        self._workdir = None
+        self._pyc_path = None
+        self._artifact_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stdin_for(self, stdin_data: str) -> str:
+        return _prepare_stdin(stdin_data, self.input_calls)
+
+    def run(self, stdin_data: str, timeout: int = PER_TEST_TIMEOUT, worker=None,
+            comparator=None) -> Tuple[str, str, int, bool]:
+        """
+        Run the compiled submission with one test's stdin (stdout streams into `comparator` if given).
+
+        Returns:
+          (stdout_text, stderr_text, returncode, timed_out_bool)
+        """
+        if self.compile_error:
+            return ("", self.compile_error, 1, False)
+        stdin_fixed = self.stdin_for(stdin_data)
+        if worker is not None:
+            execute = lambda: worker.run_plan(self, stdin_fixed, timeout=timeout, comparator=comparator)
+        else:
+            execute = lambda: self._run_subprocess(stdin_fixed, timeout, comparator)
+        return cached_run("python", self.code_src, stdin_fixed, timeout, execute,
+                          cacheable=_is_deterministic_run)
+
+    def _artifact(self) -> str:
+        """Write solution.py + solution.pyc once; the .py is only there for traceback source lines."""
+        with self._artifact_lock:
+            if self._pyc_path is None:
+                self._workdir = tempfile.mkdtemp(prefix="judge_")
+                src_path = os.path.join(self._workdir, SOLUTION_FILENAME)
+                with open(src_path, "w", encoding="utf-8") as f:
+                    f.write(self.code_src)
+                pyc_path = src_path + "c"
+                with open(pyc_path, "wb") as f:
+                    # PEP 552 header (flags=0, no mtime/size check when run directly)
+                    f.write(importlib.util.MAGIC_NUMBER + b"\0" * 12 + self.bytecode)
+                self._pyc_path = pyc_path
+        return self._pyc_path
+
+    def _run_subprocess(self, stdin_fixed: str, timeout: int, comparator=None) -> Tuple[str, str, int, bool]:
+        try:
+            return run_sandboxed([PYTHON_EXECUTABLE, self._artifact()], stdin_fixed, timeout,
+                                 comparator=comparator)
+        except Exception as exc:
+            return ("", f"Runner error: {str(exc)}", -1, False)
+
+    def close(self):
+        if self._workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+        self._workdir = None
+        self._pyc_path = None
+
+
+def check_test_cases_compiled(code: str, language: str, test_cases, worker=None, *,
+                              pool=None,
+                              max_workers: int = 1,
+                              stop_on_first_failure: bool = False,
+                              total_timeout: float = TOTAL_TIMEOUT,
+                              compare: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Same contract and result dict as check_test_cases, but the submission is
+    normalized and compiled once (PythonExecutionPlan) and every test case runs
+    that compiled artifact. Pass a leased judge_pool worker to run in a warm
+    interpreter, or a whole `pool` to lease one worker per concurrently running
+    test. A syntax error short-circuits: no test case is executed.
+    """
+    if language is None:
+        language = "python"
+
+    if language.lower() != "python":
+        return _unsupported_language(language)
+
+    fan_out_options = {
+        "compare": compare,
+        "max_workers": max_workers,
+        "stop_on_first_failure": stop_on_first_failure,
+        "total_timeout": total_timeout,
+    }
+
+    if code is None:
+        return _judge_all(test_cases, lambda tc_input, timeout, comparator: ("", "No code provided", 1, False),
+                          **fan_out_options)
+
+    if pool is not None:
+        # local import: judge_pool imports this module
+        from .judge_pool import JudgeWorkerError
+
+    with PythonExecutionPlan(code) as plan:
+        if plan.compile_error:
+            fan_out_options["max_workers"] = 1
+
+        def execute(tc_input, timeout, comparator):
+            if pool is not None and not plan.compile_error:
+                try:
+                    with pool.lease() as leased:
+                        return plan.run(tc_input, timeout, worker=leased, comparator=comparator)
+                except JudgeWorkerError:
+                    # no free worker: this test runs in its own subprocess
+                    return plan.run(tc_input, timeout, comparator=comparator)
+            return plan.run(tc_input, timeout, worker=worker, comparator=comparator)
+
+        return _judge_all(test_cases, execute, **fan_out_options)
@@ -1,4 +1,3 @@
-import requests
 import logging
 import json # <-- ADD json import
 from django.shortcuts import render, redirect, get_object_or_404
@@ -17,6 +16,9 @@ from django.utils.text import slugify # <--- NEW IMPORT
 from celery.result import AsyncResult # <-- ADD CELERY IMPORT
 from celery.result import AsyncResult 
 from .tasks import process_practice_submission, process_assessment_submission # (and other tasks)
+from .piston_client import PistonError, get_piston_client
+from .leaderboard import refresh_entries, refresh_quiz_entries
+from .plagiarism_incremental import finalize_session
 from .models import (
     Notice, NoticeReadStatus, Question, Submission, Module,
     Assessment, AssessmentQuestion, AssessmentSubmission,
@@ -32,7 +34,6 @@ from django.views.decorators.http import require_POST
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.utils import timezone
 import difflib  # for plagiarism
-from difflib import SequenceMatcher
 import re
 from django.contrib import messages
 from django.shortcuts import redirect
@@ -54,6 +55,23 @@ SUPPORTED_LANGUAGES = ["python", "c", "cpp", "java", "javascript"]
 logger = logging.getLogger(__name__)
 
 
+def _refresh_leaderboard(assessment_id, user_id):
+    """Keep the user's materialized leaderboard row current (leaderboard.py); never fails the request."""
+    try:
+        refresh_entries(assessment_id, [user_id])
+    except Exception:
+        logger.exception("Leaderboard refresh failed for assessment %s", assessment_id)
+
+
+def _finalize_session(session):
+    """Compute an ended session's result once (plagiarism_incremental.finalize_session) and its leaderboard row."""
+    try:
+        finalize_session(session)
+    except Exception:
+        logger.exception("Finalizing assessment session %s failed", session.pk)
+    _refresh_leaderboard(session.assessment_id, session.user_id)
+
+
 
 from django.contrib.auth.views import LoginView
 
@@ -79,7 +97,6 @@ class CustomLoginView(LoginView):
 def is_admin(user):
     return user.is_staff
 
-import requests
 import logging
 
 # Get an instance of a logger
@@ -917,6 +934,7 @@ def assessment_quiz(request, assessment_id):
         
         session.quiz_submitted = True
         session.save()
+        _refresh_leaderboard(assessment.id, request.user.id)
         
         messages.success(request, f"Quiz submitted! Your score: {score}/{len(questions)}. The coding section is now unlocked.")
         return redirect('assessment_detail', assessment_id=assessment.id)
@@ -954,7 +972,7 @@ def assessment_leaderboard_list(request):
 # In codingapp/views.py
 
 # at top of file (if not already)
-from django.db.models import Sum, Max, F
+from django.db.models import Sum, Max
 from django.contrib.auth.models import User
 from .models import Assessment, AssessmentSubmission, AssessmentSession, QuizSubmission
 
@@ -969,24 +987,15 @@ from .models import (
     Assessment, AssessmentQuestion, AssessmentSubmission, AssessmentSession,
     QuizSubmission
 )
-from .utils import penalty_factor_from_plagiarism  # make sure this exists
 
 User = get_user_model()
 
 @login_required
 def assessment_leaderboard(request, assessment_id):
-    from django.db.models import Sum, Max
-    import json
     from django.shortcuts import get_object_or_404, render
-    from django.contrib.auth import get_user_model
 
     # local model imports to avoid top-level import issues
-    from codingapp.models import (
-        Assessment, AssessmentQuestion, AssessmentSubmission,
-        AssessmentSession, QuizSubmission
-    )
-
-    User = get_user_model()
+    from codingapp.models import Assessment, AssessmentQuestion
 
     assessment = get_object_or_404(Assessment, id=assessment_id)
 
@@ -996,18 +1005,13 @@ def assessment_leaderboard(request, assessment_id):
         if not assessment.groups.filter(id__in=user_groups.values_list('id', flat=True)).exists():
             return render(request, "codingapp/permission_denied.html", status=403)
 
-    # =========================================================
-    # 1. CHANGED: Participants (Filtered strictly by Assigned Group)
-    # =========================================================
-    # This ensures we ONLY get students (not staff) who belong to 
-    # the groups specifically assigned to this assessment.
-    participants = User.objects.filter(
-        custom_groups__in=assessment.groups.all(),
-        is_staff=False
-    ).distinct()
-    # =========================================================
+    # Participants (students of the assigned groups) come from the materialized
+    # AssessmentLeaderboardEntry rows, kept current by the grading tasks (see leaderboard.py)
+    from django.conf import settings
+    from django.core.paginator import Paginator
+    from codingapp.leaderboard import format_time_taken, ranked_entries
 
-    # 2. Questions order
+    # Questions order
     assessment_questions = (
         AssessmentQuestion.objects
         .filter(assessment=assessment)
@@ -1016,253 +1020,47 @@ def assessment_leaderboard(request, assessment_id):
     )
     questions_list = [aq.question for aq in assessment_questions]
 
-    # 3. All submissions for this assessment (select related for fewer queries)
-    all_submissions = AssessmentSubmission.objects.filter(assessment=assessment).select_related('question', 'user')
-
-    # helper: normalize status strings that indicate a passed test
-    def _is_accepted_status(s):
-        if not s:
-            return False
-        s = str(s).strip().lower()
-        return s in ("accepted", "ok", "passed", "success", "true")
-
-    # Precompute question test counts where available
-    question_testcounts = {}
-    for q in questions_list:
-        try:
-            question_testcounts[q.id] = len(q.test_cases or [])
-        except Exception:
-            question_testcounts[q.id] = None
-
-    # Build maps of latest submission per user-question (we'll iterate in time order so later submissions overwrite)
-    user_question_scores = {}  # penalized scores stored in DB (sub.score)
-    user_question_raw = {}     # raw marks inferred or stored (0..5)
-    user_question_extra = {}   # for ai/token/struct similarity per submission (latest)
-
-    # iterate submissions in time order (older -> newer) so later ones overwrite
-    for sub in all_submissions.order_by('submitted_at'):
-        uid = sub.user_id
-        qid = sub.question_id
-
-        # penalized score as stored
-        try:
-            penalized_val = float(sub.score or 0)
-        except Exception:
-            penalized_val = 0.0
-        user_question_scores.setdefault(uid, {})[qid] = penalized_val
-
-        # prefer explicit raw_score if present
-        raw_val = getattr(sub, "raw_score", None)
-        if raw_val is not None:
-            try:
-                raw_numeric = float(raw_val or 0.0)
-            except Exception:
-                raw_numeric = 0.0
-            user_question_raw.setdefault(uid, {})[qid] = raw_numeric
-        else:
-            # try to infer from output JSON/list/dict
-            inferred_raw = 0.0
-            outputs = []
-            try:
-                out_field = sub.output
-                if isinstance(out_field, str):
-                    # try safe json first
-                    try:
-                        parsed = json.loads(out_field)
-                        if isinstance(parsed, list):
-                            outputs = parsed
-                        elif isinstance(parsed, dict):
-                            outputs = [parsed]
-                        else:
-                            outputs = []
-                    except Exception:
-                        # not valid json -> keep empty list (fallback to score)
-                        outputs = []
-                elif isinstance(out_field, list):
-                    outputs = out_field
-                elif isinstance(out_field, dict):
-                    outputs = [out_field]
-                else:
-                    outputs = []
-            except Exception:
-                outputs = []
-
-            # Count passed testcases
-            passed = 0
-            for r in outputs:
-                try:
-                    # Accept either 'status' or 'result' etc.
-                    if isinstance(r, dict):
-                        st = r.get("status") or r.get("result") or r.get("outcome")
-                    else:
-                        st = None
-                    if _is_accepted_status(st):
-                        passed += 1
-                except Exception:
-                    continue
-
-            total_tests = question_testcounts.get(qid)
-            if total_tests is None or total_tests == 0:
-                total_tests = len(outputs) or 1
-
-            # policy: full 5 only if all passed; else 0 (you can switch to proportional easily)
-            if total_tests > 0 and passed == total_tests:
-                inferred_raw = 5.0
-            else:
-                inferred_raw = 0.0
-
-            user_question_raw.setdefault(uid, {})[qid] = float(inferred_raw)
-
-        # store extra similarity metrics if present on submission (latest overwrite)
-        user_question_extra.setdefault(uid, {})[qid] = {
-            'token_similarity': float(getattr(sub, 'token_similarity', 0.0) or 0.0),
-            'structural_similarity': float(getattr(sub, 'structural_similarity', 0.0) or 0.0),
-            'ai_generated_prob': float(getattr(sub, 'ai_generated_prob', 0.0) or 0.0),
-            'plagiarism_percent': float(getattr(sub, 'plagiarism_percent', 0.0) or 0.0),
-        }
-
-    # 4. Total (penalized) coding scores aggregated
-    coding_scores_agg = (
-        all_submissions
-        .values('user__id')
-        .annotate(total_coding_score=Sum('score'))
-    )
-    coding_scores_dict = { item['user__id']: float(item['total_coding_score'] or 0.0) for item in coding_scores_agg }
-
-    # 5. Max plagiarism percent per user (DB aggregate)
-    plag_agg = (
-        all_submissions
-        .values('user__id')
-        .annotate(max_plag=Max('plagiarism_percent'))
-    )
-    plagiarism_dict = { item['user__id']: float(item['max_plag'] or 0.0) for item in plag_agg }
-
-    # 6. Quiz scores (best per user)
-    quiz_scores_dict = {}
-    if getattr(assessment, "quiz", None):
-        # try to gather quiz submissions; be defensive about model shape
-        try:
-            quiz_subs = QuizSubmission.objects.filter(quiz=assessment.quiz).values('user__id', 'score')
-            for item in quiz_subs:
-                uid = item['user__id']
-                sc = float(item['score'] or 0.0)
-                quiz_scores_dict[uid] = max(quiz_scores_dict.get(uid, 0.0), sc)
-        except Exception:
-            # if QuizSubmission not present or relation differs, skip quietly
-            quiz_scores_dict = {}
-
-    # 7. Sessions & time taken
-    sessions = AssessmentSession.objects.filter(
-        assessment=assessment,
-        user__in=participants,
-        end_time__isnull=False,
-    ).select_related('user')
-
-    session_times_dict = {}
-    for session in sessions:
-        if session.start_time and session.end_time:
-            duration = session.end_time - session.start_time
-            total_seconds = int(duration.total_seconds())
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-            time_str = f"{hours}h {minutes}m {seconds}s"
-            session_times_dict[session.user_id] = {
-                'time_str': time_str,
-                'sort_key': total_seconds,
-                'session': session
-            }
-        else:
-            session_times_dict[session.user_id] = {
-                'time_str': "N/A",
-                'sort_key': float('inf'),
-                'session': session
-            }
+    paginator = Paginator(ranked_entries(assessment), getattr(settings, "LEADERBOARD_PAGE_SIZE", 50))
+    page = paginator.get_page(request.GET.get("page"))
 
-    # 8. Build leaderboard rows
     leaderboard_data = []
-    for user in participants:
-        uid = user.id
-        question_pairs = []
-        # Build per-question pairs
-        for q in questions_list:
-            penalized_val = float(user_question_scores.get(uid, {}).get(q.id, 0.0) or 0.0)
-            raw_val = float(user_question_raw.get(uid, {}).get(q.id, 0.0) or 0.0)
-            question_pairs.append({
-                'penalized': penalized_val,
-                'raw': raw_val,
-            })
-
-        total_coding = float(coding_scores_dict.get(uid, 0.0) or 0.0)
-        total_coding_raw = float(sum(item['raw'] for item in question_pairs) or 0.0)
-        quiz_score = float(quiz_scores_dict.get(uid, 0.0) or 0.0)
-        max_plag = round(plagiarism_dict.get(uid, 0.0), 2)
-        raw_total = round(quiz_score + total_coding_raw, 2)
-
-        # Compute per-user maxes for similarity metrics across questions (latest per-sub overwrites)
-        max_token = 0.0
-        max_struct = 0.0
-        max_ai = 0.0
-        for q in questions_list:
-            extra = user_question_extra.get(uid, {}).get(q.id, {})
-            max_token = max(max_token, float(extra.get('token_similarity', 0.0) or 0.0))
-            max_struct = max(max_struct, float(extra.get('structural_similarity', 0.0) or 0.0))
-            max_ai = max(max_ai, float(extra.get('ai_generated_prob', 0.0) or 0.0))
-
-        # Session-level penalty fields if stored
-        session = session_times_dict.get(uid, {}).get('session')
-        if session is not None and hasattr(session, "penalized_total") and session.penalized_total is not None:
-            try:
-                penalized_total = float(session.penalized_total)
-            except Exception:
-                penalized_total = raw_total
-            penalty_factor = float(getattr(session, "penalty_factor", 1.0) or 1.0)
-            penalty_applied = bool(getattr(session, "penalty_applied", penalty_factor < 1.0))
-        else:
-            # compute on-the-fly from max_plag
-            from codingapp.utils import penalty_factor_from_plagiarism
-            try:
-                penalty_factor = penalty_factor_from_plagiarism(max_plag)
-            except Exception:
-                if max_plag <= 35.0:
-                    penalty_factor = 1.0
-                elif max_plag >= 85.0:
-                    penalty_factor = 0.0
-                else:
-                    penalty_factor = round((85.0 - max_plag) / (85.0 - 35.0), 4)
-            penalized_total = round(raw_total * penalty_factor, 2)
-            penalty_applied = (penalty_factor < 1.0)
-
-        total_score_display = penalized_total
-
+    for rank, entry in enumerate(page.object_list, start=page.start_index()):
+        user = entry.user
+        scores = entry.question_scores or {}
+        question_pairs = [
+            {
+                'penalized': float(scores.get(str(q.id), {}).get('penalized', 0.0) or 0.0),
+                'raw': float(scores.get(str(q.id), {}).get('raw', 0.0) or 0.0),
+            }
+            for q in questions_list
+        ]
         leaderboard_data.append({
-            'user_id': uid,
+            'rank': rank,
+            'user_id': user.id,
             'username': user.get_full_name() or user.username,
             'question_pairs': question_pairs,
-            'total_coding_score': total_coding,
-            'total_coding_raw': total_coding_raw,
-            'quiz_score': quiz_score,
-            'raw_total': raw_total,
-            'penalized_total': penalized_total,
-            'penalty_factor': penalty_factor,
-            'penalty_applied': penalty_applied,
-            'total_score': total_score_display,
-            'time_taken_str': session_times_dict.get(uid, {'time_str': "N/A"})['time_str'],
-            'time_taken_seconds': session_times_dict.get(uid, {'sort_key': float('inf')})['sort_key'],
-            'max_plagiarism': max_plag,
+            'total_coding_score': entry.coding_total,
+            'total_coding_raw': entry.coding_raw_total,
+            'quiz_score': entry.quiz_score,
+            'raw_total': entry.raw_total,
+            'penalized_total': entry.penalized_total,
+            'penalty_factor': entry.penalty_factor,
+            'penalty_applied': entry.penalty_applied,
+            'total_score': entry.penalized_total,
+            'time_taken_str': format_time_taken(entry.time_taken_seconds),
+            'time_taken_seconds': entry.time_taken_seconds if entry.time_taken_seconds is not None else float('inf'),
+            'max_plagiarism': entry.max_plagiarism,
             # Convert similarity decimals into percentages for display (keep a few decimals)
-            'token_similarity': round(max_token * 100.0, 4),
-            'structural_similarity': round(max_struct * 100.0, 4),
-            'ai_generated_prob': round(max_ai * 100.0, 4),
+            'token_similarity': round(entry.max_token_similarity * 100.0, 4),
+            'structural_similarity': round(entry.max_structural_similarity * 100.0, 4),
+            'ai_generated_prob': round(entry.max_ai_generated_prob * 100.0, 4),
         })
 
-    # 9. Sort leaderboard
-    leaderboard_data.sort(key=lambda row: (-row['total_score'], row['time_taken_seconds']))
-
     context = {
         'assessment': assessment,
         'questions': questions_list,
         'leaderboard': leaderboard_data,
+        'page_obj': page,
     }
     return render(request, 'codingapp/assessment_leaderboard.html', context) 
 
@@ -1294,6 +1092,7 @@ def assessment_heartbeat(request, assessment_id):
         return JsonResponse({"ok": False, "error": "Session not found"}, status=404)
 
     session.last_heartbeat = timezone.now()
+    ended = False
 
     # Only increment warnings if client reports not in fullscreen
     if not bool(in_fullscreen):
@@ -1303,7 +1102,10 @@ def assessment_heartbeat(request, assessment_id):
             session.flagged = True
             if not session.end_time:
                 session.end_time = timezone.now()
+                ended = True
     session.save()
+    if ended:
+        _finalize_session(session)
 
     return JsonResponse({
         "ok": True,
@@ -1456,6 +1258,8 @@ def submit_assessment_code(request, assessment_id, question_id):
         results = data.get("results", [])
         error_msg = data.get("error", "")
         plagiarism_percent = data.get("plagiarism_percent", 0.0)
+        # the plagiarism check runs after the verdict (tasks.check_assessment_plagiarism)
+        plagiarism_pending = bool(data.get("plagiarism_pending", False))
 
         return JsonResponse(
             {
@@ -1466,6 +1270,7 @@ def submit_assessment_code(request, assessment_id, question_id):
                 "results": results,
                 "error": error_msg,
                 "plagiarism_percent": plagiarism_percent,
+                "plagiarism_pending": plagiarism_pending,
             }
         )
 
@@ -2093,6 +1898,10 @@ def take_quiz(request, quiz_id):
                     score += 1
         submission.score = score
         submission.save()
+        try:
+            refresh_quiz_entries(quiz.id, request.user.id)
+        except Exception:
+            logger.exception("Leaderboard refresh failed for quiz %s", quiz.id)
         # Remove order from session
         del request.session[session_key]
         messages.success(request, f"You scored {score} out of {len(questions)}")
@@ -2856,7 +2665,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.http import JsonResponse
-import json, requests
+import json
 
 @csrf_exempt
 @login_required
@@ -2871,23 +2680,19 @@ def run_code_view(request):
             if not code or not language:
                 return JsonResponse({"error": "Missing code or language."}, status=400)
 
-            payload = {
-                "language": language,
-                "version": "*",
-                "files": [{"name": "main", "content": code}],
-                "stdin": stdin  # ✅ Send custom input
-            }
+            client = get_piston_client()
+            if client is None:
+                return JsonResponse({"error": "Piston API URL not configured."}, status=500)
 
-            response = requests.post(settings.PISTON_API_URL, json=payload, timeout=10)
-            response.raise_for_status()
-            result = response.json()
+            # ✅ Pooled connection, cached runtime version, custom input
+            run = client.run(code, language, stdin=stdin, filename="main")
 
             return JsonResponse({
-                "output": result.get("run", {}).get("stdout", ""),
-                "error": result.get("run", {}).get("stderr", "")
+                "output": run.get("stdout", ""),
+                "error": run.get("stderr", "")
             })
 
-        except requests.exceptions.RequestException as req_err:
+        except PistonError as req_err:
             return JsonResponse({"error": f"Piston API error: {str(req_err)}"}, status=502)
         except Exception as e:
             return JsonResponse({"error": f"Server error: {str(e)}"}, status=500)
@@ -2913,7 +2718,7 @@ from codingapp.utils import (
 
 @login_required
 def student_performance_list(request):
-    from codingapp.utils import get_student_performance
+    from codingapp.utils import get_students_performance
     from codingapp.models import Group, Department
 
     profile = request.user.userprofile
@@ -2928,13 +2733,15 @@ def student_performance_list(request):
             .filter(teachers=request.user)
             .prefetch_related("students")
         )
+        # whole cohort at once: a fixed number of queries however many students
+        performance = get_students_performance({s for g in groups for s in g.students.all()})
 
         data = []
         for group in groups:
             data.append({
                 "group": group,
                 "students": [
-                    get_student_performance(s)
+                    performance[s.pk]
                     for s in group.students.all()
                 ]
             })
@@ -2954,13 +2761,14 @@ def student_performance_list(request):
             .filter(department=profile.department)
             .prefetch_related("students")
         )
+        performance = get_students_performance({s for g in groups for s in g.students.all()})
 
         data = []
         for group in groups:
             data.append({
                 "group": group,
                 "students": [
-                    get_student_performance(s)
+                    performance[s.pk]
                     for s in group.students.all()
                 ]
             })
@@ -2980,6 +2788,9 @@ def student_performance_list(request):
         departments = Department.objects.prefetch_related(
             "groups__students"
         )
+        performance = get_students_performance(
+            {s for dept in departments for g in dept.groups.all() for s in g.students.all()}
+        )
 
         dept_data = []
 
@@ -2990,7 +2801,7 @@ def student_performance_list(request):
                 group_blocks.append({
                     "group": group,
                     "students": [
-                        get_student_performance(student)
+                        performance[student.pk]
                         for student in group.students.all()
                     ]
                 })
@@ -3010,7 +2821,6 @@ def student_performance_list(request):
     return render(request, "codingapp/permission_denied.html", status=403)
 
 
-from django.http import HttpResponse
 from django.contrib.auth.models import User
 from django.db.models import Count
 from .models import Submission, QuizSubmission, Module
@@ -3019,7 +2829,6 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
 from django.db.models import Q
 from codingapp.models import (
     Submission, QuizSubmission, Module, ModuleCompletion,
@@ -3162,7 +2971,6 @@ def sync_student_external_profiles(request, student_id):
 
 
 import csv
-from django.http import HttpResponse
 from django.db.models import Avg
 
 @login_required
@@ -3177,39 +2985,37 @@ def export_student_performance(request):
     if search_query:
         students = students.filter(username__icontains=search_query)
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="student_performance.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(['Username', 'Total Coding Submissions', 'Accepted Submissions', 'Total Quizzes', 'Average Quiz Score'])
-
-    for student in students:
-        coding_submissions = Submission.objects.filter(user=student)
-        quiz_submissions = QuizSubmission.objects.filter(user=student)
-
-        total_coding = coding_submissions.count()
-        accepted_coding = coding_submissions.filter(status='Accepted').count()
-        total_quizzes = quiz_submissions.count()
-        avg_quiz_score = quiz_submissions.aggregate(avg=Avg('score'))['avg'] or 0
+    # One annotated query (a correlated subquery per column) read with a server-side cursor,
+    # streamed as CSV or XLSX (exports.py)
+    from django.db.models import IntegerField, FloatField, OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+    from codingapp.exports import chunk_size, streaming_export
+
+    def per_student(queryset, aggregate, output_field):
+        return Coalesce(
+            Subquery(queryset.filter(user=OuterRef('pk')).order_by().values('user')
+                     .annotate(value=aggregate).values('value')[:1], output_field=output_field),
+            0, output_field=output_field,
+        )
 
-        writer.writerow([
-            student.username,
-            total_coding,
-            accepted_coding,
-            total_quizzes,
-            round(avg_quiz_score, 2)
-        ])
+    students = students.annotate(
+        total_coding=per_student(Submission.objects.all(), Count('id'), IntegerField()),
+        accepted_coding=per_student(Submission.objects.filter(status='Accepted'), Count('id'), IntegerField()),
+        total_quizzes=per_student(QuizSubmission.objects.all(), Count('id'), IntegerField()),
+        avg_quiz_score=per_student(QuizSubmission.objects.all(), Avg('score'), FloatField()),
+    ).order_by('id').values_list('username', 'total_coding', 'accepted_coding', 'total_quizzes', 'avg_quiz_score')
 
-    return response
+    header = ['Username', 'Total Coding Submissions', 'Accepted Submissions', 'Total Quizzes', 'Average Quiz Score']
+    rows = ((username, total_coding, accepted_coding, total_quizzes, round(avg_quiz_score or 0, 2))
+            for username, total_coding, accepted_coding, total_quizzes, avg_quiz_score
+            in students.iterator(chunk_size=chunk_size()))
+    return streaming_export(request, header, rows, "student_performance", title="Student Performance")
 
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
-from difflib import SequenceMatcher
-from django.db.models import Max
 
 from .models import Assessment, AssessmentSession, AssessmentSubmission, QuizSubmission
-from .utils import normalize_code, penalty_factor_from_plagiarism  # ensure these exist
 
 
 @login_required
@@ -3217,119 +3023,29 @@ def assessment_result(request, assessment_id):
     """
     Render final result for the current user's assessment session.
     - Records session end_time if not already set.
-    - Computes per-question and overall plagiarism (using normalized code).
-    - Computes raw totals (quiz + coding raw marks) and applies assessment-level penalty.
-    - Persists penalty info to AssessmentSession if fields exist.
+    - Finalizes the session once (plagiarism_incremental.finalize_session): per-question and
+      overall plagiarism from the stored submission signals, raw totals (quiz + coding raw
+      marks) and the assessment-level penalty, persisted on AssessmentSession.
+      A submission without raw_score counts 5 raw marks if all its test results passed, as in
+      `recompute_plagiarism --apply-assessment-penalties` (this page used to take its penalized score).
+    - Otherwise only reads those fields: no peer code is compared here.
     """
     assessment = get_object_or_404(Assessment, id=assessment_id)
     session = get_object_or_404(AssessmentSession, user=request.user, assessment=assessment)
 
-    # --- Ensure session end_time is recorded once (finalization) ---
+    # --- Ensure session end_time is recorded once, and the result computed once (finalization) ---
     if not session.end_time:
         session.end_time = timezone.now()
-        session.save(update_fields=["end_time"] if hasattr(session, "end_time") else None)
+        session.save(update_fields=["end_time"])
+    if session.finalized_at is None:
+        _finalize_session(session)
 
-    # --- Load user's submissions for this assessment ---
+    # --- Precomputed result (plagiarism_incremental.refresh_session_totals keeps it current) ---
     submissions = AssessmentSubmission.objects.filter(user=request.user, assessment=assessment).select_related("question")
-
-    # Compute coding totals: raw (before per-question penalty) and penalized per-question scores
-    coding_raw_total = 0.0   # sum of raw_score (or score if raw_score missing)
-    coding_penalized_total = 0.0  # sum of stored penalized per-question score (sub.score)
-
-    # ---------- PLAGIARISM: per-question and overall ----------
-    per_question_plag = {}  # question_id -> max similarity %
-    overall_max = 0.0
-
-    # Preload other submissions grouped by question to avoid many DB hits
-    # Build a dict: question_id -> list of other codes (strings)
-    question_ids = {sub.question_id for sub in submissions}
-    others_by_q = {}
-    for qid in question_ids:
-        others = AssessmentSubmission.objects.filter(
-            assessment=assessment, question_id=qid
-        ).exclude(user=request.user).values_list("code", flat=True)
-        # store as list of normalized strings (skip empty)
-        others_by_q[qid] = [normalize_code((c or ""), "") for c in others if (c and c.strip())]
-
-    for sub in submissions:
-        # get raw_score if available, else fallback to score
-        raw = getattr(sub, "raw_score", None)
-        if raw is None:
-            # if raw_score not available, best-effort fallback: if sub.score == 5 assume raw 5 else 0
-            raw = float(sub.score) if (hasattr(sub, "score") and sub.score is not None) else 0.0
-        coding_raw_total += float(raw or 0.0)
-
-        # penalized per-question (score) stored in sub.score
-        coding_penalized_total += float(getattr(sub, "score", 0.0) or 0.0)
-
-        my_code = (sub.code or "").strip()
-        if not my_code:
-            per_question_plag[sub.question_id] = 0.0
-            continue
-
-        norm_my = normalize_code(my_code, "")
-        max_sim = 0.0
-        for o_norm in others_by_q.get(sub.question_id, []):
-            if not o_norm:
-                continue
-            try:
-                sim = SequenceMatcher(None, norm_my, o_norm).ratio()
-                if sim > max_sim:
-                    max_sim = sim
-            except Exception:
-                continue
-
-        pct = round(max_sim * 100, 2)
-        per_question_plag[sub.question_id] = pct
-        if pct > overall_max:
-            overall_max = pct
-
-    # overall average across coding questions (if any)
-    overall_avg = 0.0
-    if per_question_plag:
-        overall_avg = round(sum(per_question_plag.values()) / len(per_question_plag), 2)
-
-    # --- Quiz score (best attempt if multiple) ---
-    quiz_score = 0.0
-    if getattr(assessment, "quiz", None):
-        best_quiz = QuizSubmission.objects.filter(quiz=assessment.quiz, user=request.user).order_by('-score').first()
-        if best_quiz:
-            quiz_score = float(best_quiz.score or 0.0)
-
-    # --- Raw total (quiz + coding raw) and penalized total (after assessment-level penalty) ---
-    raw_total = round(quiz_score + coding_raw_total, 2)
-    # compute assessment-level penalty factor from overall_max (max plagiarism across their coding answers)
-    factor = penalty_factor_from_plagiarism(overall_max)
-    penalized_total = round(raw_total * factor, 2)
-
-    # --- Persist penalty info to session if those fields exist ---
-    session_changed = False
-    if hasattr(session, "penalty_percent"):
-        session.penalty_percent = round(overall_max, 2)
-        session_changed = True
-    if hasattr(session, "penalty_factor"):
-        session.penalty_factor = factor
-        session_changed = True
-    if hasattr(session, "raw_total"):
-        session.raw_total = raw_total
-        session_changed = True
-    if hasattr(session, "penalized_total"):
-        session.penalized_total = penalized_total
-        session_changed = True
-    if hasattr(session, "penalty_applied"):
-        session.penalty_applied = (factor < 1.0)
-        session_changed = True
-
-    if session_changed:
-        # update fields in one save
-        update_fields = []
-        for f in ("penalty_percent", "penalty_factor", "raw_total", "penalized_total", "penalty_applied"):
-            if hasattr(session, f):
-                update_fields.append(f)
-        # always update end_time too
-        if "end_time" not in update_fields and session.end_time:
-            update_fields.append("end_time")
-        session.save(update_fields=update_fields)
+    per_question_plag = {int(qid): pct for qid, pct in (session.plagiarism_per_question or {}).items()}
+    factor = session.penalty_factor if session.penalty_factor is not None else 1.0
+    raw_total = session.raw_total or 0.0
+    penalized_total = session.penalized_total if session.penalized_total is not None else raw_total
 
     # Decide which total to show to user: penalized_total (if penalty applied) else raw_total
     display_total = penalized_total if factor < 1.0 else raw_total
@@ -3341,11 +3057,13 @@ def assessment_result(request, assessment_id):
         'raw_total': raw_total,
         'penalized_total': penalized_total,
         'plag_per_question': per_question_plag,
-        'plag_overall_max': round(overall_max, 2),
-        'plag_overall_avg': overall_avg,
-        'quiz_score': quiz_score,
-        'coding_raw_total': round(coding_raw_total, 2),
-        'coding_penalized_total': round(coding_penalized_total, 2),
+        'plag_overall_max': round(session.penalty_percent or 0.0, 2),
+        'plag_overall_avg': session.plagiarism_avg,
+        # plagiarism checks still queued (tasks.check_assessment_plagiarism) update the result when they finish
+        'plag_pending': any(sub.token_similarity is None for sub in submissions),
+        'quiz_score': session.quiz_score,
+        'coding_raw_total': session.coding_raw_total,
+        'coding_penalized_total': session.coding_penalized_total,
         'penalty_factor': factor,
         'penalty_applied': (factor < 1.0),
     }
@@ -3404,14 +3122,13 @@ def execute_code_api(request, question_id):
 def export_assessment_leaderboard_csv(request, assessment_id):
     assessment = get_object_or_404(Assessment, id=assessment_id)
 
-    # 1. Fetch Participants
+    # 1. Participants
     participant_ids = (
         assessment.groups
         .prefetch_related('students')
         .values_list('students', flat=True)
         .distinct()
     )
-    participants = User.objects.filter(id__in=participant_ids)
 
     # 2. Get Ordered Questions (for columns)
     assessment_questions = (
@@ -3422,113 +3139,37 @@ def export_assessment_leaderboard_csv(request, assessment_id):
     )
     questions_list = [aq.question for aq in assessment_questions]
 
-    # 3. Map Submissions: {user_id: {question_id: score}}
-    all_submissions = AssessmentSubmission.objects.filter(assessment=assessment)
-
-    user_question_scores = {}
-    user_extra_metrics = {}  # 👈 NEW (plagiarism / AI / similarity)
-
-    for sub in all_submissions:
-        # Scores (existing logic)
-        user_question_scores.setdefault(sub.user_id, {})
-        user_question_scores[sub.user_id][sub.question_id] = sub.score
-
-        # 👇 NEW: collect max similarity / plagiarism per user
-        extra = user_extra_metrics.setdefault(sub.user_id, {
-            'plagiarism': 0.0,
-            'ai': 0.0,
-            'token': 0.0,
-            'structural': 0.0,
-        })
-
-        extra['plagiarism'] = max(extra['plagiarism'], float(sub.plagiarism_percent or 0))
-        extra['ai'] = max(extra['ai'], float(sub.ai_generated_prob or 0))
-        extra['token'] = max(extra['token'], float(sub.token_similarity or 0))
-        extra['structural'] = max(extra['structural'], float(sub.structural_similarity or 0))
-
-    # 4. Get Quiz Scores
-    quiz_scores_dict = {}
-    if assessment.quiz:
-        quiz_scores = QuizSubmission.objects.filter(
-            quiz=assessment.quiz
-        ).values('user__id', 'score')
-        quiz_scores_dict = {item['user__id']: item['score'] for item in quiz_scores}
-
-    # 5. Get Session Times
-    sessions = AssessmentSession.objects.filter(
-        assessment=assessment,
-        user__in=participants,
-        end_time__isnull=False
-    )
-
-    session_times_dict = {}
-    for session in sessions:
-        if session.end_time and session.start_time:
-            duration = session.end_time - session.start_time
-            total_seconds = int(duration.total_seconds())
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-            time_str = f"{hours}h {minutes}m {seconds}s"
-            session_times_dict[session.user_id] = {
-                'time_str': time_str,
-                'sort_key': total_seconds
-            }
-        else:
-            session_times_dict[session.user_id] = {
-                'time_str': "N/A",
-                'sort_key': float('inf')
-            }
-
-    # 6. Build Data Rows
-    data_rows = []
-    for user in participants:
-        quiz_score = quiz_scores_dict.get(user.id, 0)
-
-        current_user_scores = user_question_scores.get(user.id, {})
-        coding_total = sum(current_user_scores.values())
-        total_score = quiz_score + coding_total
-
-        time_info = session_times_dict.get(
-            user.id,
-            {'time_str': "N/A", 'sort_key': float('inf')}
-        )
-
-        # Only include active participants
-        if total_score > 0 or time_info['sort_key'] != float('inf'):
-            extra = user_extra_metrics.get(user.id, {})
-
-            data_rows.append({
-                'username': user.username,
-                'quiz_score': quiz_score,
-                'question_scores': [
-                    current_user_scores.get(q.id, 0) for q in questions_list
-                ],
-                'coding_total': coding_total,
-                'total_score': total_score,
-                'time_str': time_info['time_str'],
-                'sort_key': time_info['sort_key'],
-
-                # 👇 NEW FIELDS
-                'plagiarism': extra.get('plagiarism', 0.0),
-                'ai': extra.get('ai', 0.0),
-                'token': extra.get('token', 0.0),
-                'structural': extra.get('structural', 0.0),
-            })
-
-    # 7. Sort by Score then Time
-    data_rows.sort(key=lambda x: (-x['total_score'], x['sort_key']))
-
-    # 8. Write CSV
-    response = HttpResponse(content_type='text/csv')
-    filename = slugify(assessment.title)
-    response['Content-Disposition'] = (
-        f'attachment; filename="{filename}_leaderboard.csv"'
+    # 3. Scores, maxima and time taken: the materialized leaderboard rows (leaderboard.py) of every
+    #    group member (staff too, unlike the leaderboard page) with their latest quiz attempt,
+    #    active participants only, by grand total then time
+    from django.db.models import F, FloatField, OuterRef, Subquery, Value
+    from django.db.models.functions import Cast, Coalesce
+    from codingapp.exports import chunk_size, streaming_export
+    from codingapp.leaderboard import ensure_entries, format_time_taken
+    from codingapp.models import AssessmentLeaderboardEntry
+
+    ensure_entries(assessment, User.objects.filter(id__in=participant_ids))
+    last_quiz = Value(0.0)
+    if assessment.quiz_id:
+        last_quiz = Coalesce(Cast(Subquery(
+            QuizSubmission.objects
+            .filter(quiz_id=assessment.quiz_id, user_id=OuterRef('user_id'))
+            .order_by('-submitted_at', '-id')
+            .values('score')[:1]
+        ), FloatField()), Value(0.0))
+    entries = (
+        AssessmentLeaderboardEntry.objects
+        .filter(assessment=assessment, user_id__in=participant_ids)
+        .annotate(last_quiz=last_quiz)
+        .annotate(grand_total=F('last_quiz') + F('coding_total'))
+        .filter(Q(grand_total__gt=0) | Q(time_taken_seconds__isnull=False))
+        .order_by('-grand_total', F('time_taken_seconds').asc(nulls_last=True), 'user_id')
+        .values_list('user__username', 'last_quiz', 'question_scores', 'coding_total', 'grand_total',
+                     'max_plagiarism', 'max_ai_generated_prob', 'max_token_similarity',
+                     'max_structural_similarity', 'time_taken_seconds')
     )
 
-    writer = csv.writer(response)
-
-    # Header Row
+    # 4. Header Row
     header = ['Rank', 'Username']
     if assessment.quiz:
         header.append('Quiz Score')
@@ -3546,30 +3187,30 @@ def export_assessment_leaderboard_csv(request, assessment_id):
         'Structural Similarity %',
         'Time Taken'
     ])
-    writer.writerow(header)
-
-    # Data Rows
-    for rank, entry in enumerate(data_rows, 1):
-        row = [rank, entry['username']]
-
-        if assessment.quiz:
-            row.append(entry['quiz_score'])
-
-        row.extend(entry['question_scores'])
-
-        row.extend([
-            entry['coding_total'],
-            entry['total_score'],
-            round(entry['plagiarism'], 2),
-            round(entry['ai'] * 100, 2),
-            round(entry['token'] * 100, 2),
-            round(entry['structural'] * 100, 2),
-            entry['time_str'],
-        ])
-
-        writer.writerow(row)
 
-    return response
+    # 5. Data Rows, streamed from a server-side cursor (exports.py)
+    question_keys = [str(q.id) for q in questions_list]
+
+    def rows():
+        for rank, (username, quiz_score, scores, coding_total, grand_total, plagiarism, ai, token, structural,
+                   seconds) in enumerate(entries.iterator(chunk_size=chunk_size()), 1):
+            scores = scores or {}
+            row = [rank, username]
+            if assessment.quiz:
+                row.append(int(quiz_score) if float(quiz_score).is_integer() else quiz_score)
+            row.extend(scores[key]['penalized'] if key in scores else 0 for key in question_keys)
+            row.extend([
+                coding_total,
+                grand_total,
+                round(plagiarism, 2),
+                round(ai * 100, 2),
+                round(token * 100, 2),
+                round(structural * 100, 2),
+                format_time_taken(seconds),
+            ])
+            yield row
+
+    return streaming_export(request, header, rows(), f"{slugify(assessment.title)}_leaderboard", title="Leaderboard")
 
 
 # 👇 ADD THIS ENTIRE NEW VIEW FUNCTION
@@ -1,6 +1,7 @@
 # codingplatform/celery.py
 import os
 from celery import Celery
+from celery.signals import worker_process_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'codingplatform.settings')
@@ -14,6 +15,19 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks in all installed apps (like codingapp/tasks.py)
 app.autodiscover_tasks()
 
+
+@worker_process_init.connect
+def warm_piston_client(**kwargs):
+    """Resolve Piston runtime versions once per worker process, before the first submission."""
+    try:
+        from codingapp.piston_client import get_piston_client
+        client = get_piston_client()
+        if client is not None:
+            client.warm()
+    except Exception:
+        pass
+
+
 @app.task(bind=True)
 def debug_task(self):
     """Debug task for initial setup validation."""
@@ -38,6 +38,7 @@ if RENDER_EXTERNAL_HOSTNAME:
     ALLOWED_HOSTS.append(RENDER_EXTERNAL_HOSTNAME)
 
 INSTALLED_APPS = [
+    'daphne',  # ASGI runserver (WebSockets); must precede django.contrib.staticfiles
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'codingapp',
     "widget_tweaks",
+    'channels',
 ]
 
 
@@ -83,6 +85,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'codingplatform.wsgi.application'
+# HTTP + WebSockets (live leaderboards); serve with `daphne codingplatform.asgi:application`
+ASGI_APPLICATION = 'codingplatform.asgi.application'
 
 
 DATABASES = {
@@ -127,6 +131,12 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 PISTON_API_TIMEOUT = 10
+# Pooled Piston client (see codingapp/piston_client.py)
+PISTON_POOL_SIZE = int(os.environ.get('PISTON_POOL_SIZE', 8))
+PISTON_MAX_RETRIES = 2
+PISTON_CIRCUIT_FAILURE_THRESHOLD = 5
+PISTON_CIRCUIT_RESET_TIMEOUT = 30
+PISTON_RUNTIMES_TTL = 3600
 
 LOGGING = {
     'version': 1,
@@ -157,6 +167,71 @@ CELERY_TASK_STORE_ERRORS_EVEN_IF_IGNORED = True
 CELERY_RESULT_EXTENDED = True
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# ----------------
+# JUDGE CONFIGURATION
+# ----------------
+# Warm Python worker processes per Celery process (see codingapp/judge_pool.py)
+JUDGE_POOL_ENABLED = os.environ.get('JUDGE_POOL_ENABLED', 'True').lower() == 'true'
+JUDGE_POOL_SIZE = int(os.environ.get('JUDGE_POOL_SIZE', 2))
+JUDGE_POOL_MAX_RUNS_PER_WORKER = 500
+# Test cases of one submission judged concurrently, and the wall-clock budget (seconds) per submission
+JUDGE_MAX_PARALLEL_TESTS = int(os.environ.get('JUDGE_MAX_PARALLEL_TESTS', JUDGE_POOL_SIZE))
+JUDGE_TOTAL_TIMEOUT = 30
+# Practice only needs Accepted/Rejected: skip remaining tests after the first failure
+PRACTICE_STOP_ON_FIRST_FAILURE = os.environ.get('PRACTICE_STOP_ON_FIRST_FAILURE', 'False').lower() == 'true'
+# Judge result cache keyed by (code, test cases, language): "locmem", "django", "redis" or "" to disable.
+# locmem is per Celery process; use redis to share results (and hit/miss counters) across workers.
+JUDGE_RESULT_CACHE_BACKEND = os.environ.get('JUDGE_RESULT_CACHE_BACKEND', 'locmem')
+JUDGE_RESULT_CACHE_REDIS_URL = os.environ.get('JUDGE_RESULT_CACHE_REDIS_URL', os.environ.get('REDIS_URL', 'redis://127.0.0.1:6380/1'))
+JUDGE_RESULT_CACHE_TTL = 24 * 3600
+JUDGE_RESULT_CACHE_MAX_ENTRIES = 2048
+# Per-test (code, stdin) output cache, LRU by size; 0 disables (see codingapp/output_cache.py)
+JUDGE_OUTPUT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Languages compiled once and judged on the worker itself (when gcc/g++/javac/node is installed);
+# the rest, and languages whose toolchain is missing, go to Piston. See codingapp/native_runner.py
+JUDGE_NATIVE_LANGUAGES = ["c", "cpp", "java", "javascript"]
+JUDGE_ARTIFACT_DIR = os.environ.get('JUDGE_ARTIFACT_DIR', '')
+JUDGE_ARTIFACT_CACHE_MAX_ENTRIES = 256
+
+# ----------------
+# PLAGIARISM
+# ----------------
+# Submissions are compared with every peer of the question when there are at most this many;
+# above that only with the MinHash/LSH candidates (see codingapp/fingerprint_index.py)
+PLAGIARISM_EXHAUSTIVE_BELOW = 50
+# Upper bound on peers that get the structural comparison, most token-similar first
+PLAGIARISM_MAX_CANDIDATES = 500
+# recompute_plagiarism --resume: question groups completed by earlier runs
+PLAGIARISM_RECOMPUTE_STATE_FILE = os.environ.get('PLAGIARISM_RECOMPUTE_STATE_FILE', os.path.join(BASE_DIR, '.recompute_plagiarism_state.json'))
+# Code embeddings (codingapp/embeddings.py): rows per compute_submission_embeddings run and
+# per-process cache of (assessment, question) nearest-neighbour indexes
+EMBEDDING_BATCH_SIZE = 200
+EMBEDDING_INDEX_CACHE_SIZE = 64
+# Assessment grading returns the verdict first; plagiarism signals, the penalty and embeddings are
+# computed afterwards on this low-priority queue. Workers must consume it too, e.g.
+# `celery -A codingplatform worker -Q celery,plagiarism` (or a separate `-Q plagiarism` worker).
+PLAGIARISM_QUEUE = os.environ.get('PLAGIARISM_QUEUE', 'plagiarism')
+CELERY_TASK_ROUTES = {
+    'codingapp.tasks.check_assessment_plagiarism': {'queue': PLAGIARISM_QUEUE},
+    'codingapp.tasks.compute_submission_embeddings': {'queue': PLAGIARISM_QUEUE},
+}
+# Participants per page of the assessment leaderboard (read from AssessmentLeaderboardEntry)
+LEADERBOARD_PAGE_SIZE = 50
+# Rows fetched per server-side cursor round trip by the streaming CSV/XLSX exports (codingapp/exports.py)
+EXPORT_CHUNK_SIZE = 2000
+# Live leaderboard deltas (codingapp/leaderboard_live.py). The in-memory channel layer only reaches
+# dashboards served by the same process (Celery workers then drop their deltas); set
+# CHANNEL_LAYERS_REDIS_URL so every process shares groups, which also selects the "redis" rank index.
+CHANNEL_LAYERS_REDIS_URL = os.environ.get('CHANNEL_LAYERS_REDIS_URL')
+if CHANNEL_LAYERS_REDIS_URL:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                                  'CONFIG': {'hosts': [CHANNEL_LAYERS_REDIS_URL]}}}
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+LEADERBOARD_RANKS_BACKEND = os.environ.get('LEADERBOARD_RANKS_BACKEND', 'locmem')
+LEADERBOARD_RANKS_REDIS_URL = (os.environ.get('LEADERBOARD_RANKS_REDIS_URL') or CHANNEL_LAYERS_REDIS_URL
+                               or os.environ.get('REDIS_URL', 'redis://127.0.0.1:6380/2'))
+
 # ================= EMAIL CONFIG (GMAIL) =================
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
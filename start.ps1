@@ -19,7 +19,7 @@ if (-not $container) {
 
 # --- 2. Start the Celery Worker in a new terminal window ---
 echo "Starting Celery worker in a new window..."
-Start-Process powershell -ArgumentList "-NoExit", "-Command", "celery -A codingplatform worker -l info --pool=solo"
+Start-Process powershell -ArgumentList "-NoExit", "-Command", "celery -A codingplatform worker -Q celery,plagiarism -l info --pool=solo"
 
 # --- 3. Start the Django Server in the current window ---
 echo "Starting Django development server..."